@@ -2,7 +2,18 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from mptt.admin import MPTTModelAdmin
 
-from .models import Inventory, Organization, PPEType, User
+from .cache import bump_data_version
+from .models import (
+    CurrentInventory,
+    Inventory,
+    InventoryArchive,
+    InventoryDailyRollup,
+    InventoryDailySummary,
+    InventoryForecast,
+    Organization,
+    PPEType,
+    User,
+)
 
 
 @admin.register(User)
@@ -19,6 +30,19 @@ class OrganizationAdmin(MPTTModelAdmin):
     list_filter = ("is_provider",)
     search_fields = ("name",)
 
+    # Moving an organization changes which tree its providers' inventory shows up in, so the dashboards of both the
+    # tree it leaves and the one it joins are marked as changed.
+    def save_model(self, request, obj, form, change):
+        old = Organization.objects.get(pk=obj.pk) if change else None
+        super().save_model(request, obj, form, change)
+        if old is not None:
+            bump_data_version(old)
+        bump_data_version(obj)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_data_version(obj)
+
 
 @admin.register(PPEType)
 class PPETypeAdmin(admin.ModelAdmin):
@@ -41,3 +65,118 @@ class InventoryAdmin(admin.ModelAdmin):
         "organization",
         "ppetype",
     )
+
+    # Edits made here bypass the inventory tracking forms, so the current inventory, daily rollups and forecasts they
+    # touch are recomputed and the cached dashboards of their organizations are marked as changed.
+    def save_model(self, request, obj, form, change):
+        old = [Inventory.objects.get(pk=obj.pk)] if change else []
+        super().save_model(request, obj, form, change)
+        self._inventory_changed(old + [obj])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self._inventory_changed([obj])
+
+    def delete_queryset(self, request, queryset):
+        deleted = list(queryset.select_related("ppetype", "user", "organization"))
+        super().delete_queryset(request, queryset)
+        self._inventory_changed(deleted)
+
+    @staticmethod
+    def _inventory_changed(inventories):
+        CurrentInventory.objects.refresh(inventories)
+        InventoryDailyRollup.objects.refresh(inventories)
+        InventoryForecast.objects.compute({inv.organization_id for inv in inventories})
+        trees = {inv.organization.tree_id: inv.organization for inv in inventories}
+        for organization in trees.values():
+            bump_data_version(organization)
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    """An admin that only shows its model's rows, for the tables that are kept up to date from inventory rather than
+    edited."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(InventoryArchive)
+class InventoryArchiveAdmin(ReadOnlyAdmin):
+    list_display = (
+        "organization",
+        "ppetype",
+        "number",
+        "item_number",
+        "daily_use",
+        "projected_daily_use",
+        "projected_run_out",
+        "timestamp",
+    )
+    # Archived inventory is history that the daily rollups have already counted, so it is only shown here.
+    list_filter = ("item_type",)
+
+
+@admin.register(InventoryDailySummary)
+class InventoryDailySummaryAdmin(ReadOnlyAdmin):
+    list_display = (
+        "organization",
+        "ppetype",
+        "day",
+        "entries",
+        "number",
+        "total_number",
+        "projected_run_out",
+        "timestamp",
+    )
+    # Like archived inventory, compacted inventory is only shown here.
+    list_filter = ("item_type",)
+
+
+@admin.register(InventoryDailyRollup)
+class InventoryDailyRollupAdmin(ReadOnlyAdmin):
+    # The rollups, current inventory and forecasts are derived from inventory, and recomputed as it is edited in its
+    # own admin above, so they are only shown here.
+    list_display = (
+        "organization",
+        "item_type",
+        "day",
+        "number",
+        "projected_daily_use",
+        "projected_run_out",
+        "latest_timestamp",
+    )
+    list_filter = ("item_type",)
+
+
+@admin.register(CurrentInventory)
+class CurrentInventoryAdmin(ReadOnlyAdmin):
+    list_display = (
+        "organization",
+        "ppetype",
+        "number",
+        "daily_use",
+        "projected_daily_use",
+        "projected_run_out",
+        "timestamp",
+    )
+    list_filter = ("item_type",)
+
+
+@admin.register(InventoryForecast)
+class InventoryForecastAdmin(ReadOnlyAdmin):
+    list_display = (
+        "organization",
+        "ppetype",
+        "stock",
+        "daily_consumption",
+        "days_remaining",
+        "run_out",
+        "computed_at",
+    )
+    list_filter = ("ppetype",)
@@ -0,0 +1,21 @@
+from django.contrib.auth import backends
+
+from .models import User
+
+
+def load_request_user(user_id):
+    """Returns the user with the given id together with their organization, loaded in one query, or None if there is
+    no such user.
+
+    The user isn't cached, so a password change or deactivation takes effect on their very next request. Nothing else
+    is read up front: Organization.get_provider_ids() checks the organizations version only when it is called."""
+    return User._default_manager.select_related("organization").filter(pk=user_id).first()
+
+
+class ModelBackend(backends.ModelBackend):
+    """Django's ModelBackend, except that the user of each request is loaded by load_request_user(), so that the
+    middleware, decorators and views that look at their organization don't each add a query of their own."""
+
+    def get_user(self, user_id):
+        user = load_request_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
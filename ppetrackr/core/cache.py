@@ -0,0 +1,189 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db.models import F
+
+# How long a callback waits for another callback that is already computing the value it needs before giving up and
+# computing it itself.
+LOCK_TIMEOUT = 10
+
+
+ORGANIZATIONS_VERSION_KEY = "ppetrackr:organizations-version"
+
+
+def _get_version(key):
+    # Imported here because the models bump versions from their signals.
+    from .models import DataVersion
+
+    version = DataVersion.objects.filter(key=key).values_list("version", flat=True).first()
+    if version is None:
+        # Start from the clock rather than 1, so that results cached under the versions of a database that has since
+        # been reset are never handed out again.
+        version = DataVersion.objects.get_or_create(
+            key=key, defaults={"version": int(time.time() * 1000)}
+        )[0].version
+    return version
+
+
+def _bump_version(key):
+    from .models import DataVersion
+
+    if not DataVersion.objects.filter(key=key).update(version=F("version") + 1):
+        _get_version(key)
+
+
+def _data_version_key(organization):
+    return "ppetrackr:data-version:{}".format(organization.tree_id)
+
+
+def get_data_version(organization):
+    """Returns the version of the inventory data in an organization's tree (the organization, its parents and all of
+    their providers). It changes whenever inventory is submitted anywhere in the tree, so it can be put in cache keys
+    to make cached results go stale as soon as there is new data."""
+    return _get_version(_data_version_key(organization))
+
+
+def bump_data_version(organization):
+    """Marks the inventory data in an organization's tree as changed."""
+    _bump_version(_data_version_key(organization))
+
+
+def get_organizations_version():
+    """Returns the version of the organization trees. It changes whenever any organization is added, moved, changed
+    or deleted, which is rare enough that one version is kept for all of the trees."""
+    return _get_version(ORGANIZATIONS_VERSION_KEY)
+
+
+def bump_organizations_version():
+    _bump_version(ORGANIZATIONS_VERSION_KEY)
+
+
+def get_versions(organization):
+    """Returns the data version of an organization's tree and the organizations version, read in one query. A request
+    that needs both reads them once and passes them on, rather than reading them wherever they are used."""
+    from .models import DataVersion
+
+    keys = [_data_version_key(organization), ORGANIZATIONS_VERSION_KEY]
+    versions = dict(DataVersion.objects.filter(key__in=keys).values_list("key", "version"))
+    return tuple(versions[key] if key in versions else _get_version(key) for key in keys)
+
+
+def make_key(prefix, *parts):
+    """Builds a cache key from any number of parts, hashing them so the key stays short whatever they hold."""
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return "ppetrackr:{}:{}".format(prefix, digest)
+
+
+def get_or_compute(key, compute, timeout):
+    """Returns the cached value for a key, computing and caching it if it is missing. When several requests miss at
+    once, only one of them computes the value and the others wait for it. ``compute`` must not return None."""
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = key + ":lock"
+    locked = cache.add(lock_key, True, timeout=LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = cache.get(key)
+            if value is not None:
+                return value
+    try:
+        value = compute()
+        cache.set(key, value, timeout)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
+
+
+class ResultCache:
+    """A cache for rendered dashboard results (figures and table rows), kept in the DASHBOARD_CACHE_ALIAS cache.
+
+    Callers put the data version in their keys, so a result is reused until new inventory arrives in its organization
+    tree and is then simply never asked for again; the backend's LRU eviction clears it out eventually. Hits and misses
+    are counted in the same cache, so that every process sharing it reports the same numbers."""
+
+    COUNTER_KEY = "ppetrackr:result-cache:{}"
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_or_compute(self, key, compute):
+        value = self.cache.get(key)
+        if value is not None:
+            self._count("hits")
+            return value
+        self._count("misses")
+        value = compute()
+        self.cache.set(key, value, settings.DASHBOARD_CACHE_TIMEOUT)
+        return value
+
+    def stats(self):
+        counters = self.cache.get_many(
+            [self.COUNTER_KEY.format(name) for name in ("hits", "misses")]
+        )
+        hits = counters.get(self.COUNTER_KEY.format("hits"), 0)
+        misses = counters.get(self.COUNTER_KEY.format("misses"), 0)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else None,
+        }
+
+    def _count(self, name):
+        key = self.COUNTER_KEY.format(name)
+        if not self.cache.add(key, 1, timeout=None):
+            try:
+                self.cache.incr(key)
+            except ValueError:  # Evicted between the add and the incr.
+                self.cache.add(key, 1, timeout=None)
+
+
+result_cache = ResultCache(settings.DASHBOARD_CACHE_ALIAS)
+
+
+class LRUFileBasedCache(FileBasedCache):
+    """Django's file based cache, except that when it is full it evicts the least recently used entries rather than
+    random ones. Reads bump a file's modification time, which is what the eviction goes by."""
+
+    _missing = object()
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, self._missing, version)
+        if value is self._missing:
+            return default
+        try:
+            os.utime(self._key_to_file(key, version))
+        except OSError:
+            pass
+        return value
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries < self._max_entries:
+            return  # return early if no culling is required
+        if self._cull_frequency == 0:
+            return self.clear()  # Clear the cache when CULL_FREQUENCY = 0
+
+        def last_used(fname):
+            try:
+                return os.path.getmtime(fname)
+            except OSError:
+                return 0
+
+        filelist.sort(key=last_used)
+        for fname in filelist[: int(num_entries / self._cull_frequency)]:
+            self._delete(fname)
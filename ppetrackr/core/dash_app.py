@@ -1,19 +1,52 @@
-from collections import defaultdict
-from datetime import MINYEAR, date
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
 
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
 import plotly.graph_objects as go
-from dash.dependencies import Input, Output
-from django.db.models import Max, Q, Sum, Case, When, Value, CharField
+from dash.dependencies import Input, Output, State
+from django.conf import settings
+from django.db.models import (
+    BooleanField,
+    Case,
+    CharField,
+    ExpressionWrapper,
+    F,
+    IntegerField,
+    Max,
+    Q,
+    Sum,
+    Value,
+    When,
+)
+from django.utils.dateparse import parse_date
 from django.utils import timezone
 from django_plotly_dash import DjangoDash
 
-from .models import Inventory, PPEType
+from .cache import (
+    get_or_compute,
+    get_organizations_version,
+    get_versions,
+    make_key,
+    result_cache,
+)
+from .downsampling import lttb
+from .partitions import add_months
+from .retention import raw_history_start
+from .models import (
+    CurrentInventory,
+    Inventory,
+    InventoryDailyRollup,
+    InventoryForecast,
+    Organization,
+    PPEType,
+    q_for_ids,
+)
 
 
-def tabs_wrapper(n, title, vis_type):
+def tabs_wrapper(n, title, vis_type, children=None):
     return dcc.Tab(
         label=title,
         id=f"tab{n}",
@@ -23,13 +56,69 @@ def tabs_wrapper(n, title, vis_type):
                 id=f"loading{n}",
                 type="default",
                 children=[
-                    html.Div(className="p-2 w-100 m-auto", id=f"tab{n}-{vis_type}")
+                    html.Div(
+                        className="p-2 w-100 m-auto",
+                        id=f"tab{n}-{vis_type}",
+                        children=children,
+                    )
                 ],
             )
         ],
     )
 
 
+TABLE_COLUMNS = [
+    {"name": "Organization", "id": "organization__name"},
+    {"name": "Item Category", "id": "readable_ppe_type"},
+    {"name": "Attribute", "id": "ppetype__item_attribute"},
+    {"name": "Size", "id": "ppetype__size"},
+    {"name": "Quantity", "id": "number", "type": "numeric"},
+    {"name": "Daily Use", "id": "daily_use", "type": "numeric"},
+    {"name": "Projected Daily Use", "id": "projected_daily_use", "type": "numeric"},
+    {"name": "Projected Run-Out Date", "id": "projected_run_out", "type": "datetime"},
+    {"name": "Date Submitted", "id": "timestamp__date", "type": "datetime"},
+    {"name": "Comments", "id": "comments"},
+]
+
+TABLE_PAGE_SIZE = 25
+
+# The most organizations the org-selector offers at once. The rest are found by typing in it.
+ORG_SELECTOR_MAX_OPTIONS = 50
+
+# The table is paged on the server, so no request asks for more than this many rows at once.
+TABLE_MAX_PAGE_SIZE = 100
+
+# The field each column is sorted and filtered by. The item category is the same in every row, so it is neither.
+TABLE_SORT_FIELDS = {
+    "organization__name": "organization__name",
+    "ppetype__item_attribute": "ppetype__item_attribute",
+    "ppetype__size": "ppetype__size",
+    "number": "number",
+    "daily_use": "daily_use",
+    "projected_daily_use": "projected_daily_use",
+    "projected_run_out": "projected_run_out",
+    "timestamp__date": "timestamp",
+    "comments": "comments",
+}
+
+TABLE_FILTER_OPERATORS = [
+    ("ge ", "gte"),
+    (">=", "gte"),
+    ("le ", "lte"),
+    ("<=", "lte"),
+    ("lt ", "lt"),
+    ("<", "lt"),
+    ("gt ", "gt"),
+    (">", "gt"),
+    ("ne ", "ne"),
+    ("!=", "ne"),
+    ("eq ", "exact"),
+    ("=", "exact"),
+    ("contains ", "icontains"),
+    ("datestartswith ", "startswith"),
+]
+
+
 app = DjangoDash("SimpleExample")
 
 app.layout = html.Div(
@@ -104,6 +193,16 @@ app.layout = html.Div(
                                     href="/dashboard/download?format=csv",
                                     className="dropdown-item"
                                 ),
+                                html.A(
+                                    "Download Data (Parquet)",
+                                    href="/dashboard/download?format=parquet",
+                                    className="dropdown-item"
+                                ),
+                                html.A(
+                                    "Download Data (Arrow)",
+                                    href="/dashboard/download?format=arrow",
+                                    className="dropdown-item"
+                                ),
                             ]
                         )
                     ]
@@ -116,10 +215,64 @@ app.layout = html.Div(
             style={"font-family": "Arial, Helvetica, sans-serif"},
             className="m-2",
             children=[
-                tabs_wrapper(1, "Table", "table"),
-                tabs_wrapper(2, "Current Inventory", "graph"),
-                tabs_wrapper(3, "Projected Daily Use", "graph"),
-                tabs_wrapper(4, "Projected Days of Inventory Remaining", "graph"),
+                tabs_wrapper(
+                    1,
+                    "Table",
+                    "table",
+                    children=[
+                        dash_table.DataTable(
+                            id="supply-table",
+                            columns=TABLE_COLUMNS,
+                            data=[],
+                            page_action="custom",
+                            page_current=0,
+                            page_size=TABLE_PAGE_SIZE,
+                            page_count=0,
+                            sort_action="custom",
+                            sort_mode="single",
+                            sort_by=[],
+                            filter_action="custom",
+                            filter_query="",
+                            style_as_list_view=True,
+                            style_header={
+                                "backgroundColor": "white",
+                                "fontWeight": "bold",
+                                "color": "black",
+                            },
+                            style_table={
+                                "maxHeight": "450px",
+                                "overflowY": "scroll",
+                                "border": "thin lightgrey solid",
+                            },
+                            style_cell={"padding": "0.5rem", "font-family": "sans-serif"},
+                        ),
+                        html.P(
+                            "The table lists inventory as it was submitted, which is kept for the last {} days. "
+                            "Download the data for all of it, with older days summarised by their last entry.".format(
+                                settings.INVENTORY_RAW_RETENTION_DAYS
+                            ),
+                            className="text-muted small mt-2",
+                        ),
+                    ],
+                ),
+                tabs_wrapper(
+                    2,
+                    "Current Inventory",
+                    "graph",
+                    children=dcc.Graph(id="tab2-figure"),  # TODO: Resize, label, and stylize
+                ),
+                tabs_wrapper(
+                    3,
+                    "Projected Daily Use",
+                    "graph",
+                    children=dcc.Graph(id="tab3-figure"),
+                ),
+                tabs_wrapper(
+                    4,
+                    "Projected Days of Inventory Remaining",
+                    "graph",
+                    children=dcc.Graph(id="tab4-figure"),
+                ),
             ],
         ),
     ],
@@ -131,45 +284,37 @@ def parse_field_name(data, field_name):
         y = [entry[field_name] for entry in data]
     else:
         y = []
-        today = timezone.now().date()
+        today = timezone.localdate()
         for entry in data:
             run_out_date = entry[field_name]
             if run_out_date:
-                time_diff = run_out_date - today
-                y.append(time_diff.days + time_diff.seconds / 3600)
+                y.append((run_out_date - today).days)
             else:
                 y.append(0)
     return y
 
 
 def label_axis(field_name):
-    if "projected_run_out" in field_name:
+    if "projected_run_out" in field_name or "days_remaining" in field_name:
         return "Number of Days"
     return "Number of Items"
 
 
 def provider_view(data, field_name):
     figure = go.Figure()
-    str_format = "%a, %Y-%m-%d"
-    x = [entry["timestamp"].strftime(str_format) for entry in data]
+    # The line and its markers are one trace, so the days and values are only sent once.
     figure.add_trace(
         go.Scatter(
-            x=x,
+            x=[entry["day"].isoformat() for entry in data],
             y=parse_field_name(data, field_name),
-            mode="lines",
+            mode="lines+markers",
             line=dict(color="LightSkyBlue", width=4),
-        )
-    )
-    figure.add_trace(
-        go.Scatter(
-            x=x,
-            y=parse_field_name(data, field_name),
-            mode="markers",
             marker=dict(
                 color="LightSkyBlue", size=15, line=dict(color="White", width=3)
             ),
         )
     )
+    figure.update_xaxes(type="date", tickformat="%a, %Y-%m-%d")
     return figure
 
 
@@ -177,7 +322,7 @@ def admin_view(data, field_name):
     figure = go.Figure()
     str_format = "%a, %Y-%m-%d"
     x = [
-        f"{entry['organization__name']}<br>{entry['timestamp__max'].strftime(str_format)}"
+        f"{entry['organization__name']}<br>{entry['latest_day'].strftime(str_format)}"
         for entry in data
     ]
     figure.add_trace(
@@ -193,252 +338,526 @@ def create_figure(data, field_name, is_provider):
     return admin_view(data, field_name)
 
 
-def callback_wrapper(selected_dropdown_label, orgs_selected, user, field_name):
-    if user.organization.is_provider:
-        # get the data
-        pre_data = Inventory.objects.filter(
-            organization=user.organization, ppetype__item_type=selected_dropdown_label,
-        ).values("timestamp", field_name)
-
-        # aggregate via sum using dictionary, unique keys as dates
-        new_data = defaultdict(int)
-        for i in pre_data:
-            try:
-                new_data[i["timestamp"].astimezone(tz=user.timezone).date()] += i[
-                    field_name
-                ]
-            except TypeError:
-                pass  # If grabs data points from a blank field, it just ignores the blank entry and moves on
-
-        # reformat back into acceptable data format
-        agg_data = [
-            {"timestamp": key, field_name: value} for key, value in new_data.items()
-        ]
+def get_providers(user, versions, orgs_selected):
+    """Returns the sorted ids of the providers whose inventory the user is looking at."""
+    return user.organization.get_provider_ids(
+        selected=orgs_selected, organizations_version=versions[1]
+    )
 
-        agg_data.sort(key=lambda x: x["timestamp"])
 
-        figure = create_figure(agg_data, field_name, is_provider=True)
-    else:
-        if orgs_selected is None:
-            providers = user.organization.get_descendants().filter(is_provider=True)
-        else:
-            providers = (
-                user.organization.get_descendants()
-                .filter(name__in=orgs_selected)
-                .values("id")
+def get_interaction_data(user, versions, selected_dropdown_label, orgs_selected):
+    """Returns the providers, and the points of the charts behind the dashboard, for one choice of PPE type and
+    organizations: a provider's daily rollups, or for a parent organization its providers' current inventory.
+
+    A change to either dropdown fires every tab's callback at once, so this is cached briefly per user and shared
+    between them: only the first callback to get here queries the database, and the others wait for its result. The
+    cache key includes the versions read by get_versions(), so new inventory is never hidden by it."""
+
+    def load():
+        providers = get_providers(user, versions, orgs_selected)
+        fields = ["number", "projected_daily_use", "projected_run_out"]
+        if user.organization.is_provider:
+            # The daily totals are kept up to date in the rollups as inventory is submitted
+            rollups = (
+                InventoryDailyRollup.objects.filter(
+                    q_for_ids("organization", providers),
+                    item_type=selected_dropdown_label,
+                )
+                .order_by("day")
+                .values("day", *fields)
+            )
+            return {"providers": providers, "chart_data": list(rollups)}
+
+        # Each provider's current inventory, totalled over the PPE types it has
+        current = (
+            CurrentInventory.objects.filter(
+                q_for_ids("organization", providers), item_type=selected_dropdown_label
             )
-        max_data = (
-            Inventory.objects.filter(
-                organization__in=providers, ppetype__item_type=selected_dropdown_label
+            .values("organization", "organization__name")
+            .annotate(
+                Sum("number"),
+                Sum("projected_daily_use"),
+                Max("projected_run_out"),
+                Max("timestamp"),
             )
-            .values("organization")
-            .annotate(Max("timestamp"))
             .order_by("organization")
         )
+        chart_data = [
+            {
+                "organization__name": row["organization__name"],
+                "number": row["number__sum"],
+                "projected_daily_use": row["projected_daily_use__sum"] or 0,
+                "projected_run_out": row["projected_run_out__max"],
+                "latest_day": timezone.localtime(
+                    row["timestamp__max"], user.timezone
+                ).date(),
+            }
+            for row in current
+        ]
+        return {"providers": providers, "chart_data": chart_data}
+
+    key = make_key(
+        "dashboard-interaction",
+        user.pk,
+        selected_dropdown_label,
+        sorted(orgs_selected) if orgs_selected is not None else None,
+        *versions,
+    )
+    return get_or_compute(key, load, settings.DASHBOARD_INTERACTION_CACHE_TIMEOUT)
+
+
+def result_key(name, user, versions, selected_dropdown_label, orgs_selected, *extra):
+    """Builds the result cache key for what one callback renders for a user's organization. It includes the versions
+    read by get_versions(), so results are recomputed as soon as new inventory is submitted in the organization's
+    tree."""
+    return make_key(
+        name,
+        user.organization.pk,
+        selected_dropdown_label,
+        sorted(orgs_selected) if orgs_selected is not None else None,
+        *versions,
+        *extra,
+    )
 
-        if max_data.count():
-            q_statement = Q()
-            for max_row in max_data:
-                q_statement = q_statement | (
-                    Q(organization=max_row["organization"])
-                    & Q(
-                        timestamp__date=max_row["timestamp__max"]
-                        .astimezone(tz=user.timezone)
-                        .date()
-                    )
-                )
-            data = (
-                Inventory.objects.filter(ppetype__item_type=selected_dropdown_label)
-                .filter(q_statement)
-                .values("organization__name",)
-                .annotate(Max("timestamp"))
-                .annotate(Sum(field_name))
+
+def parse_zoom_range(relayout_data):
+    """Returns the (first day, last day) a chart's x axis is zoomed to, or None if it shows everything."""
+    if not relayout_data:
+        return None
+    if "xaxis.range[0]" in relayout_data:
+        start, end = relayout_data["xaxis.range[0]"], relayout_data.get("xaxis.range[1]")
+    elif "xaxis.range" in relayout_data:
+        start, end = relayout_data["xaxis.range"]
+    else:
+        return None
+    try:
+        start, end = parse_date(str(start)[:10]), parse_date(str(end)[:10])
+    except ValueError:
+        return None
+    if start is None or end is None:
+        return None
+    return start, end
+
+
+def downsample(data, field_name, zoom_range):
+    """Cuts a provider's daily history down to the days in the zoom range (and one either side, so the line runs off
+    the edges of the chart), then to at most DASHBOARD_CHART_POINTS of them. However long the history, the chart
+    never holds more points than that, and zooming in brings back the detail."""
+    if zoom_range:
+        days = [entry["day"] for entry in data]
+        start = max(bisect_left(days, zoom_range[0]) - 1, 0)
+        end = bisect_right(days, zoom_range[1]) + 1
+        data = data[start:end]
+    indices = lttb(
+        [entry["day"].toordinal() for entry in data],
+        parse_field_name(data, field_name),
+        settings.DASHBOARD_CHART_POINTS,
+    )
+    return [data[i] for i in indices]
+
+
+def callback_wrapper(
+    selected_dropdown_label,
+    orgs_selected,
+    user,
+    field_name,
+    relayout_data,
+    current_figure,
+    margin_top=20,
+):
+    # The zoom is kept by Plotly for as long as the figure's uirevision stays the same, which is until the PPE type or
+    # organizations change. A zoom left over from a previous choice doesn't apply to the new one.
+    uirevision = "{}|{}".format(
+        selected_dropdown_label,
+        sorted(orgs_selected) if orgs_selected is not None else None,
+    )
+    current_uirevision = ((current_figure or {}).get("layout") or {}).get("uirevision")
+    zoom_range = None
+    if user.organization.is_provider and current_uirevision == uirevision:
+        zoom_range = parse_zoom_range(relayout_data)
+    # Read once, for both the result cache key and the interaction data behind it.
+    versions = get_versions(user.organization)
+
+    def render():
+        data = get_interaction_data(user, versions, selected_dropdown_label, orgs_selected)
+        chart_data = data["chart_data"]
+        if user.organization.is_provider:
+            chart_data = downsample(chart_data, field_name, zoom_range)
+        figure = create_figure(
+            chart_data, field_name, is_provider=user.organization.is_provider
+        )
+        figure.update_layout(
+            yaxis_title=label_axis(field_name),
+            margin=dict(l=20, r=20, t=margin_top, b=20),
+            showlegend=False,
+            plot_bgcolor="rgba(207, 238, 252, 0.3)",
+            font=dict(family="Arial, Helvetica, sans-serif", size=13),
+            uirevision=uirevision,
+        )
+        return figure.to_plotly_json()
+
+    key = result_key(
+        "dashboard-figure",
+        user,
+        versions,
+        selected_dropdown_label,
+        orgs_selected,
+        field_name,
+        margin_top,
+        zoom_range,
+    )
+    return result_cache.get_or_compute(key, render)
+
+
+def split_filter_part(filter_part):
+    """Splits one clause of a DataTable filter query, like ``{number} > 100``, into (column id, lookup, value).
+    Returns None for clauses it does not understand."""
+    for operator, lookup in TABLE_FILTER_OPERATORS:
+        if operator not in filter_part:
+            continue
+        name_part, value_part = filter_part.split(operator, 1)
+        name_part = name_part.strip()
+        if not (name_part.startswith("{") and name_part.endswith("}")):
+            return None
+        value = value_part.strip()
+        if value and value[0] == value[-1] and value[0] in ("'", '"', "`"):
+            value = value[1:-1].replace("\\" + value[0], value[0])
+        return name_part[1:-1], lookup, value
+    return None
+
+
+def filter_condition(column_id, lookup, value):
+    """Returns the Q object for one filter clause, or None if the column cannot be filtered that way."""
+    field = TABLE_SORT_FIELDS.get(column_id)
+    if field is None:
+        return None
+    column_type = next(col.get("type") for col in TABLE_COLUMNS if col["id"] == column_id)
+    if column_type == "numeric":
+        try:
+            value = int(value)
+        except ValueError:
+            return None
+        if lookup in ("icontains", "startswith"):
+            lookup = "exact"
+    elif column_type == "datetime":
+        if lookup in ("icontains", "startswith"):
+            # Dates are matched on a year, a year and month, or a full date.
+            parts = value.split("-")
+            try:
+                parts = [int(part) for part in parts[:3]]
+            except ValueError:
+                return None
+            if column_id == "timestamp__date":
+                try:
+                    start = date(*(parts + [1, 1])[:3])
+                    if len(parts) == 1:
+                        end = start.replace(year=start.year + 1)
+                    elif len(parts) == 2:
+                        end = add_months(start, 1)
+                    else:
+                        end = start + timedelta(days=1)
+                except (OverflowError, ValueError):
+                    return None
+                return submitted_condition("exact", start, end)
+            names = ["year", "month", "day"]
+            return Q(
+                **{f"{field}__{names[i]}": part for i, part in enumerate(parts)}
             )
-            field_name = field_name + "__sum"
-        else:
-            # If we don't get any data in the above query, we need to render an empty graph
-            data = Inventory.objects.none()
-        figure = create_figure(data, field_name, is_provider=False)
-    figure.update_layout(
-        yaxis_title=label_axis(field_name),
-        margin=dict(l=20, r=20, t=20, b=20),
-        showlegend=False,
-        plot_bgcolor="rgba(207, 238, 252, 0.3)",
-        font=dict(family="Arial, Helvetica, sans-serif", size=13),
+        value = parse_date(value)
+        if value is None:
+            return None
+        if column_id == "timestamp__date":
+            return submitted_condition(lookup, value, value + timedelta(days=1))
+    if lookup == "ne":
+        return ~Q(**{field: value})
+    return Q(**{f"{field}__{lookup}": value})
+
+
+def submitted_condition(lookup, start, end):
+    """Returns the filter for entries submitted (on a day in the current timezone) relative to the days from ``start``
+    up to ``end``, as a range of timestamps. Unlike a lookup on the date, a range can be narrowed down by the indexes
+    and the monthly partitions."""
+    start, end = [
+        timezone.make_aware(datetime.combine(day, time.min), is_dst=False)
+        for day in (start, end)
+    ]
+    during = Q(timestamp__gte=start, timestamp__lt=end)
+    return {
+        "exact": during,
+        "ne": ~during,
+        "gt": Q(timestamp__gte=end),
+        "gte": Q(timestamp__gte=start),
+        "lt": Q(timestamp__lt=start),
+        "lte": Q(timestamp__lt=end),
+    }[lookup]
+
+
+def apply_filter_query(queryset, filter_query):
+    for filter_part in (filter_query or "").split(" && "):
+        clause = split_filter_part(filter_part)
+        if clause is None:
+            continue
+        condition = filter_condition(*clause)
+        if condition is not None:
+            queryset = queryset.filter(condition)
+    return queryset
+
+
+def get_table_queryset(user, versions, selected_dropdown_label, orgs_selected):
+    """Returns the inventory listed in the dashboard table: the entries since raw_history_start(), as the note under
+    the table says. Older inventory is archived or compacted and left to the exports, and bounding the timestamp keeps
+    the table's queries off it even before it is."""
+    inventories = Inventory.objects.filter(
+        item_type=selected_dropdown_label, timestamp__gte=raw_history_start()
     )
-    return dcc.Graph(figure=figure)  # TODO: Resize, label, and stylize
+    if not user.organization:
+        return inventories.filter(user=user)
+    providers = get_interaction_data(
+        user, versions, selected_dropdown_label, orgs_selected
+    )["providers"]
+    return inventories.filter(q_for_ids("organization", providers))
 
 
 @app.expanded_callback(
-    Output("tab1-table", "children"),
-    [Input("supply-picker", "value"), Input("org-selector", "value")],
+    [
+        Output("supply-table", "data"),
+        Output("supply-table", "style_data_conditional"),
+        Output("supply-table", "page_count"),
+    ],
+    [
+        Input("supply-picker", "value"),
+        Input("org-selector", "value"),
+        Input("supply-table", "page_current"),
+        Input("supply-table", "sort_by"),
+        Input("supply-table", "filter_query"),
+    ],
+    [State("supply-table", "page_size")],
 )
-def update_table(selected_dropdown_label, orgs_selected, **kwargs):
-    columns = [
-        {"name": "Organization", "id": "organization__name"},
-        {"name": "Item Category", "id": "readable_ppe_type"},
-        {"name": "Attribute", "id": "ppetype__item_attribute"},
-        {"name": "Size", "id": "ppetype__size"},
-        {"name": "Quantity", "id": "number"},
-        {"name": "Daily Use", "id": "daily_use"},
-        {"name": "Projected Daily Use", "id": "projected_daily_use"},
-        {"name": "Projected Run-Out Date", "id": "projected_run_out"},
-        {"name": "Date Submitted", "id": "timestamp__date"},
-        {"name": "Comments", "id": "comments"},
-    ]
-    column_identifiers = [col["id"] for col in columns]
+def update_table(
+    selected_dropdown_label,
+    orgs_selected,
+    page_current,
+    sort_by,
+    filter_query,
+    page_size,
+    **kwargs,
+):
+    """Fetches one page of the inventory table. Sorting, filtering and paging are all done by the database, so only
+    the rows on screen are ever read or sent."""
     user = kwargs["user"]
-    if not user.organization:
-        data = Inventory.objects.filter(
-            user=user, ppetype__item_type=selected_dropdown_label
-        )
-    elif user.organization.is_provider:
-        data = Inventory.objects.filter(
-            organization=user.organization, ppetype__item_type=selected_dropdown_label
+    page_size = min(max(page_size or TABLE_PAGE_SIZE, 1), TABLE_MAX_PAGE_SIZE)
+    ordering = ["-timestamp", "-id"]
+    for sort in sort_by or []:
+        field = TABLE_SORT_FIELDS.get(sort["column_id"])
+        if field:
+            ordering = [
+                field if sort["direction"] == "asc" else "-" + field,
+                "-timestamp",
+                "-id",
+            ]
+    versions = get_versions(user.organization) if user.organization else None
+
+    def render():
+        queryset = apply_filter_query(
+            get_table_queryset(user, versions, selected_dropdown_label, orgs_selected),
+            filter_query,
         )
-    else:
-        if orgs_selected is None:
-            providers = user.organization.get_descendants().filter(is_provider=True)
-        else:
-            providers = (
-                user.organization.get_descendants()
-                .filter(name__in=orgs_selected)
-                .values("id")
-            )
-        data = Inventory.objects.filter(
-            organization__in=providers, ppetype__item_type=selected_dropdown_label
-        ).select_related("ppetype")
-
-    data = list(
-        data.annotate(
-            readable_ppe_type=Case(
-                *[
-                    When(ppetype__item_type=ppetype, then=Value(full_name))
-                    for (ppetype, full_name) in PPEType.PPE_CHOICES
-                ],
-                default=Value("ppetype__item_type"),
-                output_field=CharField(),
+        page_count = max((queryset.count() - 1) // page_size + 1, 1)
+        page = min(page_current or 0, page_count - 1)
+        offset = page * page_size
+
+        # Rows whose projected daily use is more than 50% above their daily use are highlighted.
+        rows = list(
+            queryset.annotate(
+                readable_ppe_type=Case(
+                    *[
+                        When(item_type=item_type, then=Value(full_name))
+                        for (item_type, full_name) in PPEType.PPE_CHOICES
+                    ],
+                    default=Value("item_type"),
+                    output_field=CharField(),
+                ),
+                projection_margin=ExpressionWrapper(
+                    F("projected_daily_use") * 2 - F("daily_use") * 3,
+                    output_field=IntegerField(),
+                ),
+                over_projected=Case(
+                    When(daily_use__gt=0, projection_margin__gt=0, then=Value(True)),
+                    default=Value(False),
+                    output_field=BooleanField(),
+                ),
             )
-        ).values(*column_identifiers)
-    )
+            .order_by(*ordering)
+            .values(*[col["id"] for col in TABLE_COLUMNS], "over_projected")[
+                offset : offset + page_size
+            ]
+        )
 
-    style_data_conditional = []
-    for index, row in enumerate(data[::-1]):
-        try:
-            if (row.get("projected_daily_use", 0) - row.get("daily_use", 0)) / row.get(
-                "daily_use", 1
-            ) > 0.5:
-                style_data_conditional.append(
-                    {
-                        "if": {"row_index": index},
-                        "backgroundColor": "#FF6848",
-                        "color": "white",
-                    }
-                )
-        except (TypeError, ZeroDivisionError):
-            pass
-
-    table = dash_table.DataTable(
-        id="supply-table",
-        columns=columns,
-        data=data[::-1],
-        style_as_list_view=True,
-        style_header={
-            "backgroundColor": "white",
-            "fontWeight": "bold",
-            "color": "black",
-        },
-        style_table={
-            "maxHeight": "450px",
-            "overflowY": "scroll",
-            "border": "thin lightgrey solid",
-        },
-        style_cell={"padding": "0.5rem", "font-family": "sans-serif"},
-        style_cell_conditional=style_data_conditional,
-    )
-    return table
+        style_data_conditional = [
+            {"if": {"row_index": index}, "backgroundColor": "#FF6848", "color": "white"}
+            for index, row in enumerate(rows)
+            if row.pop("over_projected")
+        ]
+        return rows, style_data_conditional, page_count
+
+    if user.organization:
+        # Submission dates are shown in the user's timezone, so the timezone is part of the key.
+        key = result_key(
+            "dashboard-table",
+            user,
+            versions,
+            selected_dropdown_label,
+            orgs_selected,
+            str(user.timezone),
+            page_current,
+            page_size,
+            ordering,
+            filter_query,
+        )
+        return result_cache.get_or_compute(key, render)
+    return render()
 
 
 @app.expanded_callback(
-    Output("tab2-graph", "children"),
-    [Input("supply-picker", "value"), Input("org-selector", "value")],
+    Output("tab2-figure", "figure"),
+    [
+        Input("supply-picker", "value"),
+        Input("org-selector", "value"),
+        Input("tab2-figure", "relayoutData"),
+    ],
+    [State("tab2-figure", "figure")],
 )
-def update_current_inventory(selected_dropdown_label, orgs_selected, **kwargs):
+def update_current_inventory(
+    selected_dropdown_label, orgs_selected, relayout_data, figure, **kwargs
+):
     return callback_wrapper(
-        selected_dropdown_label, orgs_selected, kwargs["user"], "number"
+        selected_dropdown_label,
+        orgs_selected,
+        kwargs["user"],
+        "number",
+        relayout_data,
+        figure,
     )
 
 
 @app.expanded_callback(
-    Output("tab3-graph", "children"),
-    [Input("supply-picker", "value"), Input("org-selector", "value")],
+    Output("tab3-figure", "figure"),
+    [
+        Input("supply-picker", "value"),
+        Input("org-selector", "value"),
+        Input("tab3-figure", "relayoutData"),
+    ],
+    [State("tab3-figure", "figure")],
 )
-def update_projected_inventory(selected_dropdown_label, orgs_selected, **kwargs):
+def update_projected_inventory(
+    selected_dropdown_label, orgs_selected, relayout_data, figure, **kwargs
+):
     return callback_wrapper(
-        selected_dropdown_label, orgs_selected, kwargs["user"], "projected_daily_use"
+        selected_dropdown_label,
+        orgs_selected,
+        kwargs["user"],
+        "projected_daily_use",
+        relayout_data,
+        figure,
     )
 
 
-@app.expanded_callback(
-    Output("tab4-graph", "children"),
-    [Input("supply-picker", "value"), Input("org-selector", "value")],
-)
-def update_remaining_inventory(selected_dropdown_label, orgs_selected, **kwargs):
-    user = kwargs["user"]
-    field_name = "projected_run_out"
+def get_forecasts(user, versions, selected_dropdown_label, orgs_selected):
+    """Returns the days-remaining forecasts for the tab 4 chart: one per PPE type (attribute and size) for a provider,
+    and for a parent one per provider, from the total stock and consumption of its PPE types. The stored forecasts are
+    as of each provider's latest count, so the stock used up since then is taken off first."""
+    providers = get_providers(user, versions, orgs_selected)
+    forecasts = InventoryForecast.objects.filter(
+        q_for_ids("organization", providers),
+        ppetype__item_type=selected_dropdown_label,
+        daily_consumption__gt=0,
+    ).values(
+        "organization__name",
+        "ppetype__item_attribute",
+        "ppetype__size",
+        "stock",
+        "daily_consumption",
+        "latest_timestamp",
+    )
+    now = timezone.now()
 
-    if user.organization.is_provider:
-        # get the data
-        pre_data = Inventory.objects.filter(
-            organization=user.organization, ppetype__item_type=selected_dropdown_label,
-        ).values("timestamp", field_name)
-
-        # aggregate using longest remaining date via a dictionary, unique keys as dates
-        new_data = defaultdict(lambda: date(MINYEAR, 1, 1))
-        for i in pre_data:
-            try:
-                temp = new_data[i["timestamp"].astimezone(tz=user.timezone).date()]
-                new_data[i["timestamp"].astimezone(tz=user.timezone).date()] = (
-                    i[field_name] if temp < i[field_name] else temp
-                )
-            except TypeError:
-                pass  # If grabs data points from a blank field, it just ignores the blank entry and moves on
+    def stock_left(entry):
+        days = max((now - entry["latest_timestamp"]).total_seconds() / (24 * 60 * 60), 0)
+        return max(entry["stock"] - entry["daily_consumption"] * days, 0)
 
-        # reformat back into acceptable data format
-        agg_data = [
-            {"timestamp": key, field_name: value} for key, value in new_data.items()
+    if user.organization.is_provider:
+        return [
+            {
+                "ppetype__item_attribute": entry["ppetype__item_attribute"],
+                "ppetype__size": entry["ppetype__size"],
+                "days_remaining": stock_left(entry) / entry["daily_consumption"],
+            }
+            for entry in forecasts.order_by("ppetype__item_attribute", "ppetype__size")
         ]
+    totals = {}
+    for entry in forecasts.order_by("organization__name"):
+        stock, consumption = totals.get(entry["organization__name"], (0, 0))
+        totals[entry["organization__name"]] = (
+            stock + stock_left(entry),
+            consumption + entry["daily_consumption"],
+        )
+    return [
+        {"organization__name": name, "days_remaining": stock / consumption}
+        for name, (stock, consumption) in totals.items()
+    ]
 
-        agg_data.sort(key=lambda x: x["timestamp"])
 
-        figure = create_figure(agg_data, field_name, is_provider=True)
+def forecast_figure(forecasts, is_provider):
+    if is_provider:
+        x = [
+            f"{entry['ppetype__item_attribute']}<br>{entry['ppetype__size']}"
+            for entry in forecasts
+        ]
     else:
-        if orgs_selected is None:
-            providers = user.organization.get_descendants().filter(is_provider=True)
-        else:
-            providers = (
-                user.organization.get_descendants()
-                .filter(name__in=orgs_selected)
-                .values("id")
-            )
-        data = (
-            Inventory.objects.filter(
-                organization__in=providers, ppetype__item_type=selected_dropdown_label
-            )
-            .values("organization__name")
-            .annotate(Max(field_name))
-            .annotate(Max("timestamp"))
+        x = [entry["organization__name"] for entry in forecasts]
+    figure = go.Figure()
+    figure.add_trace(
+        go.Bar(
+            x=x,
+            y=[round(entry["days_remaining"], 1) for entry in forecasts],
+            marker_color="LightSkyBlue",
         )
-        field_name = field_name + "__max"
-        figure = create_figure(data, field_name, is_provider=False)
-    figure.update_layout(
-        yaxis_title=label_axis(field_name),
-        margin=dict(l=20, r=20, t=40, b=20),
-        showlegend=False,
-        plot_bgcolor="rgba(207, 238, 252, 0.3)",
-        font=dict(family="Arial, Helvetica, sans-serif", size=13),
     )
-    return dcc.Graph(figure=figure)  # TODO: Resize, label, and stylize
+    return figure
+
+
+@app.expanded_callback(
+    Output("tab4-figure", "figure"),
+    [Input("supply-picker", "value"), Input("org-selector", "value")],
+)
+def update_remaining_inventory(selected_dropdown_label, orgs_selected, **kwargs):
+    """Charts how many days each PPE type (for a provider) or provider (for a parent) has left at the rate it has
+    been using them up, as forecast by InventoryForecast.objects.compute()."""
+    user = kwargs["user"]
+    versions = get_versions(user.organization)
+
+    def render():
+        forecasts = get_forecasts(user, versions, selected_dropdown_label, orgs_selected)
+        figure = forecast_figure(forecasts, is_provider=user.organization.is_provider)
+        figure.update_layout(
+            yaxis_title=label_axis("days_remaining"),
+            margin=dict(l=20, r=20, t=40, b=20),
+            showlegend=False,
+            plot_bgcolor="rgba(207, 238, 252, 0.3)",
+            font=dict(family="Arial, Helvetica, sans-serif", size=13),
+        )
+        return figure.to_plotly_json()
+
+    # The days remaining count down without new inventory, so a chart is only reused within the hour.
+    key = result_key(
+        "dashboard-forecast",
+        user,
+        versions,
+        selected_dropdown_label,
+        orgs_selected,
+        timezone.now().replace(minute=0, second=0, microsecond=0),
+    )
+    return result_cache.get_or_compute(key, render)
 
 
 @app.expanded_callback(
@@ -464,14 +883,76 @@ def update_org_selector(selected_dropdown_label, **kwargs):
     return {"display": "none"}
 
 
+def get_org_selector_options(organization, organizations_version):
+    """Returns the options for a parent organization's org-selector, one per provider, sorted by name.
+
+    They are cached per parent and keyed on the organizations version, so they are rebuilt as soon as any
+    organization is added, moved or renamed."""
+    provider_ids = organization.get_provider_ids(organizations_version=organizations_version)
+
+    def load():
+        return [
+            {"label": name, "value": pk}
+            for pk, name in Organization.objects.filter(q_for_ids("pk", provider_ids))
+            .order_by("name")
+            .values_list("id", "name")
+        ]
+
+    key = make_key("org-selector-options", organization.pk, organizations_version)
+    return get_or_compute(key, load, settings.ORG_SELECTOR_CACHE_TIMEOUT)
+
+
+@lru_cache(maxsize=256)
+def get_org_prefix_index(organization_id, organizations_version):
+    """Builds the in-memory type-ahead index of a parent organization's providers: a sorted list of (lowercased name
+    suffix starting at a word, option index) pairs, so that a search matches the start of any word in a name. The
+    organizations version is part of the arguments, so a provider joining, leaving or being renamed gets a fresh
+    index."""
+    options = get_org_selector_options(
+        Organization.objects.get(pk=organization_id), organizations_version
+    )
+    entries = []
+    for index, option in enumerate(options):
+        name = option["label"].lower()
+        for position, char in enumerate(name):
+            if position == 0 or (name[position - 1] == " " and char != " "):
+                entries.append((name[position:], index))
+    entries.sort()
+    return [entry[0] for entry in entries], [entry[1] for entry in entries], options
+
+
+def search_org_selector_options(organization, organizations_version, search_value):
+    """Returns at most ORG_SELECTOR_MAX_OPTIONS options whose names have a word starting with the search value."""
+    keys, indexes, options = get_org_prefix_index(organization.pk, organizations_version)
+    if not search_value:
+        return options[:ORG_SELECTOR_MAX_OPTIONS]
+    prefix = search_value.lower()
+    start = bisect_left(keys, prefix)
+    end = bisect_left(keys, prefix + "\uffff", lo=start)
+    matches = sorted(set(indexes[start:end]))[:ORG_SELECTOR_MAX_OPTIONS]
+    return [options[index] for index in matches]
+
+
 @app.expanded_callback(
-    Output("org-selector", "options"), [Input("org-selector", "value")]
+    Output("org-selector", "options"),
+    [Input("org-selector", "search_value")],
+    [State("org-selector", "value")],
 )
-def update_org_selector_options(selected_dropdown_label, **kwargs):
+def update_org_selector_options(search_value, orgs_selected, **kwargs):
+    """Offers the providers matching what is typed in the selector, rather than sending every provider up front."""
     user = kwargs["user"]
-    return [
-        {"label": i["name"], "value": i["name"]}
-        for i in list(
-            user.organization.get_descendants().filter(is_provider=True).values("name")
-        )
-    ]
+    if not user.organization or user.organization.is_provider:
+        return []
+    organizations_version = get_organizations_version()
+    options = search_org_selector_options(user.organization, organizations_version, search_value)
+    # The organizations already selected must stay among the options, or the dropdown can't show them.
+    if orgs_selected:
+        shown = {option["value"] for option in options}
+        missing = [pk for pk in orgs_selected if pk not in shown]
+        if missing:
+            options = options + [
+                option
+                for option in get_org_selector_options(user.organization, organizations_version)
+                if option["value"] in missing
+            ]
+    return options
@@ -1,6 +1,10 @@
+from base64 import b64decode
+from binascii import Error as BinasciiError
 from functools import wraps
 
 from django.contrib import messages
+from django.contrib.auth import authenticate
+from django.http import JsonResponse
 from django.shortcuts import redirect
 
 
@@ -16,7 +20,6 @@ def onboard_required(func):
 
     @wraps(func)
     def wrapper(request, *args, **kwargs):
-        print(request.user.is_onboarded)
         if not request.user.is_onboarded:
             messages.error(
                 request, "Please complete your onboarding steps to continue forward.",
@@ -46,3 +49,41 @@ def onboard_pending(func):
         return func(request, *args, **kwargs)
 
     return wrapper
+
+
+def basic_auth_required(func):
+    """
+    Decorator for API views called by other systems rather than people,
+    which authenticates the user from HTTP Basic credentials instead of
+    a session, and requires them to have onboarded. Unauthenticated
+    requests get a 401 asking for credentials.
+
+    Requests aren't authenticated by the session cookie, so views using
+    this can safely be csrf_exempt.
+    """
+
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        user = None
+        method, _, credentials = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+        if method.lower() == "basic":
+            try:
+                username, _, password = (
+                    b64decode(credentials.strip()).decode().partition(":")
+                )
+            except (BinasciiError, UnicodeDecodeError):
+                pass
+            else:
+                user = authenticate(request, username=username, password=password)
+        if user is None or not user.is_active:
+            response = JsonResponse({"error": "Authentication required."}, status=401)
+            response["WWW-Authenticate"] = 'Basic realm="PPETrackr", charset="UTF-8"'
+            return response
+        if not user.is_onboarded:
+            return JsonResponse(
+                {"error": "Please complete your onboarding steps first."}, status=403
+            )
+        request.user = user
+        return func(request, *args, **kwargs)
+
+    return wrapper
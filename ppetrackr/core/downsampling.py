@@ -0,0 +1,33 @@
+def lttb(x, y, threshold):
+    """Picks the indices of at most ``threshold`` points of a time series that keep its visual shape, using the
+    Largest-Triangle-Three-Buckets algorithm (Steinarsson, 2013). ``x`` must be increasing numbers.
+
+    The first and last points are always kept. The points in between are split into ``threshold - 2`` buckets, and
+    from each one the point forming the largest triangle with the point kept from the previous bucket and the average
+    of the next bucket is kept, so peaks and dips survive where plain decimation would skip them."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    indices = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        next_start, next_end = end, min(int((i + 2) * bucket_size) + 1, n)
+        avg_x = sum(x[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(y[next_start:next_end]) / (next_end - next_start)
+
+        best, best_area = start, -1
+        for j in range(start, end):
+            area = abs(
+                (x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a])
+            )
+            if area > best_area:
+                best, best_area = j, area
+        indices.append(best)
+        a = best
+    indices.append(n - 1)
+    return indices
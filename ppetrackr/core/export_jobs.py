@@ -0,0 +1,187 @@
+"""Background export jobs.
+
+Exports are built by a small pool of worker threads into EXPORT_CACHE_DIR. Each finished file is named after its job
+id, which is made of the organization, the data version of its tree, the organizations version and the format. Every
+write to inventory (submissions, the ingest API, bulk imports, admin edits) bumps the data version, and any change to
+the organizations (a provider joining the tree, say) bumps the organizations version, so as long as neither changes,
+repeated downloads are served straight from the cached file. The directory is shared by all worker processes on an
+instance, so the job state lives on disk:
+
+    <job id>          the finished export
+    <job id>.part     an export being built (its mtime, touched as rows are written, tells stale builds from live ones)
+    <job id>.error    an export that failed, holding the error message
+"""
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+from .cache import get_data_version, get_organizations_version
+from .exports import EXPORT_CONTENT_TYPES, write_export
+from .models import Organization
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_RE = re.compile(
+    r"^(?P<organization>\d+)-(?P<version>\d+-\d+)\.(?P<format>[a-z]+)$"
+)
+
+READY = "ready"
+RUNNING = "running"
+FAILED = "failed"
+MISSING = "missing"
+
+_executor = ThreadPoolExecutor(max_workers=settings.EXPORT_WORKERS)
+_eviction_lock = threading.Lock()
+
+
+def get_export_version(organization):
+    """Returns the version of an organization's export: its tree's data version and the organizations version."""
+    return "{}-{}".format(get_data_version(organization), get_organizations_version())
+
+
+def parse_job_id(job_id):
+    """Returns (organization id, export version, format) for a valid job id, otherwise None."""
+    match = JOB_ID_RE.match(job_id)
+    if not match or match.group("format") not in EXPORT_CONTENT_TYPES:
+        return None
+    return (
+        int(match.group("organization")),
+        match.group("version"),
+        match.group("format"),
+    )
+
+
+def artifact_path(job_id):
+    return os.path.join(settings.EXPORT_CACHE_DIR, job_id)
+
+
+def get_job_status(job_id):
+    path = artifact_path(job_id)
+    if os.path.exists(path):
+        return READY
+    if os.path.exists(path + ".error"):
+        return FAILED
+    try:
+        if time.time() - os.path.getmtime(path + ".part") < settings.EXPORT_JOB_TIMEOUT:
+            return RUNNING
+    except OSError:
+        pass
+    return MISSING
+
+
+def get_job_error(job_id):
+    try:
+        with open(artifact_path(job_id) + ".error") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def start_export(organization, file_format):
+    """Returns the job id for an organization's current export, queueing a build if it is not cached or already being
+    built. Failed builds are retried."""
+    job_id = "{}-{}.{}".format(
+        organization.pk, get_export_version(organization), file_format
+    )
+    status = get_job_status(job_id)
+    if status in (READY, RUNNING):
+        return job_id
+
+    os.makedirs(settings.EXPORT_CACHE_DIR, exist_ok=True)
+    path = artifact_path(job_id)
+    if status == FAILED:
+        _remove(path + ".error")
+    # A .part file left by a build that died with its worker is cleared away. Another process may have claimed the
+    # build since the status was read, so the file is only removed if it is still stale now.
+    _remove_stale_part(path + ".part")
+    try:
+        # Claim the build. If another process has claimed it, its build is left to run.
+        os.close(os.open(path + ".part", os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return job_id
+    _executor.submit(_build, job_id)
+    return job_id
+
+
+def open_artifact(job_id):
+    """Opens a finished export for reading, marking it as recently used."""
+    path = artifact_path(job_id)
+    os.utime(path)
+    return open(path, "rb")
+
+
+def _build(job_id):
+    organization_id, version, file_format = parse_job_id(job_id)
+    path = artifact_path(job_id)
+    try:
+        organization = Organization.objects.get(pk=organization_id)
+        with open(path + ".part", "wb") as output:
+            # The export is read after the versions in its job id, so it holds at least what they stand for. Some
+            # formats (XLSX) only write to the file as they finish, so the .part file is touched as rows are read.
+            write_export(
+                organization,
+                file_format,
+                output,
+                on_progress=lambda: os.utime(path + ".part"),
+            )
+        os.replace(path + ".part", path)
+    except Exception as e:
+        logger.exception("Export %s failed", job_id)
+        with open(path + ".error", "w") as f:
+            f.write(str(e))
+        _remove(path + ".part")
+    finally:
+        connection.close()
+    evict_artifacts(keep=job_id)
+
+
+def evict_artifacts(keep=None):
+    """Deletes the least recently used finished exports and error files until the cache fits in
+    EXPORT_CACHE_MAX_BYTES, and the .part files of builds that died."""
+    with _eviction_lock:
+        artifacts = []
+        for name in os.listdir(settings.EXPORT_CACHE_DIR):
+            job_id, suffix = name, ""
+            for ending in (".error", ".part"):
+                if name.endswith(ending):
+                    job_id, suffix = name[: -len(ending)], ending
+            if job_id == keep or not parse_job_id(job_id):
+                continue
+            try:
+                stat = os.stat(artifact_path(name))
+            except OSError:
+                continue
+            if suffix == ".part":
+                _remove_stale_part(artifact_path(name))
+                continue
+            artifacts.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for mtime, size, name in artifacts)
+        if keep and os.path.exists(artifact_path(keep)):
+            total += os.path.getsize(artifact_path(keep))
+        for mtime, size, name in sorted(artifacts):
+            if total <= settings.EXPORT_CACHE_MAX_BYTES:
+                break
+            _remove(artifact_path(name))
+            total -= size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _remove_stale_part(path):
+    """Removes a .part file that nothing has touched for EXPORT_JOB_TIMEOUT, going by its mtime as of right now."""
+    try:
+        if time.time() - os.path.getmtime(path) >= settings.EXPORT_JOB_TIMEOUT:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
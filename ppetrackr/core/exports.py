@@ -0,0 +1,435 @@
+import csv
+import io
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from contextlib import contextmanager
+from itertools import chain
+
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils.dateparse import parse_datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+
+from .models import (
+    Inventory,
+    InventoryArchive,
+    InventoryDailySummary,
+    Organization,
+    PPEType,
+    q_for_ids,
+)
+
+# Number of rows pulled from the database per round trip while exporting. On Postgres, ``iterator()`` uses a
+# server-side cursor, so this is also the most rows held in the worker's memory at any one time.
+EXPORT_CHUNK_SIZE = 2000
+
+# Number of rows per record batch (and Parquet row group) in the columnar formats.
+EXPORT_BATCH_SIZE = 20000
+
+# The first value in each pair is the pretty title text for the header of the spreadsheet. The second value is the
+# field lookup (following relations with "__") for the cell value, so that the organization and PPE type are joined
+# into the export query instead of being fetched once per row.
+EXPORT_COLUMNS = [
+    ("Organization", "organization__name"),
+    ("Item Category", "item_type"),
+    ("Model Number", "item_number"),
+    ("Attribute", "ppetype__item_attribute"),
+    ("Size", "ppetype__size"),
+    ("Quantity", "number"),
+    ("Daily Use", "daily_use"),
+    ("Projected Daily Use", "projected_daily_use"),
+    ("Projected Run-Out Date", "projected_run_out"),
+    ("Date Submitted (UTC)", "timestamp"),
+    ("Comments", "comments"),
+]
+
+EXPORT_HEADERS = [title for title, field in EXPORT_COLUMNS]
+
+EXPORT_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument-spreadsheetml.sheet",
+    "parquet": "application/octet-stream",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+
+class PseudoBuffer:
+    """This is basically a mockup of the write file format that Python expects. You can use this to work with Django
+    StreamingHttpResponses"""
+
+    def write(self, v):
+        return v
+
+
+# Typed columns for the Parquet and Arrow exports. Organization and item category are dictionary encoded (categoricals
+# for pandas/R users) and the timestamp is a native UTC timestamp rather than text.
+ARROW_SCHEMA = pa.schema(
+    [
+        pa.field("organization", pa.dictionary(pa.int32(), pa.string())),
+        pa.field("item_category", pa.dictionary(pa.int32(), pa.string())),
+        pa.field("model_number", pa.string()),
+        pa.field("attribute", pa.string()),
+        pa.field("size", pa.string()),
+        pa.field("quantity", pa.int64()),
+        pa.field("daily_use", pa.int64()),
+        pa.field("projected_daily_use", pa.int64()),
+        pa.field("projected_run_out", pa.date32()),
+        pa.field("timestamp", pa.timestamp("us", tz="UTC")),
+        pa.field("comments", pa.string()),
+    ]
+)
+
+ARROW_FIELDS = [
+    "organization_id",
+    "item_type",
+    "item_number",
+    "ppetype__item_attribute",
+    "ppetype__size",
+    "number",
+    "daily_use",
+    "projected_daily_use",
+    "projected_run_out",
+    "timestamp",
+    "comments",
+]
+
+
+def get_export_organizations(organization):
+    """Returns the organizations whose inventory an organization may export: itself if it is a provider, otherwise
+    all of its child providers."""
+    return Organization.objects.filter(q_for_ids("pk", organization.get_provider_ids()))
+
+
+def get_export_queryset(organization, until=None, model=Inventory):
+    """Returns the inventory in an organization's export, optionally only the entries submitted up to ``until``. This
+    is the inventory in the inventory table; pass ``model=InventoryArchive`` for the older inventory in the archive, or
+    ``model=InventoryDailySummary`` for the daily summaries that the oldest inventory has been compacted into."""
+    queryset = model.objects.filter(
+        q_for_ids("organization", organization.get_provider_ids())
+    )
+    if until is not None:
+        queryset = queryset.filter(timestamp__lte=until)
+    return queryset
+
+
+@contextmanager
+def export_snapshot():
+    """Makes the queries inside the block all see the database as it was when the first of them ran, so that an
+    export read from every tier of inventory can't miss, or repeat, entries archived or compacted meanwhile."""
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        # A transaction sees one snapshot on SQLite already, on Postgres only if it is asked to as it starts.
+        if outermost and connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        yield
+
+
+def encode_cursor(timestamp, pk, high_water=None):
+    """Encodes the (timestamp, id) of the last inventory entry a client has seen as an opaque, URL-safe string, along
+    with the high water mark of an incremental export cursor (see get_incremental_queryset()) if there is one."""
+    parts = [timestamp.isoformat(), str(pk)]
+    if high_water is not None:
+        parts.append(str(high_water))
+    raw = "|".join(parts)
+    return urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, high_water=False):
+    """Returns the (timestamp, id) pair in a cursor, raising ValueError if it isn't a valid cursor. With
+    ``high_water``, returns a (timestamp, id, high water mark) triple instead, the mark being None for cursors that
+    have none."""
+    try:
+        raw = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        parts = raw.split("|")
+        if len(parts) not in (2, 3):
+            raise ValueError
+        timestamp = parse_datetime(parts[0])
+        parts[1:] = [int(part) for part in parts[1:]]
+    except (TypeError, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor: {}".format(cursor))
+    if timestamp is None:
+        raise ValueError("Invalid cursor: {}".format(cursor))
+    if high_water:
+        return timestamp, parts[1], parts[2] if len(parts) == 3 else None
+    return timestamp, parts[1]
+
+
+def get_incremental_queryset(organization, since=None, limit=None):
+    """Returns the inventory submitted after the ``since`` cursor (all of it if there is no cursor) and the cursor to
+    pass as ``since`` next time, as a (queryset, next cursor) pair. At most ``limit`` entries are returned, if given.
+
+    Entries are ordered by (timestamp, id), which matches the (organization, timestamp, id) index, so each call is a
+    range scan that costs only the new rows. The upper bound is fixed before the rows are read, so entries submitted
+    while the export is running are left for the next call rather than skipped.
+
+    The daily summaries are older than the archive's entries, which are older than the inventory table's, so a client
+    is given everything after its cursor in the summaries first, then in the archive, and only then moves on to the
+    inventory table. Once its cursor is past an older tier, the timestamp bound means that tier's query reads nothing
+    (and no partition at all on Postgres). A summary keeps the id and timestamp of its day's last entry, so a client
+    that had seen that entry before it was compacted isn't given the day again.
+
+    Entries can be ingested or imported with a timestamp behind a cursor handed out already. Ids are handed out in the
+    order entries are added, so a cursor also carries a high water mark: the highest id there was when it was made. A
+    call whose cursor has entries behind it with higher ids than that returns those first, see _backdated_queryset()."""
+    # Read before anything else. Entries with higher ids are left out of this call, and returned by a later one.
+    top = _highest_id()
+    high_water = top
+    if since is not None:
+        timestamp, pk, since_high_water = (tuple(since) + (None,))[:3]
+        since = timestamp, pk
+        # Cursors from before high water marks have none, and can only be given the entries that come after them.
+        if since_high_water is not None:
+            backdated = _backdated_queryset(organization, since, since_high_water, limit)
+            if backdated is not None:
+                return backdated
+            high_water = max(top, since_high_water)
+
+    for model in [InventoryDailySummary, InventoryArchive, Inventory]:
+        queryset = (
+            get_export_queryset(organization, model=model)
+            .filter(pk__lte=top)
+            .order_by("timestamp", "pk")
+        )
+        if since is not None:
+            timestamp, pk = since
+            queryset = queryset.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gt=pk)
+            )
+
+        last = None
+        if limit is not None:
+            page_end = list(queryset.values_list("timestamp", "pk")[limit - 1 : limit])
+            last = page_end[0] if page_end else None
+        if last is None:
+            last = queryset.reverse().values_list("timestamp", "pk").first()
+        if last is not None:
+            break
+    else:  # Nothing new, the client stays where it is.
+        next_cursor = encode_cursor(*since, high_water) if since is not None else ""
+        return queryset.none(), next_cursor
+
+    timestamp, pk = last
+    queryset = queryset.filter(
+        Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lte=pk)
+    )
+    return queryset, encode_cursor(timestamp, pk, high_water)
+
+
+def _highest_id():
+    """Returns the highest id of any inventory entry. Archived entries, and the summaries standing in for the last
+    entries of compacted days, keep the ids of their entries, so the archive and summaries are looked in too."""
+    return max(
+        model.objects.aggregate(top=Max("pk"))["top"] or 0
+        for model in [InventoryDailySummary, InventoryArchive, Inventory]
+    )
+
+
+def _backdated_queryset(organization, since, high_water, limit):
+    """Returns the entries added since a cursor's high water mark with a timestamp behind its (timestamp, id), in id
+    order, and the cursor that follows them, as a (queryset, next cursor) pair; or None if there are none. The next
+    cursor keeps the position of ``since`` and raises the high water mark to the last id returned.
+
+    A backdated entry may have been archived, or compacted (into a summary that took its id, as its day's last entry)
+    since, so each tier is looked in. Only the tier with the lowest such id is returned from, and only up to the
+    lowest such id of the others, so that no entry is left behind the new high water mark. The queries seek the
+    primary key to the high water mark, so they only read the entries added since."""
+    timestamp, pk = since
+    behind = Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lte=pk)
+    firsts = []
+    for model in [InventoryDailySummary, InventoryArchive, Inventory]:
+        queryset = (
+            get_export_queryset(organization, model=model)
+            .filter(behind, pk__gt=high_water)
+            .order_by("pk")
+        )
+        first = queryset.values_list("pk", flat=True).first()
+        if first is not None:
+            firsts.append((first, queryset))
+    if not firsts:
+        return None
+    firsts.sort(key=lambda found: found[0])
+    queryset = firsts[0][1]
+    if len(firsts) > 1:
+        queryset = queryset.filter(pk__lt=firsts[1][0])
+    if limit is not None:
+        page_end = list(queryset.values_list("pk", flat=True)[limit - 1 : limit])
+        if page_end:
+            queryset = queryset.filter(pk__lte=page_end[0])
+    last = queryset.reverse().values_list("pk", flat=True).first()
+    return queryset, encode_cursor(timestamp, pk, last)
+
+
+def write_export(organization, file_format, output, until=None, queryset=None, on_progress=None):
+    """Writes an organization's export in one of the EXPORT_CONTENT_TYPES formats to a binary file. The entries
+    exported default to the organization's whole export, from the daily summaries, the archive and the inventory
+    table alike. ``on_progress``, if given, is called every EXPORT_CHUNK_SIZE rows (or every record batch)."""
+    if queryset is None:
+        querysets = [
+            get_export_queryset(organization, until=until, model=model)
+            for model in [InventoryDailySummary, InventoryArchive, Inventory]
+        ]
+    else:
+        querysets = [queryset]
+    with export_snapshot():
+        if file_format in ("csv", "xlsx"):
+            rows = _report_progress(
+                chain.from_iterable(map(iter_export_rows, querysets)),
+                on_progress,
+                EXPORT_CHUNK_SIZE,
+            )
+            if file_format == "csv":
+                write_csv(rows, output)
+            else:
+                write_xlsx(rows, output)
+        elif file_format in ("parquet", "arrow"):
+            organizations = get_export_organizations(organization)
+            batches = _report_progress(
+                chain.from_iterable(
+                    iter_arrow_batches(queryset, organizations) for queryset in querysets
+                ),
+                on_progress,
+                1,
+            )
+            if file_format == "parquet":
+                write_parquet(batches, output)
+            else:
+                write_arrow(batches, output)
+        else:
+            raise ValueError("Unknown export format: {}".format(file_format))
+
+
+def _report_progress(items, on_progress, every):
+    if on_progress is None:
+        yield from items
+        return
+    for count, item in enumerate(items, start=1):
+        yield item
+        if count % every == 0:
+            on_progress()
+
+
+def iter_export_rows(queryset):
+    """Yields one list of cell values per inventory entry, in EXPORT_COLUMNS order. Rows are read in chunks from a
+    database cursor and never collected into a list, so memory stays flat however large the export is. The queryset's
+    ordering is kept, so leave it unordered unless the order matters."""
+    item_type_names = dict(PPEType.PPE_CHOICES)
+    fields = [field for title, field in EXPORT_COLUMNS]
+    category_index = fields.index("item_type")
+
+    rows = (
+        queryset.values_list(*fields)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    for row in rows:
+        row = list(row)
+        row[category_index] = item_type_names.get(
+            row[category_index], row[category_index]
+        )
+        yield row
+
+
+def stream_csv(rows):
+    """Encodes the header and then each row as CSV text as the rows arrive."""
+    writer = csv.writer(PseudoBuffer())
+    yield writer.writerow(EXPORT_HEADERS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_csv(rows, output):
+    """Writes the header and rows as UTF-8 CSV to a binary file."""
+    text = io.TextIOWrapper(output, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(EXPORT_HEADERS)
+    writer.writerows(rows)
+    text.flush()
+    text.detach()
+
+
+def write_xlsx(rows, output):
+    """Writes the header and rows into an XLSX workbook in a binary file.
+
+    xlsxwriter's constant_memory mode flushes each row to disk once the next one is started, so the rows are never
+    held in memory in full."""
+    book = xlsxwriter.Workbook(
+        output, {"constant_memory": True, "remove_timezone": True}
+    )
+    runout_date_format = book.add_format({"num_format": "yyyy-mm-dd"})
+    timestamp_format = book.add_format({"num_format": "yyyy-mm-dd hh:mm:ss.000"})
+    column_formats = {
+        "projected_run_out": runout_date_format,
+        "timestamp": timestamp_format,
+    }
+    formats = [column_formats.get(field) for title, field in EXPORT_COLUMNS]
+
+    sheet = book.add_worksheet()
+    sheet.write_row(0, 0, EXPORT_HEADERS)
+    # constant_memory requires every row to be written in order, left to right.
+    for r_num, cols in enumerate(rows, start=1):
+        for c_num, cell in enumerate(cols):
+            if formats[c_num] is None:
+                sheet.write(r_num, c_num, cell)
+            else:
+                sheet.write(r_num, c_num, cell, formats[c_num])
+    book.close()
+
+
+def iter_arrow_batches(queryset, organizations):
+    """Yields the export as Arrow record batches of up to EXPORT_BATCH_SIZE rows each.
+
+    The dictionaries for the categorical columns are fixed up front (every organization in scope, every PPE category)
+    so that all batches share them, which the Arrow file format requires."""
+    org_ids, org_names = [], []
+    for org_id, name in organizations.order_by("name").values_list("id", "name"):
+        org_ids.append(org_id)
+        org_names.append(name)
+    org_index = {org_id: i for i, org_id in enumerate(org_ids)}
+    item_types = [item_type for item_type, name in PPEType.PPE_CHOICES]
+    item_type_index = {item_type: i for i, item_type in enumerate(item_types)}
+    dictionaries = [
+        pa.array(org_names, type=pa.string()),
+        pa.array([name for item_type, name in PPEType.PPE_CHOICES], type=pa.string()),
+    ]
+
+    rows = (
+        queryset.values_list(*ARROW_FIELDS)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == EXPORT_BATCH_SIZE:
+            yield _to_record_batch(batch, [org_index, item_type_index], dictionaries)
+            batch = []
+    if batch:
+        yield _to_record_batch(batch, [org_index, item_type_index], dictionaries)
+
+
+def _to_record_batch(rows, indexes, dictionaries):
+    columns = list(zip(*rows))
+    arrays = []
+    for i, (field, values) in enumerate(zip(ARROW_SCHEMA, columns)):
+        if i < len(dictionaries):
+            indices = pa.array([indexes[i][v] for v in values], type=pa.int32())
+            arrays.append(pa.DictionaryArray.from_arrays(indices, dictionaries[i]))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=ARROW_SCHEMA)
+
+
+def write_parquet(batches, output):
+    """Writes the record batches to a Parquet file, one row group per batch."""
+    writer = pq.ParquetWriter(output, ARROW_SCHEMA)
+    for batch in batches:
+        writer.write_table(pa.Table.from_batches([batch]))
+    writer.close()
+
+
+def write_arrow(batches, output):
+    """Writes the record batches to an Arrow IPC file."""
+    writer = pa.RecordBatchFileWriter(output, ARROW_SCHEMA)
+    for batch in batches:
+        writer.write_batch(batch)
+    writer.close()
@@ -60,26 +60,66 @@ class CustomUserCreationForm(UserCreationForm):
         fields = ("username", "email", "first_name", "last_name", "timezone")
 
 
+class PPETypeChoiceField(forms.ChoiceField):
+    """A choice of PPEType from a dict of them by pk, rather than from a queryset, so that the PPE types can be
+    looked up once and shared by every form of a formset instead of being queried again by each form."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ppetypes = {}
+
+    @property
+    def ppetypes(self):
+        return self._ppetypes
+
+    @ppetypes.setter
+    def ppetypes(self, ppetypes):
+        self._ppetypes = ppetypes
+        self.choices = [("", "---------")] + [
+            (pk, str(ppetype)) for pk, ppetype in ppetypes.items()
+        ]
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.ppetypes[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise forms.ValidationError(
+                self.error_messages["invalid_choice"],
+                code="invalid_choice",
+                params={"value": value},
+            )
+
+    def validate(self, value):
+        forms.Field.validate(self, value)
+
+
 class TrackInventoryForm(forms.ModelForm):
     ppe_type = None
-    ppetype = forms.ModelChoiceField(
-        queryset=None, help_text="PPE Brand & Size", label="PPE Type"
-    )
+    ppetype = PPETypeChoiceField(help_text="PPE Brand & Size", label="PPE Type")
 
     field_order = [
         "ppetype",
     ]
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, ppetypes=None, **kwargs):
+        """``ppetypes`` is a dict of the PPE types to choose from by pk. Formsets should look it up once and pass it
+        to all their forms through ``form_kwargs``; otherwise each form looks it up itself."""
         super().__init__(*args, **kwargs)
-        self.fields["ppetype"].queryset = PPEType.objects.filter(
-            item_type=self.get_ppe_type()
-        )
+        if ppetypes is None:
+            ppetypes = PPEType.objects.filter(item_type=self.get_ppe_type()).in_bulk()
+        self.fields["ppetype"].ppetypes = ppetypes
         self.helper = FormHelper(self)
         self.helper.form_tag = False
         self.helper.disable_csrf = True
         self.helper.html5_required = True
 
+    def _get_validation_exclusions(self):
+        # The PPE type was picked from the looked-up ones, so model validation needn't query it again to check it
+        # exists.
+        return super()._get_validation_exclusions() + ["ppetype"]
+
     def get_ppe_type(self):
         raise NotImplementedError
 
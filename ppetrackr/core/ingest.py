@@ -0,0 +1,300 @@
+import codecs
+import csv
+import gzip
+import json
+from datetime import date, datetime
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .cache import bump_data_version
+from .exports import ARROW_FIELDS, ARROW_SCHEMA, EXPORT_COLUMNS
+from .models import (
+    CurrentInventory,
+    Inventory,
+    InventoryDailyRollup,
+    InventoryForecast,
+    PPEType,
+)
+
+# Number of valid rows inserted per batch (and per transaction) while ingesting.
+INGEST_BATCH_SIZE = 1000
+
+# The most row errors listed in an ingest report. Rows past this are still counted, just not described.
+INGEST_MAX_ERRORS = 1000
+
+INGEST_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# The inventory fields a row may set, each by its field name or by its column name in the exports, so that an export
+# can be ingested again as it is. The PPE type is given by its item_type, item_attribute and size.
+INGEST_FIELDS = [
+    "item_type",
+    "item_attribute",
+    "size",
+    "number",
+    "item_number",
+    "daily_use",
+    "projected_daily_use",
+    "projected_run_out",
+    "timestamp",
+    "comments",
+]
+
+INGEST_COLUMN_ALIASES = {
+    title: field.replace("ppetype__", "") for title, field in EXPORT_COLUMNS
+}
+INGEST_COLUMN_ALIASES.update(
+    (name, field.replace("ppetype__", ""))
+    for name, field in zip(ARROW_SCHEMA.names, ARROW_FIELDS)
+    if name != "organization"
+)
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class RowError(ValueError):
+    """Raised for a row that can't be ingested, with the problem with each field that was wrong."""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+class PPETypeMap:
+    """Every PPE type in memory, keyed by (item_type, item_attribute, size), so that rows can be matched to their PPE
+    type without a query each. The item type may be given by its value or its name, and the attribute and size are
+    matched ignoring case and surrounding spaces."""
+
+    def __init__(self):
+        self.item_types = {}
+        for item_type, name in PPEType.PPE_CHOICES:
+            self.item_types[item_type] = item_type
+            self.item_types[name.casefold()] = item_type
+        self.ppetypes = {
+            self.key(ppetype.item_type, ppetype.item_attribute, ppetype.size): ppetype
+            for ppetype in PPEType.objects.all()
+        }
+
+    def key(self, item_type, item_attribute, size):
+        return (
+            item_type,
+            str(item_attribute or "").strip().casefold(),
+            str(size or "").strip().casefold(),
+        )
+
+    def get(self, item_type, item_attribute, size):
+        """Returns the matching PPE type, or None."""
+        item_type = self.item_types.get(str(item_type or "").strip().casefold())
+        return self.ppetypes.get(self.key(item_type, item_attribute, size))
+
+
+def open_ingest_stream(stream, compressed=None):
+    """Wraps a binary stream in gzip decompression if it is compressed. Whether it is can be given, otherwise it is
+    detected from the stream's first bytes (which must then support peek(), as buffered files do)."""
+    if compressed is None:
+        compressed = stream.peek(2)[:2] == GZIP_MAGIC
+    return gzip.GzipFile(fileobj=stream, mode="rb") if compressed else stream
+
+
+def iter_csv_rows(stream):
+    """Yields (line number, dict) pairs from a binary stream of UTF-8 CSV with a header row, a line at a time."""
+    reader = csv.DictReader(codecs.getreader("utf-8-sig")(stream))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def iter_ndjson_rows(stream):
+    """Yields (line number, dict) pairs from a binary stream of newline-delimited JSON objects, a line at a time.
+    Lines that aren't JSON objects are yielded as a RowError instead of a dict."""
+    for line_num, line in enumerate(codecs.getreader("utf-8")(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = RowError({"row": "Invalid JSON: {}".format(e)})
+        if not isinstance(row, (dict, RowError)):
+            row = RowError({"row": "Each line must be a JSON object."})
+        yield line_num, row
+
+
+def _clean_count(value):
+    if value is None or value == "":
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Enter a whole number.")
+    if number < 0:
+        raise ValueError("Enter a number of at least 0.")
+    return number
+
+
+def _clean_date(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        day = parse_date(str(value))
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError("Enter a date as YYYY-MM-DD.")
+    return day
+
+
+def _clean_timestamp(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        timestamp = value
+    else:
+        try:
+            timestamp = parse_datetime(str(value))
+        except ValueError:
+            timestamp = None
+    if timestamp is None:
+        raise ValueError("Enter a date and time as YYYY-MM-DD HH:MM[:SS].")
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, timezone.utc)
+    return timestamp
+
+
+def clean_row(row, ppetypes):
+    """Turns one row (a dict of field names or export column names to values) into an unsaved Inventory, raising
+    RowError listing every field that is wrong. The organization and user are left for the caller to set."""
+    values = {}
+    for column, value in row.items():
+        field = INGEST_COLUMN_ALIASES.get(column, column)
+        if field in INGEST_FIELDS:
+            values[field] = value.strip() if isinstance(value, str) else value
+
+    errors = {}
+    cleaned = {}
+    for field, clean in [
+        ("number", _clean_count),
+        ("daily_use", _clean_count),
+        ("projected_daily_use", _clean_count),
+        ("projected_run_out", _clean_date),
+        ("timestamp", _clean_timestamp),
+    ]:
+        try:
+            cleaned[field] = clean(values.get(field))
+        except ValueError as e:
+            errors[field] = str(e)
+    if "number" not in errors and cleaned["number"] is None:
+        errors["number"] = "This field is required."
+
+    for field, max_length in [("item_number", 255)]:
+        value = values.get(field)
+        cleaned[field] = "" if value is None else str(value)
+        if len(cleaned[field]) > max_length:
+            errors[field] = "Enter at most {} characters.".format(max_length)
+    comments = values.get("comments")
+    cleaned["comments"] = "" if comments is None else str(comments)
+
+    ppetype = ppetypes.get(
+        values.get("item_type"), values.get("item_attribute"), values.get("size")
+    )
+    if ppetype is None:
+        errors["ppetype"] = "No PPE type {!r} with attribute {!r} and size {!r}.".format(
+            values.get("item_type"), values.get("item_attribute"), values.get("size")
+        )
+    if errors:
+        raise RowError(errors)
+
+    if cleaned["timestamp"] is None:
+        del cleaned["timestamp"]
+    # Set item_type as well, as these are inserted with bulk_create(), which doesn't call save().
+    return Inventory(ppetype=ppetype, item_type=ppetype.item_type, **cleaned)
+
+
+class IngestReport:
+    """Counts the rows an ingest created and rejected, describing up to INGEST_MAX_ERRORS of the rejected ones. Created
+    rows dated before the organization's newest inventory are counted as backdated: they sort behind cursors handed
+    out already, so incremental exports from those cursors return them on their next call, out of timestamp order."""
+
+    def __init__(self):
+        self.created = 0
+        self.backdated = 0
+        self.rejected = 0
+        self.errors = []
+        self.error = None
+
+    def reject(self, line_num, errors):
+        self.rejected += 1
+        if len(self.errors) < INGEST_MAX_ERRORS:
+            self.errors.append({"row": line_num, "errors": errors})
+
+    def as_dict(self):
+        report = {
+            "created": self.created,
+            "backdated": self.backdated,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "errors_truncated": self.rejected > len(self.errors),
+        }
+        if self.error:
+            report["error"] = self.error
+        return report
+
+
+def ingest_inventory(rows, user, batch_size=INGEST_BATCH_SIZE):
+    """Validates (line number, row) pairs from iter_csv_rows() or iter_ndjson_rows() and inserts the valid ones as
+    inventory of the user's organization, returning an IngestReport.
+
+    Rows are read as they arrive and inserted INGEST_BATCH_SIZE at a time, each batch with its current inventory and
+    daily rollups in its own transaction, so memory stays flat however many rows there are and a long upload doesn't
+    hold its locks throughout. Invalid rows are skipped and reported rather than failing the rest, and rows dated
+    before the organization's newest inventory are counted as backdated. The forecasts and dashboard data version are
+    updated once, at the end. If the stream itself turns out to be unreadable (a corrupt gzip or text that isn't
+    UTF-8), the rows read so far are kept and the report's error says what went wrong."""
+    organization = user.organization
+    ppetypes = PPETypeMap()
+    report = IngestReport()
+    batch = []
+    newest = Inventory.objects.filter(organization=organization).aggregate(
+        newest=Max("timestamp")
+    )["newest"]
+
+    def flush():
+        with transaction.atomic():
+            Inventory.objects.bulk_create(batch)
+            CurrentInventory.objects.record(batch)
+            InventoryDailyRollup.objects.record(batch)
+        report.created += len(batch)
+        batch.clear()
+
+    try:
+        for line_num, row in rows:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                inventory = clean_row(row, ppetypes)
+            except RowError as e:
+                report.reject(line_num, e.errors)
+                continue
+            inventory.organization = organization
+            inventory.user = user
+            if newest is not None and inventory.timestamp < newest:
+                report.backdated += 1
+            batch.append(inventory)
+            if len(batch) >= batch_size:
+                flush()
+    except (EOFError, OSError, UnicodeDecodeError, csv.Error) as e:
+        report.error = "Could not read the upload: {}".format(e)
+    if batch:
+        flush()
+
+    if report.created:
+        InventoryForecast.objects.compute([organization])
+        bump_data_version(organization)
+    return report
@@ -0,0 +1,105 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from ppetrackr.core.models import (
+    Inventory,
+    InventoryDailyRollup,
+    Organization,
+    PPEType,
+    User,
+)
+
+TIMEZONES = ["America/New_York", "America/Los_Angeles", "Europe/London", "Asia/Kolkata"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the two ways InventoryDailyRollup.objects.daily_totals() can count inventory on local days, in the "
+        "database and in a per-row Python loop, checking that both give the same totals. Runs against throwaway data "
+        "in a transaction that is rolled back. daily_totals() uses the database on Postgres and the loop elsewhere: "
+        "SQLite has no timezone support, so Django converts every row's timestamp in a Python function there, and "
+        "the database totals come out slower than the loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, default=1000000, help="Inventory entries to generate."
+        )
+        parser.add_argument(
+            "--providers", type=int, default=20, help="Providers to spread them over."
+        )
+        parser.add_argument(
+            "--days", type=int, default=365, help="Days of history to spread them over."
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        stamp = timezone.now().timestamp()
+        parent = Organization.objects.create(
+            name="Benchmark parent {}".format(stamp), is_provider=False
+        )
+        providers = [
+            Organization.objects.create(
+                name="Benchmark provider {} {}".format(i, parent.pk),
+                is_provider=True,
+                parent=parent,
+            )
+            for i in range(options["providers"])
+        ]
+        users = {
+            tz: User.objects.create(
+                username="benchmark-{}-{}".format(tz, stamp),
+                email="benchmark-{}-{}@example.com".format(tz, stamp),
+                timezone=tz,
+            )
+            for tz in TIMEZONES
+        }
+        ppetypes = list(PPEType.objects.all()) or [
+            PPEType.objects.create(item_type=item_type, item_attribute="", size="")
+            for item_type, name in PPEType.PPE_CHOICES
+        ]
+
+        self.stdout.write("Generating {} inventory entries...".format(options["rows"]))
+        now = timezone.now()
+        span = options["days"] * 24 * 60 * 60
+        for start in range(0, options["rows"], 10000):
+            Inventory.objects.bulk_create(
+                Inventory(
+                    organization=random.choice(providers),
+                    user=random.choice(list(users.values())),
+                    ppetype=ppetype,
+                    item_type=ppetype.item_type,
+                    number=random.randint(0, 10000),
+                    projected_daily_use=random.choice([None, random.randint(0, 500)]),
+                    timestamp=now - timedelta(seconds=random.randint(0, span)),
+                )
+                for ppetype in random.choices(
+                    ppetypes, k=min(10000, options["rows"] - start)
+                )
+            )
+        inventories = Inventory.objects.filter(organization__parent=parent)
+
+        start = time.perf_counter()
+        expected = InventoryDailyRollup.objects._totals_in_python(inventories)
+        python_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        totals = InventoryDailyRollup.objects._totals_in_database(inventories)
+        database_time = time.perf_counter() - start
+
+        if totals != expected:
+            raise CommandError("The database totals differ from the Python ones.")
+
+        self.stdout.write("rollup rows    python (s)   database (s)")
+        self.stdout.write(
+            "{:>11} {:>13.2f} {:>14.2f}".format(len(totals), python_time, database_time)
+        )
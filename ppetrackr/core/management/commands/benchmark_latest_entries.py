@@ -0,0 +1,105 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from ppetrackr.core.models import (
+    Inventory,
+    Organization,
+    PPEType,
+    User,
+    latest_entries,
+    q_for_ids,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Times latest_entries(), the query that finds each provider's latest inventory of each PPE type (which the "
+        "current inventory behind the admin dashboard charts is built from), on growing numbers of providers. Runs "
+        "against throwaway data in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--providers",
+            type=int,
+            nargs="+",
+            default=[100, 200, 400, 800, 1600],
+            help="Provider counts to time the query at.",
+        )
+        parser.add_argument(
+            "--days", type=int, default=30, help="Days of history per provider."
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="Runs per provider count (best is kept)."
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        counts = sorted(options["providers"])
+        parent = Organization.objects.create(
+            name="Benchmark parent {}".format(timezone.now()), is_provider=False
+        )
+        providers = [
+            Organization.objects.create(
+                name="Benchmark provider {} {}".format(i, parent.pk),
+                is_provider=True,
+                parent=parent,
+            )
+            for i in range(counts[-1])
+        ]
+        user = User.objects.create_user(
+            "benchmark-{}".format(parent.pk),
+            "benchmark-{}@example.com".format(parent.pk),
+            organization=parent,
+            timezone="UTC",
+        )
+        ppetypes = [
+            PPEType.objects.create(item_type=item_type, item_attribute="Benchmark", size="M")
+            for item_type, name in PPEType.PPE_CHOICES
+        ]
+
+        now = timezone.now()
+        for provider in providers:
+            # Providers report on most days, but not all of them, and not every type of PPE.
+            Inventory.objects.bulk_create(
+                Inventory(
+                    organization=provider,
+                    user=user,
+                    ppetype=ppetype,
+                    item_type=ppetype.item_type,
+                    number=random.randint(0, 10000),
+                    projected_daily_use=random.randint(0, 500),
+                    timestamp=now - timedelta(days=day, minutes=random.randint(0, 600)),
+                )
+                for day in range(options["days"])
+                for ppetype in ppetypes
+                if random.random() < 0.8
+            )
+
+        self.stdout.write("providers      best (ms)   per provider (ms)")
+        for count in counts:
+            # Filtered by a list of ids, the way the dashboard and the current inventory rebuild filter providers.
+            ids = [provider.pk for provider in providers[:count]]
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                rows = list(
+                    latest_entries(
+                        Inventory.objects.filter(q_for_ids("organization", ids))
+                    ).values_list("organization_id", "ppetype_id", "number")
+                )
+                timings.append(time.perf_counter() - start)
+            assert len({(row[0], row[1]) for row in rows}) == len(rows)
+            best = min(timings) * 1000
+            self.stdout.write(
+                "{:>9} {:>14.2f} {:>19.4f}".format(count, best, best / count)
+            )
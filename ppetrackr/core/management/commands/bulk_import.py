@@ -0,0 +1,358 @@
+import io
+import json
+import os
+import time
+from itertools import islice
+
+import pyarrow.parquet as pq
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from ppetrackr.core.cache import bump_data_version, bump_organizations_version
+from ppetrackr.core.ingest import (
+    PPETypeMap,
+    RowError,
+    clean_row,
+    iter_csv_rows,
+    open_ingest_stream,
+)
+from ppetrackr.core.models import (
+    CurrentInventory,
+    ImportCheckpoint,
+    Inventory,
+    InventoryDailyRollup,
+    InventoryForecast,
+    Organization,
+    User,
+)
+
+FORMATS = {".csv": "csv", ".gz": "csv", ".xlsx": "xlsx", ".parquet": "parquet"}
+
+# Columns that may name an inventory entry's organization, as in the CSV and columnar exports.
+ORGANIZATION_COLUMNS = ["Organization", "organization"]
+
+# The columns the import writes to the inventory table: all of them but the id.
+INVENTORY_FIELDS = [
+    field for field in Inventory._meta.concrete_fields if not field.primary_key
+]
+
+TRUE_VALUES = {"true", "t", "yes", "y", "1"}
+FALSE_VALUES = {"false", "f", "no", "n", "0"}
+
+
+def iter_file_rows(path, file_format):
+    """Yields a dict for each row of a CSV (optionally gzipped), XLSX or Parquet file with a header, reading the file
+    a piece at a time rather than all at once."""
+    if file_format == "csv":
+        with open(path, "rb") as f:
+            for line_num, row in iter_csv_rows(open_ingest_stream(f)):
+                yield row
+    elif file_format == "xlsx":
+        # openpyxl is only needed to import spreadsheets, so it is only loaded then.
+        import openpyxl
+
+        book = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = book.active.iter_rows(values_only=True)
+            header = ["" if title is None else str(title) for title in next(rows, ())]
+            for values in rows:
+                if any(value is not None for value in values):
+                    yield dict(zip(header, values))
+        finally:
+            book.close()
+    elif file_format == "parquet":
+        parquet = pq.ParquetFile(path)
+        for i in range(parquet.num_row_groups):
+            columns = parquet.read_row_group(i).to_pydict()
+            for values in zip(*columns.values()):
+                yield dict(zip(columns, values))
+    else:
+        raise ValueError("Unknown import format: {}".format(file_format))
+
+
+def _copy_value(value):
+    """Formats a value for Postgres' COPY text format."""
+    if value is None:
+        return "\\N"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports inventory, or organizations, from a CSV, XLSX or Parquet file. Inventory rows give their "
+        "organization's name, PPE type and other fields under the same column names as the exports; organization "
+        "rows give a name, the name of their parent organization (if any, which must already exist or come earlier "
+        "in the file) and is_provider. Rows are inserted in batches, with COPY on Postgres, and invalid rows are "
+        "reported and skipped. Progress is checkpointed in the database with every batch, so an import that stops "
+        "part way can be run again to carry on from where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=["inventory", "organizations"])
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "xlsx", "parquet"],
+            help="The file's format, guessed from its extension by default.",
+        )
+        parser.add_argument(
+            "--user",
+            help="Username of the user that imported inventory is recorded as submitted by. Their timezone decides "
+            "which day each entry is counted on.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="Rows inserted per transaction."
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="The name progress is recorded under, by default the imported file's absolute path.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Import the whole file again, even if a checkpoint says part of it was imported already.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or FORMATS.get(
+            os.path.splitext(path)[1].lower()
+        )
+        if not os.path.exists(path):
+            raise CommandError("No such file: {}".format(path))
+        if file_format is None:
+            raise CommandError("Can't tell the format of {}, pass --format.".format(path))
+
+        self.kind = options["kind"]
+        if self.kind == "inventory":
+            if not options["user"]:
+                raise CommandError("Pass the --user that imported inventory is submitted by.")
+            try:
+                self.user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError("No such user: {}".format(options["user"]))
+            self.ppetypes = PPETypeMap()
+        # Foreign keys are resolved from these maps rather than queried row by row.
+        self.organizations = dict(Organization.objects.values_list("name", "pk"))
+        self.pending_names = set()
+
+        self.checkpoint = self.read_checkpoint(
+            path, options["checkpoint"] or os.path.abspath(path), options["restart"]
+        )
+        self.imported_organizations = set(json.loads(self.checkpoint.organizations))
+        if self.checkpoint.rows:
+            self.stdout.write(
+                "Resuming {} after row {}.".format(path, self.checkpoint.rows)
+            )
+
+        self.batch = []
+        self.last_row = self.checkpoint.rows
+        self.read = self.created = self.rejected = 0
+        self.start = time.perf_counter()
+        rows = enumerate(iter_file_rows(path, file_format), start=1)
+        for row_num, row in islice(rows, self.checkpoint.rows, None):
+            self.read += 1
+            try:
+                if self.kind == "inventory":
+                    obj = self.clean_inventory(row)
+                else:
+                    obj = self.clean_organization(row)
+            except RowError as e:
+                self.rejected += 1
+                for field, error in e.errors.items():
+                    self.stderr.write("Row {}: {}: {}".format(row_num, field, error))
+            else:
+                self.batch.append(obj)
+            self.last_row = row_num
+            if len(self.batch) >= options["batch_size"]:
+                self.flush()
+        self.flush()
+
+        self.finish()
+        self.checkpoint.delete()
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Imported {} rows from {} ({} rejected) at {:.0f} rows/s.".format(
+                    self.created, path, self.rejected, self.rate()
+                )
+            )
+        )
+
+    def clean_inventory(self, row):
+        name = next(
+            (row[column] for column in ORGANIZATION_COLUMNS if row.get(column)), None
+        )
+        organization_id = self.organizations.get(str(name).strip())
+        try:
+            inventory = clean_row(row, self.ppetypes)
+        except RowError as e:
+            errors = e.errors
+        else:
+            errors = {}
+        if organization_id is None:
+            errors["organization"] = "No organization named {!r}.".format(name)
+        if errors:
+            raise RowError(errors)
+        inventory.organization_id = organization_id
+        inventory.user = self.user
+        return inventory
+
+    def clean_organization(self, row):
+        errors = {}
+        name = str(row.get("name") or "").strip()
+        if not name:
+            errors["name"] = "This field is required."
+        elif len(name) > 255:
+            errors["name"] = "Enter at most 255 characters."
+        elif name in self.organizations or name in self.pending_names:
+            errors["name"] = "There is already an organization named {!r}.".format(name)
+
+        is_provider = row.get("is_provider")
+        if not isinstance(is_provider, bool):
+            is_provider = str(is_provider or "").strip().lower()
+            if is_provider in TRUE_VALUES or is_provider in FALSE_VALUES:
+                is_provider = is_provider in TRUE_VALUES
+            else:
+                errors["is_provider"] = "Enter true or false."
+
+        parent_name = str(row.get("parent") or "").strip()
+        parent_id = None
+        if parent_name:
+            if parent_name in self.pending_names:
+                # The parent is waiting to be inserted in this batch, and the child needs its id.
+                self.flush()
+            parent_id = self.organizations.get(parent_name)
+            if parent_id is None:
+                errors["parent"] = "No organization named {!r}.".format(parent_name)
+        if errors:
+            raise RowError(errors)
+
+        self.pending_names.add(name)
+        # The tree fields are filled in by a single rebuild once every organization is in, rather than the tree
+        # being renumbered as each one is added.
+        mptt_meta = Organization._mptt_meta
+        return Organization(
+            name=name,
+            parent_id=parent_id,
+            is_provider=is_provider,
+            **{
+                mptt_meta.left_attr: 0,
+                mptt_meta.right_attr: 0,
+                mptt_meta.tree_id_attr: 0,
+                mptt_meta.level_attr: 0,
+            }
+        )
+
+    def flush(self):
+        """Inserts the batch, and records that every row up to the last one handled is done, in one transaction. If
+        the import is killed, both roll back, and the checkpoint still points at the end of the previous batch."""
+        with transaction.atomic():
+            if self.kind == "inventory":
+                self.insert_inventory(self.batch)
+                self.imported_organizations.update(
+                    inventory.organization_id for inventory in self.batch
+                )
+                self.checkpoint.organizations = json.dumps(sorted(self.imported_organizations))
+            else:
+                Organization.objects.bulk_create(self.batch)
+            self.checkpoint.rows = self.last_row
+            self.checkpoint.save()
+        if self.kind == "organizations":
+            self.organizations.update(
+                Organization.objects.filter(name__in=self.pending_names).values_list(
+                    "name", "pk"
+                )
+            )
+            self.pending_names.clear()
+        self.created += len(self.batch)
+        self.batch.clear()
+        self.stdout.write(
+            "{} rows read, {} imported, {} rejected, {:.0f} rows/s".format(
+                self.last_row, self.created, self.rejected, self.rate()
+            )
+        )
+
+    def insert_inventory(self, inventories):
+        """Inserts inventory straight into its table: by COPY on Postgres, otherwise by a batched executemany()."""
+        rows = [
+            [
+                field.get_db_prep_save(getattr(inventory, field.attname), connection)
+                for field in INVENTORY_FIELDS
+            ]
+            for inventory in inventories
+        ]
+        if not rows:
+            return
+        table = connection.ops.quote_name(Inventory._meta.db_table)
+        columns = ", ".join(
+            connection.ops.quote_name(field.column) for field in INVENTORY_FIELDS
+        )
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                data = io.StringIO()
+                for row in rows:
+                    data.write("\t".join(_copy_value(value) for value in row) + "\n")
+                data.seek(0)
+                cursor.copy_expert(
+                    "COPY {} ({}) FROM STDIN".format(table, columns), data
+                )
+            else:
+                cursor.executemany(
+                    "INSERT INTO {} ({}) VALUES ({})".format(
+                        table, columns, ", ".join(["%s"] * len(INVENTORY_FIELDS))
+                    ),
+                    rows,
+                )
+
+    def finish(self):
+        """Brings everything derived from the imported rows up to date, once, now that they are all in."""
+        if self.kind == "inventory":
+            organizations = list(
+                Organization.objects.filter(pk__in=self.imported_organizations)
+            )
+            self.stdout.write(
+                "Rebuilding the current inventory, daily rollups and forecasts..."
+            )
+            CurrentInventory.objects.rebuild(organizations)
+            InventoryDailyRollup.objects.rebuild(organizations)
+            InventoryForecast.objects.compute(organizations)
+            trees = {organization.tree_id: organization for organization in organizations}
+            for organization in trees.values():
+                bump_data_version(organization)
+        else:
+            self.stdout.write("Rebuilding the organization tree...")
+            Organization.objects.rebuild()
+            bump_organizations_version()
+            # Rebuilding can renumber the trees, so every tree's cached dashboards are let go.
+            for root in Organization.objects.root_nodes():
+                bump_data_version(root)
+
+    def rate(self):
+        return self.read / max(time.perf_counter() - self.start, 1e-6)
+
+    def read_checkpoint(self, path, name, restart):
+        stat = os.stat(path)
+        if restart:
+            ImportCheckpoint.objects.filter(name=name).delete()
+        checkpoint, created = ImportCheckpoint.objects.get_or_create(
+            name=name,
+            defaults={"kind": self.kind, "size": stat.st_size, "mtime": stat.st_mtime},
+        )
+        if not created and (
+            checkpoint.kind != self.kind
+            or checkpoint.size != stat.st_size
+            or checkpoint.mtime != stat.st_mtime
+        ):
+            raise CommandError(
+                "The checkpoint {!r} is of a different import, or the file has changed since. Pass --restart to "
+                "import the whole file.".format(name)
+            )
+        return checkpoint
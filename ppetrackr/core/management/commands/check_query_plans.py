@@ -0,0 +1,216 @@
+import random
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from ppetrackr.core.exports import get_incremental_queryset
+from ppetrackr.core.models import (
+    CurrentInventory,
+    Inventory,
+    InventoryDailyRollup,
+    InventoryForecast,
+    Organization,
+    PPEType,
+    User,
+    latest_entries,
+    q_for_ids,
+)
+from ppetrackr.core.partitions import archive_entries
+from ppetrackr.core.retention import compact_entries, raw_history_start
+
+# Tables that must never be read in full by a hot query.
+LARGE_TABLES = [
+    "core_inventory",
+    "core_inventoryarchive",
+    "core_inventorydailysummary",
+    "core_inventorydailyrollup",
+    "core_inventoryforecast",
+]
+
+# The partitions of a partitioned table count as the table.
+PARTITION_SUFFIX_RE = re.compile(r"_(?:p\d{4}_\d{2}|default)$")
+
+# How a full table read shows up in EXPLAIN output: "Seq Scan on <table>" on Postgres, "SCAN TABLE <table>" (or
+# "SCAN <table>" on newer versions) without an index on SQLite.
+FULL_SCAN_PATTERNS = [
+    re.compile(r"Seq Scan on (?P<table>\w+)"),
+    re.compile(r"\bSCAN (?:TABLE )?(?P<table>\w+)(?! USING)(?:\s|$)"),
+]
+
+
+def hot_queries(parent):
+    """Returns the hot inventory queries, by name, as run for the first provider of a parent organization."""
+    provider_ids = parent.get_provider_ids()
+    provider = Organization.objects.get(pk=provider_ids[0])
+    item_type = PPEType.GLOVES
+    now = timezone.now()
+    # As if the last entries added were backdated, from behind a cursor handed out before them.
+    recent = Inventory.objects.aggregate(top=Max("pk"))["top"] - 100
+    return {
+        "recent items": Inventory.objects.filter(
+            organization=provider, item_type=item_type
+        ).order_by("-timestamp")[:5],
+        "dashboard table page": Inventory.objects.filter(
+            q_for_ids("organization", provider_ids),
+            item_type=item_type,
+            timestamp__gte=raw_history_start(),
+        )
+        .select_related("ppetype")
+        .order_by("-timestamp", "-id")[:25],
+        "inventory list page": Inventory.objects.filter(
+            organization=provider, timestamp__gte=raw_history_start()
+        )
+        .select_related("ppetype", "user")
+        .order_by("-timestamp", "-pk")[:16],
+        "compacted incremental export": get_incremental_queryset(
+            provider, limit=1000
+        )[0],
+        "archived incremental export": get_incremental_queryset(
+            provider, since=(now - timedelta(days=240), 0), limit=1000
+        )[0],
+        "incremental export": get_incremental_queryset(
+            provider, since=(now - timedelta(days=30), 0), limit=1000
+        )[0],
+        "backdated incremental export": get_incremental_queryset(
+            provider, since=(now, 0, recent), limit=1000
+        )[0],
+        "provider rollups": InventoryDailyRollup.objects.filter(
+            organization=provider, item_type=item_type
+        ).order_by("day"),
+        "latest entries": latest_entries(
+            Inventory.objects.filter(q_for_ids("organization", provider_ids))
+        ),
+        "current inventory": CurrentInventory.objects.filter(
+            q_for_ids("organization", provider_ids), item_type=item_type
+        )
+        .values("organization")
+        .annotate(Sum("number")),
+        "forecast window": Inventory.objects.filter(
+            organization=provider,
+            timestamp__gt=now - timedelta(days=14),
+            timestamp__lte=now,
+        ),
+        "forecasts": InventoryForecast.objects.filter(
+            q_for_ids("organization", provider_ids), ppetype__item_type=item_type
+        ),
+    }
+
+
+def full_scans(plan):
+    """Returns the large tables that a query plan reads in full."""
+    scanned = []
+    for line in plan.splitlines():
+        for pattern in FULL_SCAN_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                table = PARTITION_SUFFIX_RE.sub("", match.group("table"))
+                if table in LARGE_TABLES:
+                    scanned.append(match.group("table"))
+    return scanned
+
+
+def seed(rows, providers):
+    """Seeds a parent organization with providers and a year of inventory, part of it archived and compacted, and
+    returns the parent."""
+    stamp = timezone.now().timestamp()
+    parent = Organization.objects.create(
+        name="Query plan parent {}".format(stamp), is_provider=False
+    )
+    organizations = [
+        Organization.objects.create(
+            name="Query plan provider {} {}".format(i, parent.pk),
+            is_provider=True,
+            parent=parent,
+        )
+        for i in range(providers)
+    ]
+    user = User.objects.create(
+        username="query-plans-{}".format(stamp),
+        email="query-plans-{}@example.com".format(stamp),
+        timezone="UTC",
+    )
+    ppetypes = list(PPEType.objects.all()) or [
+        PPEType.objects.create(item_type=item_type, item_attribute="", size="")
+        for item_type, name in PPEType.PPE_CHOICES
+    ]
+
+    now = timezone.now()
+    for start in range(0, rows, 10000):
+        Inventory.objects.bulk_create(
+            Inventory(
+                organization=random.choice(organizations),
+                user=user,
+                ppetype=ppetype,
+                item_type=ppetype.item_type,
+                number=random.randint(0, 10000),
+                daily_use=random.randint(0, 500),
+                timestamp=now - timedelta(seconds=random.randint(0, 365 * 86400)),
+            )
+            for ppetype in random.choices(ppetypes, k=min(10000, rows - start))
+        )
+    # The oldest half of it is archived, and the oldest quarter compacted, as it would have been by the time there
+    # was a year of it.
+    archive_entries(now - timedelta(days=180))
+    compact_entries(now - timedelta(days=270))
+    CurrentInventory.objects.rebuild()
+    InventoryDailyRollup.objects.rebuild()
+    InventoryForecast.objects.compute()
+
+    # Let the planner see the seeded data as it would see a production database.
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return parent
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks the query plans of the hot inventory queries (recent items, the dashboard table and charts, the "
+        "inventory list, incremental exports and forecasts), failing if any of them reads a whole inventory table. "
+        "Runs against a large seeded dataset in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, default=200000, help="Inventory entries to seed."
+        )
+        parser.add_argument(
+            "--providers", type=int, default=50, help="Providers to spread them over."
+        )
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Print every plan, not only the failing ones.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            failures = self.run(options)
+            transaction.set_rollback(True)
+        if failures:
+            raise CommandError(
+                "{} hot queries read whole tables: {}".format(
+                    len(failures), ", ".join(failures)
+                )
+            )
+        self.stdout.write(self.style.SUCCESS("All query plans use indexes."))
+
+    def run(self, options):
+        parent = seed(options["rows"], options["providers"])
+        failures = []
+        for name, queryset in hot_queries(parent).items():
+            plan = queryset.explain()
+            scanned = full_scans(plan)
+            if scanned:
+                failures.append(name)
+                self.stdout.write(
+                    self.style.ERROR("{}: full scan of {}".format(name, ", ".join(scanned)))
+                )
+            else:
+                self.stdout.write("{}: ok".format(name))
+            if scanned or options["verbose_plans"]:
+                self.stdout.write(plan + "\n")
+        return failures
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from ppetrackr.core.retention import (
+    COMPACTION_BATCH_SIZE,
+    compact_entries,
+    compaction_cutoff,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Collapses the inventory submitted more than INVENTORY_RAW_RETENTION_DAYS days ago into one summary per "
+        "organization, PPE type and day, holding the day's last entry and its totals. Run it daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.INVENTORY_RAW_RETENTION_DAYS,
+            help="Days of raw inventory to keep.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=COMPACTION_BATCH_SIZE,
+            help="Entries compacted per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] <= settings.FORECAST_WINDOW_DAYS:
+            raise CommandError(
+                "The forecasts read the last {} days of raw inventory, so keep more days than that.".format(
+                    settings.FORECAST_WINDOW_DAYS
+                )
+            )
+        before = compaction_cutoff(timezone.now(), options["days"])
+        report = compact_entries(before, options["batch_size"])
+        # Days with a single entry take up a little more space as summaries than they did as entries.
+        if report["bytes"] >= 0:
+            space = "reclaiming about {}".format(filesizeformat(report["bytes"]))
+        else:
+            space = "taking up about {} more".format(filesizeformat(-report["bytes"]))
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Compacted {} entries submitted before {:%Y-%m-%d} into {} new daily summaries, {}.".format(
+                    report["entries"], before, report["summaries"], space
+                )
+            )
+        )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ppetrackr.core.models import InventoryForecast
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes every organization's days-remaining forecasts. Run it daily, so that forecasts of organizations "
+        "that haven't submitted inventory lately still move with the rolling window."
+    )
+
+    def handle(self, *args, **options):
+        InventoryForecast.objects.compute()
+        self.stdout.write(
+            "Computed {} forecasts.".format(InventoryForecast.objects.count())
+        )
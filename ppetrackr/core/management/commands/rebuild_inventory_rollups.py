@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from ppetrackr.core.cache import bump_data_version
+from ppetrackr.core.models import CurrentInventory, InventoryDailyRollup, Organization
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the current inventory and the daily inventory rollups used by the dashboard from the raw "
+        "inventory."
+    )
+
+    def handle(self, *args, **options):
+        CurrentInventory.objects.rebuild()
+        InventoryDailyRollup.objects.rebuild()
+        # Every tree's cached dashboards were built from what was there before, so they are let go.
+        for root in Organization.objects.root_nodes():
+            bump_data_version(root)
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Rebuilt {} current inventory rows and {} daily rollups.".format(
+                    CurrentInventory.objects.count(),
+                    InventoryDailyRollup.objects.count(),
+                )
+            )
+        )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ppetrackr.core.partitions import (
+    ARCHIVE_BATCH_SIZE,
+    archive_boundary,
+    roll_partitions,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves inventory submitted before the last INVENTORY_HOT_MONTHS months from the inventory table to the "
+        "archive and, on Postgres 11 and later, creates the partitions of the coming months. Run it daily; it only "
+        "has anything to do once a month, or after old inventory has been imported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=ARCHIVE_BATCH_SIZE,
+            help="Entries moved per transaction, where they are moved one by one.",
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        report = roll_partitions(now=now, batch_size=options["batch_size"])
+        for month in report["created"]:
+            self.stdout.write("Created the partition for {:%Y-%m}.".format(month))
+        for month in report["archived"]:
+            self.stdout.write("Moved the partition for {:%Y-%m} to the archive.".format(month))
+        for month in report["skipped"]:
+            self.stderr.write(
+                "Couldn't lock the partition for {:%Y-%m} in time, so its entries were moved one by one "
+                "instead.".format(month)
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Moved {} entries submitted before {:%Y-%m-%d} to the archive one by one.".format(
+                    report["entries"], archive_boundary(now)
+                )
+            )
+        )
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.7 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_auto_20200408_1636'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['organization', 'timestamp', 'id'], name='inventory_org_ts_id_idx'),
+        ),
+    ]
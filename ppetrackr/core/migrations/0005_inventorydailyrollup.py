@@ -0,0 +1,85 @@
+# Generated by Django 2.1.7 on 2026-10-18 13:20
+
+from itertools import groupby
+
+import django.db.models.deletion
+import pytz
+from django.db import migrations, models
+
+
+def build_rollups(apps, schema_editor):
+    Inventory = apps.get_model("core", "Inventory")
+    InventoryDailyRollup = apps.get_model("core", "InventoryDailyRollup")
+    rows = (
+        Inventory.objects.order_by("organization")
+        .values_list(
+            "organization_id",
+            "ppetype__item_type",
+            "timestamp",
+            "user__timezone",
+            "number",
+            "projected_daily_use",
+            "projected_run_out",
+        )
+        .iterator()
+    )
+    for organization_id, org_rows in groupby(rows, key=lambda row: row[0]):
+        totals = {}
+        for _, item_type, timestamp, tz, number, daily_use, run_out in org_rows:
+            if isinstance(tz, str):
+                tz = pytz.timezone(tz)
+            key = (item_type, timestamp.astimezone(tz).date())
+            if key not in totals:
+                totals[key] = [0, 0, None, timestamp]
+            total = totals[key]
+            total[0] += number
+            total[1] += daily_use or 0
+            if run_out is not None and (total[2] is None or run_out > total[2]):
+                total[2] = run_out
+            total[3] = max(total[3], timestamp)
+        InventoryDailyRollup.objects.bulk_create(
+            [
+                InventoryDailyRollup(
+                    organization_id=organization_id,
+                    item_type=item_type,
+                    day=day,
+                    number=number,
+                    projected_daily_use=daily_use,
+                    projected_run_out=run_out,
+                    latest_timestamp=timestamp,
+                )
+                for (item_type, day), (number, daily_use, run_out, timestamp) in totals.items()
+            ]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_inventory_org_ts_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryDailyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_type', models.CharField(choices=[('n95mask', 'N95 Masks'), ('gloves', 'Gloves'), ('alcohol', 'Alcohol Solutions'), ('swab', 'Swabs'), ('gowns', 'Gowns'), ('face_mask', 'Non-N95 Face Masks')], max_length=64)),
+                ('day', models.DateField()),
+                ('number', models.BigIntegerField(default=0)),
+                ('projected_daily_use', models.BigIntegerField(default=0)),
+                ('projected_run_out', models.DateField(blank=True, null=True)),
+                ('latest_timestamp', models.DateTimeField()),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='core.Organization')),
+            ],
+            options={
+                'verbose_name': 'Inventory Daily Rollup',
+                'verbose_name_plural': 'Inventory Daily Rollups',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='inventorydailyrollup',
+            unique_together={('organization', 'item_type', 'day')},
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1.7 on 2026-10-18 13:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_inventorydailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryForecast',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.BigIntegerField()),
+                ('daily_consumption', models.FloatField(blank=True, null=True)),
+                ('days_remaining', models.FloatField(blank=True, null=True)),
+                ('run_out', models.DateField(blank=True, null=True)),
+                ('latest_timestamp', models.DateTimeField()),
+                ('computed_at', models.DateTimeField()),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='forecasts', to='core.Organization')),
+                ('ppetype', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='forecasts', to='core.PPEType')),
+            ],
+            options={
+                'verbose_name': 'Inventory Forecast',
+                'verbose_name_plural': 'Inventory Forecasts',
+                'unique_together': {('organization', 'ppetype')},
+            },
+        ),
+    ]
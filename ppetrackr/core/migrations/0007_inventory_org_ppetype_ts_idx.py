@@ -0,0 +1,17 @@
+# Generated by Django 2.1.7 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_inventoryforecast'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['organization', 'ppetype', 'timestamp'], name='inventory_org_ppetype_ts_idx'),
+        ),
+    ]
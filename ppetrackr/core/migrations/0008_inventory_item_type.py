@@ -0,0 +1,55 @@
+# Generated by Django 2.1.7 on 2026-10-18 14:02
+
+from django.db import migrations, models, transaction
+
+# Rows copied per transaction, so the copy never holds locks on the whole inventory table at once.
+BATCH_SIZE = 10000
+
+
+def copy_item_types(apps, schema_editor):
+    Inventory = apps.get_model("core", "Inventory")
+    PPEType = apps.get_model("core", "PPEType")
+    ppetypes = {}
+    for pk, item_type in PPEType.objects.values_list("pk", "item_type"):
+        ppetypes.setdefault(item_type, []).append(pk)
+
+    last_pk = 0
+    while True:
+        batch_end = (
+            Inventory.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[BATCH_SIZE - 1 : BATCH_SIZE]
+            .first()
+        )
+        batch = Inventory.objects.filter(pk__gt=last_pk)
+        if batch_end is not None:
+            batch = batch.filter(pk__lte=batch_end)
+        with transaction.atomic():
+            for item_type, ppetype_ids in ppetypes.items():
+                batch.filter(ppetype_id__in=ppetype_ids).update(item_type=item_type)
+        if batch_end is None:
+            break
+        last_pk = batch_end
+
+
+class Migration(migrations.Migration):
+    # Each batch of the copy is committed on its own.
+    atomic = False
+
+    dependencies = [
+        ('core', '0007_inventory_org_ppetype_ts_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='item_type',
+            field=models.CharField(choices=[('n95mask', 'N95 Masks'), ('gloves', 'Gloves'), ('alcohol', 'Alcohol Solutions'), ('swab', 'Swabs'), ('gowns', 'Gowns'), ('face_mask', 'Non-N95 Face Masks')], default='', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_item_types, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['organization', 'item_type', 'timestamp'], name='inventory_org_type_ts_idx'),
+        ),
+    ]
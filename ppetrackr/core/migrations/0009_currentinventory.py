@@ -0,0 +1,79 @@
+# Generated by Django 2.1.7 on 2026-10-18 15:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+FIELDS = (
+    "item_type",
+    "number",
+    "daily_use",
+    "projected_daily_use",
+    "projected_run_out",
+    "timestamp",
+)
+
+
+def fill_current_inventory(apps, schema_editor):
+    """Reads each organization's inventory of each PPE type newest first, keeping the first entry of each."""
+    Inventory = apps.get_model("core", "Inventory")
+    CurrentInventory = apps.get_model("core", "CurrentInventory")
+    rows = (
+        Inventory.objects.order_by("organization", "ppetype", "-timestamp", "-id")
+        .values_list("organization_id", "ppetype_id", *FIELDS)
+        .iterator()
+    )
+    batch = []
+    last_key = None
+    for organization_id, ppetype_id, *values in rows:
+        if (organization_id, ppetype_id) == last_key:
+            continue
+        last_key = (organization_id, ppetype_id)
+        batch.append(
+            CurrentInventory(
+                organization_id=organization_id,
+                ppetype_id=ppetype_id,
+                **dict(zip(FIELDS, values))
+            )
+        )
+        if len(batch) >= 1000:
+            CurrentInventory.objects.bulk_create(batch)
+            batch = []
+    CurrentInventory.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_inventory_item_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentInventory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_type', models.CharField(choices=[('n95mask', 'N95 Masks'), ('gloves', 'Gloves'), ('alcohol', 'Alcohol Solutions'), ('swab', 'Swabs'), ('gowns', 'Gowns'), ('face_mask', 'Non-N95 Face Masks')], max_length=64)),
+                ('number', models.PositiveIntegerField()),
+                ('daily_use', models.PositiveIntegerField(blank=True, null=True)),
+                ('projected_daily_use', models.PositiveIntegerField(blank=True, null=True)),
+                ('projected_run_out', models.DateField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='current_inventories', to='core.Organization')),
+                ('ppetype', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='current_inventories', to='core.PPEType')),
+            ],
+            options={
+                'verbose_name': 'Current Inventory',
+                'verbose_name_plural': 'Current Inventories',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='currentinventory',
+            index=models.Index(fields=['organization', 'item_type'], name='currentinventory_org_type_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='currentinventory',
+            unique_together={('organization', 'ppetype')},
+        ),
+        migrations.RunPython(fill_current_inventory, migrations.RunPython.noop),
+    ]
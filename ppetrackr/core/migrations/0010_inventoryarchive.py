@@ -0,0 +1,154 @@
+# Generated by Django 2.1.7 on 2026-10-18 16:05
+
+from datetime import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.utils.timezone import utc
+
+# How many months ahead of the current one get partitions, as INVENTORY_PARTITIONS_AHEAD did when this was written.
+# The roll_inventory_partitions command creates them from then on.
+PARTITIONS_AHEAD = 3
+
+
+def month_start(value):
+    return value.astimezone(utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def add_keys_and_indexes(schema_editor, model):
+    """Adds the primary key, foreign keys and indexes Django would have made to a newly partitioned table. The primary
+    key of a partitioned table has to include the timestamp it is partitioned by; ids are still unique on their own,
+    as they all come from one sequence."""
+    quote = schema_editor.quote_name
+    schema_editor.execute(
+        "ALTER TABLE {} ADD PRIMARY KEY ({}, {})".format(
+            quote(model._meta.db_table), quote(model._meta.pk.column), quote("timestamp")
+        )
+    )
+    for field in model._meta.local_fields:
+        if field.remote_field and field.db_constraint:
+            schema_editor.execute(
+                schema_editor._create_fk_sql(model, field, "_fk_%(to_table)s_%(to_column)s")
+            )
+    for sql in schema_editor._model_indexes_sql(model):
+        schema_editor.execute(sql)
+
+
+def partition_inventory(apps, schema_editor):
+    """Turns the inventory table into one partitioned by month, and recreates the (empty) archive table the same way,
+    if the database is Postgres 11 or later. Every entry is copied into the partitioned table, in the same
+    transaction, so this takes as long as copying the whole table does."""
+    db = schema_editor.connection
+    if db.vendor != "postgresql" or db.pg_version < 110000:
+        return
+    inventory_model = apps.get_model("core", "Inventory")
+    archive_model = apps.get_model("core", "InventoryArchive")
+    quote = schema_editor.quote_name
+    execute = schema_editor.execute
+    # The foreign keys and indexes of the archive table created above are made now rather than at the end of the
+    # migration, so that they don't end up being made twice on the table recreated here.
+    for sql in schema_editor.deferred_sql:
+        execute(sql)
+    schema_editor.deferred_sql = []
+
+    table = inventory_model._meta.db_table
+    unpartitioned = table + "_unpartitioned"
+    columns = ", ".join(
+        quote(field.column) for field in inventory_model._meta.concrete_fields
+    )
+
+    execute("ALTER TABLE {} RENAME TO {}".format(quote(table), quote(unpartitioned)))
+    execute(
+        "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        "PARTITION BY RANGE ({})".format(
+            quote(table), quote(unpartitioned), quote("timestamp")
+        )
+    )
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT MIN({}), pg_get_serial_sequence(%s, 'id') FROM {}".format(
+                quote("timestamp"), quote(unpartitioned)
+            ),
+            [unpartitioned],
+        )
+        first, sequence = cursor.fetchone()
+    now = datetime.now(utc)
+    month = month_start(first or now)
+    while month <= add_months(month_start(now), PARTITIONS_AHEAD):
+        # Partition bounds must be literals (not parameters or casts) before Postgres 12.
+        execute(
+            "CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ('{}') TO ('{}')".format(
+                quote("{}_p{:04d}_{:02d}".format(table, month.year, month.month)),
+                quote(table),
+                month.isoformat(),
+                add_months(month, 1).isoformat(),
+            )
+        )
+        month = add_months(month, 1)
+    # Entries outside every month's partition, such as those submitted with a timestamp far in the future, go here.
+    execute(
+        "CREATE TABLE {} PARTITION OF {} DEFAULT".format(quote(table + "_default"), quote(table))
+    )
+    execute(
+        "INSERT INTO {table} ({columns}) SELECT {columns} FROM {unpartitioned}".format(
+            table=quote(table), columns=columns, unpartitioned=quote(unpartitioned)
+        )
+    )
+    # The id sequence would otherwise be dropped along with the table it was made for.
+    execute("ALTER SEQUENCE {} OWNED BY {}.{}".format(sequence, quote(table), quote("id")))
+    execute("DROP TABLE {}".format(quote(unpartitioned)))
+    add_keys_and_indexes(schema_editor, inventory_model)
+
+    # Partitions can only be moved between tables with the same columns and constraints, so the archive is made
+    # like the inventory table, without the id's default.
+    archive = archive_model._meta.db_table
+    execute("DROP TABLE {}".format(quote(archive)))
+    execute(
+        "CREATE TABLE {} (LIKE {} INCLUDING CONSTRAINTS) PARTITION BY RANGE ({})".format(
+            quote(archive), quote(table), quote("timestamp")
+        )
+    )
+    add_keys_and_indexes(schema_editor, archive_model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_currentinventory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryArchive',
+            fields=[
+                ('number', models.PositiveIntegerField()),
+                ('item_number', models.CharField(blank=True, max_length=255)),
+                ('daily_use', models.PositiveIntegerField(blank=True, null=True)),
+                ('projected_daily_use', models.PositiveIntegerField(blank=True, null=True)),
+                ('projected_run_out', models.DateField(blank=True, null=True)),
+                ('comments', models.TextField(blank=True)),
+                ('timestamp', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('item_type', models.CharField(choices=[('n95mask', 'N95 Masks'), ('gloves', 'Gloves'), ('alcohol', 'Alcohol Solutions'), ('swab', 'Swabs'), ('gowns', 'Gowns'), ('face_mask', 'Non-N95 Face Masks')], editable=False, max_length=64)),
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_inventories', to='core.Organization')),
+                ('ppetype', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_inventories', to='core.PPEType')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_inventories', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archived Inventory',
+                'verbose_name_plural': 'Archived Inventories',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='inventoryarchive',
+            index=models.Index(fields=['organization', 'timestamp', 'id'], name='inventoryarchive_org_ts_id_idx'),
+        ),
+        migrations.RunPython(partition_inventory, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.1.7 on 2026-10-18 16:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_inventoryarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryDailySummary',
+            fields=[
+                ('number', models.PositiveIntegerField()),
+                ('item_number', models.CharField(blank=True, max_length=255)),
+                ('daily_use', models.PositiveIntegerField(blank=True, null=True)),
+                ('projected_daily_use', models.PositiveIntegerField(blank=True, null=True)),
+                ('projected_run_out', models.DateField(blank=True, null=True)),
+                ('comments', models.TextField(blank=True)),
+                ('timestamp', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('item_type', models.CharField(choices=[('n95mask', 'N95 Masks'), ('gloves', 'Gloves'), ('alcohol', 'Alcohol Solutions'), ('swab', 'Swabs'), ('gowns', 'Gowns'), ('face_mask', 'Non-N95 Face Masks')], editable=False, max_length=64)),
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('entries', models.PositiveIntegerField()),
+                ('total_number', models.BigIntegerField()),
+                ('total_projected_daily_use', models.BigIntegerField()),
+                ('latest_projected_run_out', models.DateField(blank=True, null=True)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_summaries', to='core.Organization')),
+                ('ppetype', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_summaries', to='core.PPEType')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Inventory Daily Summary',
+                'verbose_name_plural': 'Inventory Daily Summaries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='inventorydailysummary',
+            index=models.Index(fields=['organization', 'timestamp', 'id'], name='inventorysummary_org_ts_id_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='inventorydailysummary',
+            unique_together={('organization', 'ppetype', 'day')},
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.1.7 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=1024, unique=True)),
+                ('kind', models.CharField(max_length=32)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('rows', models.BigIntegerField(default=0)),
+                ('organizations', models.TextField(default='[]')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,13 +1,21 @@
 import uuid
+from datetime import datetime, time, timedelta
 
 import pytz
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, UserManager
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.core.cache import cache
+from django.db.models import Avg, Case, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import TruncDay
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from mptt.models import MPTTModel, TreeForeignKey, TreeManager
 from timezone_field import TimeZoneField
 
+from .cache import bump_organizations_version, get_organizations_version
+
 
 class Organization(MPTTModel, models.Model):
     name = models.CharField(max_length=255, db_index=True, unique=True)
@@ -20,6 +28,54 @@ class Organization(MPTTModel, models.Model):
     def __str__(self):
         return "{}".format(self.name)
 
+    def get_provider_ids(self, selected=None, organizations_version=None):
+        """Returns the sorted ids of the providers whose inventory the organization sees: itself if it is a provider,
+        otherwise every provider below it, optionally only those among the ``selected`` ids.
+
+        The providers are found by the MPTT tree_id/lft/rght range of the organization and cached until any
+        organization changes, so dashboards and exports filter inventory by a short list of integers instead of
+        running a subquery over the tree every time. Callers that have already read the organizations version can
+        pass it in, saving a query."""
+        if organizations_version is None:
+            organizations_version = get_organizations_version()
+        key = "ppetrackr:provider-ids:{}:{}".format(self.pk, organizations_version)
+        ids = cache.get(key)
+        if ids is None:
+            if self.is_provider:
+                ids = [self.pk]
+            else:
+                # The tree may have changed since this instance was loaded, so its range is read afresh, in the same
+                # query as the providers.
+                node = Organization.objects.filter(pk=self.pk)
+                ids = list(
+                    Organization.objects.filter(
+                        tree_id=Subquery(node.values("tree_id")),
+                        lft__gt=Subquery(node.values("lft")),
+                        rght__lt=Subquery(node.values("rght")),
+                        is_provider=True,
+                    )
+                    .order_by("pk")
+                    .values_list("pk", flat=True)
+                )
+            cache.set(key, ids, timeout=None)
+        if selected is not None:
+            selected = set(selected)
+            ids = [pk for pk in ids if pk in selected]
+        return ids
+
+
+@receiver([post_save, post_delete], sender=Organization)
+def organizations_changed(sender, **kwargs):
+    bump_organizations_version()
+
+
+def q_for_ids(field, ids):
+    """Returns a filter for rows whose ``field`` is one of a sorted list of ids: a single range when the ids are
+    consecutive, otherwise an IN list of integers."""
+    if ids and ids[-1] - ids[0] + 1 == len(ids):
+        return Q(**{"{}__gte".format(field): ids[0], "{}__lte".format(field): ids[-1]})
+    return Q(**{"{}__in".format(field): ids})
+
 
 class User(AbstractUser):
     email = models.EmailField(
@@ -70,13 +126,9 @@ class PPEType(models.Model):
         verbose_name_plural = "PPE Types"
 
 
-class Inventory(models.Model):
-    organization = models.ForeignKey(
-        Organization,
-        on_delete=models.CASCADE,
-        related_name="inventories",
-        db_index=True,
-    )
+class AbstractInventory(models.Model):
+    """The fields of an inventory entry, shared by the inventory table, its archive and the daily summaries."""
+
     number = models.PositiveIntegerField()
     item_number = models.CharField(max_length=255, blank=True)
     daily_use = models.PositiveIntegerField(null=True, blank=True)
@@ -84,6 +136,31 @@ class Inventory(models.Model):
     projected_run_out = models.DateField(null=True, blank=True)
     comments = models.TextField(blank=True)
     timestamp = models.DateTimeField(default=timezone.now, db_index=True)
+    # A copy of ppetype.item_type, so that inventory can be filtered by type of PPE without joining PPEType.
+    item_type = models.CharField(
+        max_length=64, choices=PPEType.PPE_CHOICES, editable=False
+    )
+
+    def save(self, *args, **kwargs):
+        self.item_type = self.ppetype.item_type
+        super().save(*args, **kwargs)
+
+    @property
+    def local_date(self):
+        """The day this entry was submitted, in the timezone of the user who submitted it."""
+        return self.timestamp.astimezone(self.user.timezone).date()
+
+    class Meta:
+        abstract = True
+
+
+class Inventory(AbstractInventory):
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name="inventories",
+        db_index=True,
+    )
     ppetype = models.ForeignKey(
         "PPEType", related_name="inventories", on_delete=models.CASCADE
     )
@@ -97,3 +174,655 @@ class Inventory(models.Model):
     class Meta:
         verbose_name = "Inventory"
         verbose_name_plural = "Inventories"
+        indexes = [
+            # Incremental exports page through an organization's inventory in (timestamp, id) order.
+            models.Index(
+                fields=["organization", "timestamp", "id"],
+                name="inventory_org_ts_id_idx",
+            ),
+            # The forecasts look up one organization's inventory of each PPE type, oldest and newest first.
+            models.Index(
+                fields=["organization", "ppetype", "timestamp"],
+                name="inventory_org_ppetype_ts_idx",
+            ),
+            # Recent items and the dashboard table list one organization's inventory of a type of PPE, newest first.
+            models.Index(
+                fields=["organization", "item_type", "timestamp"],
+                name="inventory_org_type_ts_idx",
+            ),
+        ]
+
+
+class InventoryArchive(AbstractInventory):
+    """Inventory submitted before the last INVENTORY_HOT_MONTHS months. The roll_inventory_partitions command moves it
+    here out of the inventory table, so that the dashboard never reads it; exports and rebuilds of the rollups and
+    current inventory read both. Entries keep the ids they had in the inventory table."""
+
+    id = models.IntegerField(primary_key=True)
+    organization = models.ForeignKey(
+        Organization, on_delete=models.CASCADE, related_name="archived_inventories",
+    )
+    ppetype = models.ForeignKey(
+        "PPEType", on_delete=models.CASCADE, related_name="archived_inventories",
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="archived_inventories",
+    )
+
+    def __repr__(self):
+        return "<Archived inventory of {}: {}>".format(self, self.number)
+
+    class Meta:
+        verbose_name = "Archived Inventory"
+        verbose_name_plural = "Archived Inventories"
+        indexes = [
+            # Exports page through an organization's archived inventory in (timestamp, id) order.
+            models.Index(
+                fields=["organization", "timestamp", "id"],
+                name="inventoryarchive_org_ts_id_idx",
+            ),
+        ]
+
+
+class InventoryDailySummary(AbstractInventory):
+    """The inventory an organization submitted of one PPE type on one day (local to the submitting users), once it is
+    older than INVENTORY_RAW_RETENTION_DAYS. The compact_inventory command collapses each day's raw entries into one
+    of these, which is the day's last entry (keeping its id, user and timestamp) together with the day's totals, so
+    that exports and the current inventory can show the last entry and the daily rollups can still be rebuilt."""
+
+    id = models.IntegerField(primary_key=True)
+    organization = models.ForeignKey(
+        Organization, on_delete=models.CASCADE, related_name="inventory_summaries",
+    )
+    ppetype = models.ForeignKey(
+        "PPEType", on_delete=models.CASCADE, related_name="inventory_summaries",
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="inventory_summaries",
+    )
+    day = models.DateField()
+    entries = models.PositiveIntegerField()
+    # The day's totals, as the daily rollups count them.
+    total_number = models.BigIntegerField()
+    total_projected_daily_use = models.BigIntegerField()
+    latest_projected_run_out = models.DateField(null=True, blank=True)
+
+    @property
+    def local_date(self):
+        return self.day
+
+    def __repr__(self):
+        return "<Inventory summary of {} on {}: {}>".format(self, self.day, self.number)
+
+    class Meta:
+        verbose_name = "Inventory Daily Summary"
+        verbose_name_plural = "Inventory Daily Summaries"
+        unique_together = ("organization", "ppetype", "day")
+        indexes = [
+            # Exports page through an organization's summaries in (timestamp, id) order.
+            models.Index(
+                fields=["organization", "timestamp", "id"],
+                name="inventorysummary_org_ts_id_idx",
+            ),
+        ]
+
+
+class InventoryDailyRollupManager(models.Manager):
+    def record(self, inventories):
+        """Adds newly saved inventory entries into their daily rollups."""
+        totals = {}
+        for inventory in inventories:
+            key = (
+                inventory.organization_id,
+                inventory.item_type,
+                inventory.local_date,
+            )
+            totals[key] = _add_to_rollup(
+                totals.get(key),
+                inventory.number,
+                inventory.projected_daily_use,
+                inventory.projected_run_out,
+                inventory.timestamp,
+            )
+
+        with transaction.atomic():
+            for (organization_id, item_type, day), values in totals.items():
+                rollup, created = self.select_for_update().get_or_create(
+                    organization_id=organization_id,
+                    item_type=item_type,
+                    day=day,
+                    defaults=dict(zip(ROLLUP_FIELDS, values)),
+                )
+                if not created:
+                    current = [getattr(rollup, field) for field in ROLLUP_FIELDS]
+                    for field, value in zip(
+                        ROLLUP_FIELDS, _add_to_rollup(current, *values)
+                    ):
+                        setattr(rollup, field, value)
+                    rollup.save()
+
+    def refresh(self, inventories):
+        """Recomputes the daily rollups that the given inventory entries fall into from the raw inventory. Use this
+        after inventory has been changed or deleted, rather than just added."""
+        keys = {
+            (inventory.organization_id, inventory.item_type, inventory.local_date)
+            for inventory in inventories
+        }
+        with transaction.atomic():
+            for organization_id, item_type, day in keys:
+                # A local day starts and ends less than a day either side of the same UTC day.
+                start = datetime.combine(day - timedelta(days=1), time.min)
+                end = datetime.combine(day + timedelta(days=2), time.min)
+                values = self.history_totals(
+                    organization_id=organization_id,
+                    item_type=item_type,
+                    timestamp__gte=pytz.utc.localize(start),
+                    timestamp__lt=pytz.utc.localize(end),
+                ).get((organization_id, item_type, day))
+                if values is None:
+                    self.filter(
+                        organization_id=organization_id, item_type=item_type, day=day
+                    ).delete()
+                else:
+                    self.update_or_create(
+                        organization_id=organization_id,
+                        item_type=item_type,
+                        day=day,
+                        defaults=dict(zip(ROLLUP_FIELDS, values)),
+                    )
+
+    def rebuild(self, organizations=None):
+        """Throws away every rollup, or only those of the given organizations, and rebuilds them from the raw
+        inventory."""
+        rollups = self.all()
+        filters = {}
+        if organizations is not None:
+            rollups = rollups.filter(organization__in=organizations)
+            filters["organization__in"] = organizations
+        with transaction.atomic():
+            rollups.delete()
+            self.bulk_create(
+                [
+                    self.model(
+                        organization_id=organization_id,
+                        item_type=item_type,
+                        day=day,
+                        **dict(zip(ROLLUP_FIELDS, values)),
+                    )
+                    for (organization_id, item_type, day), values in self.history_totals(
+                        **filters
+                    ).items()
+                ]
+            )
+
+    def daily_totals(self, inventories):
+        """Returns the rollup values of some inventory, keyed by (organization id, item type, day), with each entry
+        counted on the day it was submitted in its submitter's timezone.
+
+        On Postgres, which converts timestamps to local time itself, the days are truncated and summed up by the
+        database, so only one row per organization, type of PPE and day is ever read back. SQLite has no timezone
+        support, so Django would convert every row in a Python function there, which is slower than reading the rows
+        and converting them here; see the benchmark_daily_bucketing command."""
+        inventories = inventories.order_by()
+        if connection.vendor == "postgresql":
+            return self._totals_in_database(inventories)
+        return self._totals_in_python(inventories)
+
+    def _totals_in_database(self, inventories):
+        # One query per timezone that the submitters are in.
+        timezones = inventories.values_list("user__timezone", flat=True).distinct()
+        totals = {}
+        for tz in timezones:
+            tz = pytz.timezone(str(tz))
+            rows = (
+                inventories.filter(user__timezone=tz)
+                .annotate(local_day=TruncDay("timestamp", tzinfo=tz))
+                .values_list("organization_id", "item_type", "local_day")
+                .annotate(
+                    Sum("number"),
+                    Sum("projected_daily_use"),
+                    Max("projected_run_out"),
+                    Max("timestamp"),
+                )
+            )
+            for organization_id, item_type, local_day, *values in rows:
+                key = (organization_id, item_type, local_day.date())
+                totals[key] = _add_to_rollup(totals.get(key), *values)
+        return totals
+
+    def _totals_in_python(self, inventories):
+        rows = inventories.values_list(
+            "organization_id",
+            "item_type",
+            "timestamp",
+            "user__timezone",
+            "number",
+            "projected_daily_use",
+            "projected_run_out",
+        ).iterator()
+        totals = {}
+        for organization_id, item_type, timestamp, tz, *values in rows:
+            key = (organization_id, item_type, timestamp.astimezone(pytz.timezone(str(tz))).date())
+            totals[key] = _add_to_rollup(totals.get(key), *values, timestamp)
+        return totals
+
+    def history_totals(self, **filters):
+        """Returns the daily_totals() of the inventory matching the filters, in the inventory table and its archive,
+        together with the totals kept in the daily summaries of compacted inventory."""
+        totals = {}
+        for model in [InventoryArchive, Inventory]:
+            inventories = model.objects.filter(**filters)
+            for key, values in self.daily_totals(inventories).items():
+                totals[key] = _add_to_rollup(totals.get(key), *values)
+        summaries = (
+            InventoryDailySummary.objects.filter(**filters)
+            .order_by()
+            .values_list("organization_id", "item_type", "day")
+            .annotate(
+                Sum("total_number"),
+                Sum("total_projected_daily_use"),
+                Max("latest_projected_run_out"),
+                Max("timestamp"),
+            )
+        )
+        for organization_id, item_type, day, *values in summaries:
+            key = (organization_id, item_type, day)
+            totals[key] = _add_to_rollup(totals.get(key), *values)
+        return totals
+
+
+ROLLUP_FIELDS = ("number", "projected_daily_use", "projected_run_out", "latest_timestamp")
+
+
+def _add_to_rollup(values, number, projected_daily_use, projected_run_out, timestamp):
+    """Folds one inventory entry (or another rollup's values) into a rollup's values, in ROLLUP_FIELDS order."""
+    if values is None:
+        return [number, projected_daily_use or 0, projected_run_out, timestamp]
+    total_number, total_daily_use, latest_run_out, latest_timestamp = values
+    if latest_run_out is None or (
+        projected_run_out is not None and projected_run_out > latest_run_out
+    ):
+        latest_run_out = projected_run_out
+    return [
+        total_number + number,
+        total_daily_use + (projected_daily_use or 0),
+        latest_run_out,
+        max(latest_timestamp, timestamp),
+    ]
+
+
+class InventoryDailyRollup(models.Model):
+    """The inventory an organization submitted for one type of PPE on one day (local to the submitting user), summed
+    up. These are kept up to date as inventory is submitted, so that the dashboard charts never need to read the raw
+    inventory history."""
+
+    organization = models.ForeignKey(
+        Organization, on_delete=models.CASCADE, related_name="daily_rollups",
+    )
+    item_type = models.CharField(max_length=64, choices=PPEType.PPE_CHOICES)
+    day = models.DateField()
+    number = models.BigIntegerField(default=0)
+    projected_daily_use = models.BigIntegerField(default=0)
+    projected_run_out = models.DateField(null=True, blank=True)
+    latest_timestamp = models.DateTimeField()
+
+    objects = InventoryDailyRollupManager()
+
+    def __str__(self):
+        return "{} - {} ({})".format(
+            self.organization, self.get_item_type_display(), self.day
+        )
+
+    class Meta:
+        verbose_name = "Inventory Daily Rollup"
+        verbose_name_plural = "Inventory Daily Rollups"
+        unique_together = ("organization", "item_type", "day")
+
+
+def latest_entries(inventories, latest=True):
+    """Returns the latest (or first) entry of each organization and PPE type among some inventory, in one query.
+
+    On databases that support it (Postgres) this is a DISTINCT ON, elsewhere each entry is found with a correlated
+    subquery, both over the (organization, ppetype, timestamp) index."""
+    order = ("-timestamp", "-id") if latest else ("timestamp", "id")
+    if connection.features.can_distinct_on_fields:
+        return inventories.order_by("organization", "ppetype", *order).distinct(
+            "organization", "ppetype"
+        )
+    end = (
+        inventories.filter(
+            organization=OuterRef("organization"), ppetype=OuterRef("ppetype")
+        )
+        .order_by(*order)
+        .values("pk")[:1]
+    )
+    return inventories.filter(pk=Subquery(end))
+
+
+CURRENT_INVENTORY_FIELDS = (
+    "item_type",
+    "number",
+    "daily_use",
+    "projected_daily_use",
+    "projected_run_out",
+    "timestamp",
+)
+
+
+class CurrentInventoryManager(models.Manager):
+    def record(self, inventories):
+        """Makes newly saved inventory entries the current inventory of their organization and PPE type, unless a
+        later entry already is. Call it in the same transaction as the entries are saved in."""
+        latest = {}
+        for inventory in inventories:
+            key = (inventory.organization_id, inventory.ppetype_id)
+            if key not in latest or inventory.timestamp >= latest[key].timestamp:
+                latest[key] = inventory
+        if not latest:
+            return
+
+        with transaction.atomic():
+            for retry in (False, True):
+                current = {
+                    (row.organization_id, row.ppetype_id): row
+                    for row in self.select_for_update().filter(
+                        organization_id__in={key[0] for key in latest},
+                        ppetype_id__in={key[1] for key in latest},
+                    )
+                }
+                missing = [
+                    self.model(
+                        organization_id=organization_id,
+                        ppetype_id=ppetype_id,
+                        **{field: getattr(inventory, field) for field in CURRENT_INVENTORY_FIELDS}
+                    )
+                    for (organization_id, ppetype_id), inventory in latest.items()
+                    if (organization_id, ppetype_id) not in current
+                ]
+                if not missing:
+                    break
+                try:
+                    with transaction.atomic():
+                        self.bulk_create(missing)
+                    break
+                except IntegrityError:
+                    # Another submission may have created some of the rows first, in which case they are locked and
+                    # updated instead on a second try. An error that isn't that race fails the second try too.
+                    if retry:
+                        raise
+
+            # Every row that is out of date is updated by one statement, picking each row's values with CASE.
+            updates = {
+                current[key].pk: inventory
+                for key, inventory in latest.items()
+                if key in current and inventory.timestamp >= current[key].timestamp
+            }
+            if updates:
+                fields = [self.model._meta.get_field(field) for field in CURRENT_INVENTORY_FIELDS]
+                self.filter(pk__in=updates).update(
+                    **{
+                        field.name: Case(
+                            *[
+                                When(pk=pk, then=Value(getattr(inventory, field.name), output_field=field))
+                                for pk, inventory in updates.items()
+                            ],
+                            output_field=field,
+                        )
+                        for field in fields
+                    }
+                )
+
+    def refresh(self, inventories):
+        """Finds the current inventory of the organizations and PPE types of the given entries again from the raw
+        inventory. Use this after inventory has been changed or deleted, rather than just added."""
+        keys = {
+            (inventory.organization_id, inventory.ppetype_id)
+            for inventory in inventories
+        }
+        with transaction.atomic():
+            for organization_id, ppetype_id in keys:
+                # The older tiers only need looking in if there is nothing in the newer ones.
+                for model in [Inventory, InventoryArchive, InventoryDailySummary]:
+                    inventory = (
+                        model.objects.filter(
+                            organization_id=organization_id, ppetype_id=ppetype_id
+                        )
+                        .order_by("-timestamp", "-id")
+                        .first()
+                    )
+                    if inventory is not None:
+                        break
+                if inventory is None:
+                    self.filter(
+                        organization_id=organization_id, ppetype_id=ppetype_id
+                    ).delete()
+                else:
+                    self.update_or_create(
+                        organization_id=organization_id,
+                        ppetype_id=ppetype_id,
+                        defaults={
+                            field: getattr(inventory, field)
+                            for field in CURRENT_INVENTORY_FIELDS
+                        },
+                    )
+
+    def rebuild(self, organizations=None):
+        """Throws away the current inventory of every organization, or only of the given ones, and finds it again
+        from the raw inventory."""
+        current = self.all()
+        if organizations is not None:
+            current = current.filter(organization__in=organizations)
+        fields = ("organization_id", "ppetype_id") + CURRENT_INVENTORY_FIELDS
+        latest = {}
+        for model in [InventoryDailySummary, InventoryArchive, Inventory]:
+            inventories = model.objects.all()
+            if organizations is not None:
+                inventories = inventories.filter(organization__in=organizations)
+            for pk, *values in latest_entries(inventories).values_list("pk", *fields):
+                key = tuple(values[:2])
+                # Entries are compared by (timestamp, id), as latest_entries() orders them.
+                if key not in latest or (values[-1], pk) > latest[key][0]:
+                    latest[key] = ((values[-1], pk), values)
+        with transaction.atomic():
+            current.delete()
+            self.bulk_create(
+                self.model(**dict(zip(fields, values)))
+                for order, values in latest.values()
+            )
+
+
+class CurrentInventory(models.Model):
+    """The latest inventory an organization submitted of each PPE type. This is kept up to date in the same
+    transaction as inventory is submitted, so what every provider has right now is read from one row per provider and
+    PPE type, however long their history is."""
+
+    organization = models.ForeignKey(
+        Organization, on_delete=models.CASCADE, related_name="current_inventories",
+    )
+    ppetype = models.ForeignKey(
+        PPEType, on_delete=models.CASCADE, related_name="current_inventories",
+    )
+    item_type = models.CharField(max_length=64, choices=PPEType.PPE_CHOICES)
+    number = models.PositiveIntegerField()
+    daily_use = models.PositiveIntegerField(null=True, blank=True)
+    projected_daily_use = models.PositiveIntegerField(null=True, blank=True)
+    projected_run_out = models.DateField(null=True, blank=True)
+    timestamp = models.DateTimeField()
+
+    objects = CurrentInventoryManager()
+
+    def __str__(self):
+        return "{} - {}".format(self.organization, self.ppetype)
+
+    class Meta:
+        verbose_name = "Current Inventory"
+        verbose_name_plural = "Current Inventories"
+        unique_together = ("organization", "ppetype")
+        indexes = [
+            models.Index(
+                fields=["organization", "item_type"],
+                name="currentinventory_org_type_idx",
+            ),
+        ]
+
+
+class InventoryForecastManager(models.Manager):
+    def compute(self, organizations=None):
+        """Recomputes the forecasts of the given organizations (all of them by default) from their inventory over the
+        last FORECAST_WINDOW_DAYS days.
+
+        Every provider and PPE type is forecast at once: one grouped query averages the reported daily use, one more
+        reads the first stock count of every pair in the window and the latest is read from the current inventory, so
+        the number of queries doesn't grow with the number of providers."""
+        now = timezone.now()
+        window = Inventory.objects.filter(
+            timestamp__gt=now - timedelta(days=settings.FORECAST_WINDOW_DAYS),
+            timestamp__lte=now,
+        )
+        if organizations is not None:
+            window = window.filter(organization__in=organizations)
+
+        pairs = {
+            (row["organization_id"], row["ppetype_id"]): row
+            for row in window.values("organization_id", "ppetype_id").annotate(
+                reported_daily_use=Avg("daily_use"),
+                first_timestamp=Min("timestamp"),
+                latest_timestamp=Max("timestamp"),
+            )
+        }
+        first_stock = self._first_stock(window)
+        current = CurrentInventory.objects.all()
+        if organizations is not None:
+            current = current.filter(organization__in=organizations)
+        latest_stock = {
+            (organization_id, ppetype_id): number
+            for organization_id, ppetype_id, number in current.values_list(
+                "organization_id", "ppetype_id", "number"
+            )
+        }
+
+        forecasts = []
+        for key, row in pairs.items():
+            stock = latest_stock.get(key)
+            if stock is None:
+                # Its current inventory is being rebuilt, and the next computation will pick it up.
+                continue
+            daily_consumption = _observed_consumption(
+                first_stock[key],
+                stock,
+                row["first_timestamp"],
+                row["latest_timestamp"],
+                row["reported_daily_use"],
+            )
+            days_remaining = (
+                stock / daily_consumption if daily_consumption else None
+            )
+            forecasts.append(
+                self.model(
+                    organization_id=key[0],
+                    ppetype_id=key[1],
+                    stock=stock,
+                    daily_consumption=daily_consumption,
+                    days_remaining=days_remaining,
+                    run_out=(
+                        timezone.localdate(row["latest_timestamp"])
+                        + timedelta(days=int(days_remaining))
+                        if days_remaining is not None
+                        else None
+                    ),
+                    latest_timestamp=row["latest_timestamp"],
+                    computed_at=now,
+                )
+            )
+
+        with transaction.atomic():
+            stale = self.all()
+            if organizations is not None:
+                stale = stale.filter(organization__in=organizations)
+            stale.delete()
+            self.bulk_create(forecasts)
+
+    @staticmethod
+    def _first_stock(window):
+        """Returns the stock counted by the first entry of each organization and PPE type in the window, keyed by
+        (organization id, PPE type id)."""
+        return {
+            (organization_id, ppetype_id): number
+            for organization_id, ppetype_id, number in latest_entries(
+                window, latest=False
+            ).values_list("organization_id", "ppetype_id", "number")
+        }
+
+
+def _observed_consumption(
+    first_stock, latest_stock, first_timestamp, latest_timestamp, reported_daily_use
+):
+    """Returns how many items a day are being used up: the fall in stock over the window where there is one to see,
+    otherwise the daily use reported over the window (None if there is neither)."""
+    days = (latest_timestamp - first_timestamp).total_seconds() / (24 * 60 * 60)
+    if days >= 1 and first_stock > latest_stock:
+        return (first_stock - latest_stock) / days
+    return reported_daily_use or None
+
+
+class InventoryForecast(models.Model):
+    """How long an organization's stock of one PPE type is expected to last, given how fast it has been used lately.
+    These are recomputed as inventory is submitted and by the compute_forecasts command. The stock, days remaining and
+    run out date are as of the latest count (latest_timestamp), so how many days are left now is worked out from them
+    when it is shown."""
+
+    organization = models.ForeignKey(
+        Organization, on_delete=models.CASCADE, related_name="forecasts",
+    )
+    ppetype = models.ForeignKey(
+        PPEType, on_delete=models.CASCADE, related_name="forecasts",
+    )
+    stock = models.BigIntegerField()
+    daily_consumption = models.FloatField(null=True, blank=True)
+    days_remaining = models.FloatField(null=True, blank=True)
+    run_out = models.DateField(null=True, blank=True)
+    latest_timestamp = models.DateTimeField()
+    computed_at = models.DateTimeField()
+
+    objects = InventoryForecastManager()
+
+    def __str__(self):
+        return "{} - {}".format(self.organization, self.ppetype)
+
+    class Meta:
+        verbose_name = "Inventory Forecast"
+        verbose_name_plural = "Inventory Forecasts"
+        unique_together = ("organization", "ppetype")
+
+
+class DataVersion(models.Model):
+    """A version number that changes whenever the data it is named after does, see cache.get_data_version(). These
+    are kept in the database rather than in a cache, so that every web process and every management command on every
+    instance reads and bumps the same ones."""
+
+    key = models.CharField(max_length=255, unique=True)
+    version = models.BigIntegerField()
+
+    def __str__(self):
+        return "{}: {}".format(self.key, self.version)
+
+
+class ImportCheckpoint(models.Model):
+    """How far the bulk_import command has got through a file. It is saved in the same transaction as each batch of
+    rows, so it never claims rows that weren't imported, nor misses ones that were."""
+
+    name = models.CharField(max_length=1024, unique=True)
+    kind = models.CharField(max_length=32)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    rows = models.BigIntegerField(default=0)
+    # The ids of the organizations imported inventory has been added to, as a JSON list.
+    organizations = models.TextField(default="[]")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{}: {} rows".format(self.name, self.rows)
@@ -0,0 +1,64 @@
+from django.db.models import Q
+
+from .exports import encode_cursor
+
+
+class KeysetPage:
+    """One page of a queryset, newest first, found by (timestamp, id) keyset pagination rather than OFFSET.
+
+    A page is fetched by seeking the (organization, timestamp, id) index to the row after the ``after`` cursor (or
+    before the ``before`` cursor) and reading ``size`` rows from there, so every page costs the same however deep it
+    is. There is no page count, only links to the first, previous and next pages."""
+
+    def __init__(self, queryset, size, after=None, before=None):
+        if before is not None:
+            timestamp, pk = before
+            rows = list(
+                queryset.filter(
+                    Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gt=pk)
+                ).order_by("timestamp", "pk")[: size + 1]
+            )
+            if len(rows) > size:
+                self.object_list = rows[:size][::-1]
+                self.has_previous = self.has_next = True
+                self.after = None
+                return
+            # Back at the newest rows, which make up a full first page.
+            after = None
+
+        if after is not None:
+            timestamp, pk = after
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk)
+            )
+        rows = list(queryset.order_by("-timestamp", "-pk")[: size + 1])
+        self.object_list = rows[:size]
+        self.after = after
+        self.has_previous = after is not None
+        self.has_next = len(rows) > size
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        last = self.object_list[-1]
+        return encode_cursor(last.timestamp, last.pk)
+
+    @property
+    def previous_cursor(self):
+        if not self.object_list:
+            # Paged past the oldest row (or it has since been deleted or archived), so go back from where this page
+            # was meant to start.
+            return encode_cursor(*self.after)
+        first = self.object_list[0]
+        return encode_cursor(first.timestamp, first.pk)
+
+
+def approximate_count(queryset, limit):
+    """Counts the rows of a queryset, but stops at ``limit``: returns (count, True) if there are more than that."""
+    count = queryset.order_by()[: limit + 1].count()
+    return min(count, limit), count > limit
@@ -0,0 +1,274 @@
+"""Inventory is stored in two tiers. The inventory table holds the last INVENTORY_HOT_MONTHS months, which is all the
+dashboard reads, and the inventory archive holds everything older, which only exports (and rebuilds of what is derived
+from inventory) read. The roll_inventory_partitions command moves inventory from one to the other as months go by.
+Either tier's oldest inventory is later compacted into daily summaries, see retention.py.
+
+On Postgres 11 and later both tables are partitioned by month of timestamp, so that a query that bounds the timestamp
+only reads the months it needs, and a month is archived by detaching its partition from the inventory table and
+attaching it to the archive, without copying a row. Elsewhere, archived entries are copied and deleted in batches.
+"""
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from .models import Inventory, InventoryArchive
+
+# The most entries moved to the archive per transaction.
+ARCHIVE_BATCH_SIZE = 500
+
+# How long moving a partition waits for the locks it needs, before leaving the partition for the next roll rather
+# than holding up the queries queued behind it.
+PARTITION_LOCK_TIMEOUT = "10s"
+
+PARTITION_NAME_RE = re.compile(r"_p(?P<year>\d{4})_(?P<month>\d{2})$")
+
+
+def month_start(value):
+    """Returns the first instant (in UTC) of the month that a datetime falls in."""
+    return value.astimezone(timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def archive_boundary(now=None):
+    """Returns the start of the oldest month kept in the inventory table. Inventory submitted before it belongs in the
+    archive."""
+    return add_months(month_start(now or timezone.now()), 1 - settings.INVENTORY_HOT_MONTHS)
+
+
+def partition_name(model, month):
+    return "{}_p{:04d}_{:02d}".format(model._meta.db_table, month.year, month.month)
+
+
+def default_partition_name(model):
+    return "{}_default".format(model._meta.db_table)
+
+
+def _bounds(month):
+    # Partition bounds must be literals (not parameters or casts) before Postgres 12. These are generated, never input.
+    return "FROM ('{}') TO ('{}')".format(
+        month.isoformat(), add_months(month, 1).isoformat()
+    )
+
+
+def _range_check(month):
+    return "{ts} IS NOT NULL AND {ts} >= '{start}' AND {ts} < '{end}'".format(
+        ts=connection.ops.quote_name("timestamp"),
+        start=month.isoformat(),
+        end=add_months(month, 1).isoformat(),
+    )
+
+
+def is_partitioned():
+    """Whether the inventory tables are partitioned by month, which they are on Postgres 11 and later."""
+    if connection.vendor != "postgresql" or connection.pg_version < 110000:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+            [Inventory._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def partitions(model):
+    """Returns the months that a partitioned table has partitions for, mapped to the partitions' names."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(%s)",
+            [model._meta.db_table],
+        )
+        names = [name for name, in cursor.fetchall()]
+    months = {}
+    for name in names:
+        match = PARTITION_NAME_RE.search(name)
+        if match:
+            month = datetime(
+                int(match.group("year")), int(match.group("month")), 1, tzinfo=timezone.utc
+            )
+            months[month] = name
+    return months
+
+
+def create_partition(model, month):
+    """Creates a partitioned table's partition for a month. Any entries of that month that are in the default
+    partition, for want of one, are moved into it."""
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    name = partition_name(model, month)
+    default = default_partition_name(model)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [default])
+        has_default = cursor.fetchone()[0] is not None
+        if has_default:
+            cursor.execute(
+                "SELECT 1 FROM {} WHERE {} LIMIT 1".format(quote(default), _range_check(month))
+            )
+            has_default = cursor.fetchone() is not None
+        if not has_default:
+            cursor.execute(
+                "CREATE TABLE {} PARTITION OF {} FOR VALUES {}".format(
+                    quote(name), quote(table), _bounds(month)
+                )
+            )
+            return
+        # A partition can't be created while the default partition has entries that belong in it.
+        cursor.execute(
+            "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)".format(
+                quote(name), quote(table)
+            )
+        )
+        cursor.execute(
+            "WITH moved AS (DELETE FROM {default} WHERE {check} RETURNING *) "
+            "INSERT INTO {name} SELECT * FROM moved".format(
+                default=quote(default), check=_range_check(month), name=quote(name)
+            )
+        )
+        cursor.execute(
+            "ALTER TABLE {} ATTACH PARTITION {} FOR VALUES {}".format(
+                quote(table), quote(name), _bounds(month)
+            )
+        )
+
+
+def archive_partition(month):
+    """Moves a month's partition from the inventory table to the archive, without copying it. The inventory table is
+    only locked for as long as it takes to detach the partition, and not at all if that lock can't be had within
+    PARTITION_LOCK_TIMEOUT, in which case OperationalError is raised."""
+    quote = connection.ops.quote_name
+    name = partition_name(Inventory, month)
+    check = name + "_range"
+    with connection.cursor() as cursor:
+        # With a check that every entry is in the month, attaching the partition doesn't scan it to make sure.
+        with transaction.atomic():
+            cursor.execute("SET LOCAL lock_timeout = %s", [PARTITION_LOCK_TIMEOUT])
+            cursor.execute(
+                "ALTER TABLE {name} DROP CONSTRAINT IF EXISTS {check}, "
+                "ADD CONSTRAINT {check} CHECK ({range})".format(
+                    name=quote(name), check=quote(check), range=_range_check(month)
+                )
+            )
+        with transaction.atomic():
+            cursor.execute("SET LOCAL lock_timeout = %s", [PARTITION_LOCK_TIMEOUT])
+            cursor.execute(
+                "ALTER TABLE {} DETACH PARTITION {}".format(
+                    quote(Inventory._meta.db_table), quote(name)
+                )
+            )
+            cursor.execute(
+                "ALTER TABLE {} ATTACH PARTITION {} FOR VALUES {}".format(
+                    quote(InventoryArchive._meta.db_table), quote(name), _bounds(month)
+                )
+            )
+            cursor.execute(
+                "ALTER TABLE {} RENAME TO {}".format(
+                    quote(name), quote(partition_name(InventoryArchive, month))
+                )
+            )
+            cursor.execute(
+                "ALTER TABLE {} DROP CONSTRAINT {}".format(
+                    quote(partition_name(InventoryArchive, month)), quote(check)
+                )
+            )
+
+
+def drop_partition(month):
+    """Drops the inventory table's partition for a month if it is empty, returning whether it was."""
+    quote = connection.ops.quote_name
+    name = partition_name(Inventory, month)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SET LOCAL lock_timeout = %s", [PARTITION_LOCK_TIMEOUT])
+        # Locked first, so that nothing can be added to it between checking that it is empty and dropping it.
+        cursor.execute("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE".format(quote(name)))
+        cursor.execute("SELECT 1 FROM {} LIMIT 1".format(quote(name)))
+        if cursor.fetchone() is not None:
+            return False
+        cursor.execute(
+            "ALTER TABLE {} DETACH PARTITION {}".format(
+                quote(Inventory._meta.db_table), quote(name)
+            )
+        )
+        cursor.execute("DROP TABLE {}".format(quote(name)))
+    return True
+
+
+def archive_entries(before, batch_size=ARCHIVE_BATCH_SIZE):
+    """Moves the entries submitted before a time from the inventory table to the archive, batch_size at a time, and
+    returns how many were moved. Each batch is copied and deleted in a transaction of its own, with its rows locked
+    so that no edit to them is lost, and keeps its ids."""
+    partitioned = is_partitioned()
+    archive_months = set(partitions(InventoryArchive)) if partitioned else set()
+    fields = [field.attname for field in Inventory._meta.concrete_fields]
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Inventory.objects.select_for_update()
+                .filter(timestamp__lt=before)
+                .order_by("timestamp", "id")
+                .values_list(*fields)[:batch_size]
+            )
+            if not rows:
+                return moved
+            entries = [InventoryArchive(**dict(zip(fields, row))) for row in rows]
+            if partitioned:
+                for month in {month_start(entry.timestamp) for entry in entries}:
+                    if month not in archive_months:
+                        create_partition(InventoryArchive, month)
+                        archive_months.add(month)
+            InventoryArchive.objects.bulk_create(entries)
+            Inventory.objects.filter(pk__in=[entry.pk for entry in entries]).delete()
+        moved += len(rows)
+
+
+def roll_partitions(now=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archives the inventory of every month before archive_boundary() and, if the tables are partitioned, makes sure
+    the coming INVENTORY_PARTITIONS_AHEAD months have partitions. Returns a dict of what was done: "created" and
+    "archived" hold the months whose partitions were created and moved whole, "skipped" the months whose partitions
+    couldn't be locked in time, and "entries" counts the entries moved one by one."""
+    now = now or timezone.now()
+    boundary = archive_boundary(now)
+    report = {"created": [], "archived": [], "skipped": [], "entries": 0}
+    if is_partitioned():
+        existing = partitions(Inventory)
+        month = month_start(now)
+        while month <= add_months(month_start(now), settings.INVENTORY_PARTITIONS_AHEAD):
+            if month not in existing:
+                create_partition(Inventory, month)
+                report["created"].append(month)
+            month = add_months(month, 1)
+
+        archived = partitions(InventoryArchive)
+        for month in sorted(existing):
+            # A month the archive already has a partition for is moved entry by entry below.
+            if month < boundary and month not in archived:
+                try:
+                    archive_partition(month)
+                except OperationalError:
+                    report["skipped"].append(month)
+                else:
+                    report["archived"].append(month)
+
+    # Whatever is left: entries in the default partition, or in a partition that couldn't be moved whole, or every
+    # archived entry if the tables aren't partitioned.
+    report["entries"] = archive_entries(boundary, batch_size)
+
+    if is_partitioned():
+        # The partitions left behind by entries moved one by one are empty now, unless entries were added since.
+        for month in sorted(partitions(Inventory)):
+            if month < boundary:
+                try:
+                    drop_partition(month)
+                except OperationalError:
+                    pass
+    return report
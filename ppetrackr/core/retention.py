@@ -0,0 +1,159 @@
+"""Raw inventory is only kept for INVENTORY_RAW_RETENTION_DAYS days. After that, the compact_inventory command
+collapses each organization's entries of a PPE type on one day into one InventoryDailySummary: the day's last entry,
+which is what exports and the current inventory show, along with the day's totals, which the daily rollups are
+rebuilt from. Hospitals submit several times a day, so this leaves a fraction of the rows in the history.
+"""
+from datetime import timedelta
+
+import pytz
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Sum
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from .partitions import archive_boundary
+from .models import (
+    Inventory,
+    InventoryArchive,
+    InventoryDailySummary,
+    User,
+    _add_to_rollup,
+)
+
+# The most raw entries compacted per transaction.
+COMPACTION_BATCH_SIZE = 1000
+
+# The fields of a raw entry, which a summary copies from the day's last one.
+ENTRY_FIELDS = [field.attname for field in Inventory._meta.concrete_fields]
+
+
+def compaction_cutoff(now=None, days=None):
+    """Returns the start of the UTC day ``days`` (INVENTORY_RAW_RETENTION_DAYS by default) before now. Inventory
+    submitted before it is compacted."""
+    if days is None:
+        days = settings.INVENTORY_RAW_RETENTION_DAYS
+    day = (now or timezone.now()).astimezone(timezone.utc) - timedelta(days=days)
+    return day.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def raw_history_start(now=None):
+    """Returns the time from which every entry is in the inventory table as it was submitted. Anything older is in
+    the archive or compacted into daily summaries (or soon will be), so lists of entries start here."""
+    return max(archive_boundary(now), compaction_cutoff(now))
+
+
+def stored_size(queryset):
+    """Returns about how many bytes the rows of a queryset take up in their table, not counting indexes: their size as
+    stored on Postgres, elsewhere the total length of their values."""
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    if connection.vendor == "postgresql":
+        sql = "pg_column_size({}.*)".format(table)
+    else:
+        sql = " + ".join(
+            "COALESCE(LENGTH({}.{}), 0)".format(table, connection.ops.quote_name(field.column))
+            for field in queryset.model._meta.concrete_fields
+        )
+    size = RawSQL(sql, [], output_field=BigIntegerField())
+    return queryset.order_by().aggregate(size=Sum(size))["size"] or 0
+
+
+def _add_to_summary(summary, entry, day):
+    """Folds one raw entry (a dict of its ENTRY_FIELDS) into the summary of its day, which may be None, and returns
+    the new summary."""
+    if summary is None:
+        entries, totals, last = 0, None, entry
+    else:
+        entries = summary.entries
+        totals = [
+            summary.total_number,
+            summary.total_projected_daily_use,
+            summary.latest_projected_run_out,
+            summary.timestamp,
+        ]
+        last = {field: getattr(summary, field) for field in ENTRY_FIELDS}
+        # Entries are compared by (timestamp, id), as the current inventory and exports order them.
+        if (entry["timestamp"], entry["id"]) > (last["timestamp"], last["id"]):
+            last = entry
+    total_number, total_projected_daily_use, latest_projected_run_out, timestamp = _add_to_rollup(
+        totals,
+        entry["number"],
+        entry["projected_daily_use"],
+        entry["projected_run_out"],
+        entry["timestamp"],
+    )
+    return InventoryDailySummary(
+        day=day,
+        entries=entries + 1,
+        total_number=total_number,
+        total_projected_daily_use=total_projected_daily_use,
+        latest_projected_run_out=latest_projected_run_out,
+        **last
+    )
+
+
+def compact_entries(before, batch_size=COMPACTION_BATCH_SIZE):
+    """Collapses the raw entries submitted before a time, in the archive and then the inventory table, into daily
+    summaries, batch_size entries at a time. Each batch is a transaction of its own that locks only its entries and
+    the summaries they are added to, so submissions and exports carry on meanwhile.
+
+    A day can be compacted over several batches (or runs, for a day that straddles ``before`` in its submitter's
+    timezone): its entries are then added to the summary already there, which keeps the id of the day's last entry.
+    Returns a dict with the number of "entries" compacted, the number of "summaries" added and the "bytes" they were
+    reduced by, as measured by stored_size()."""
+    report = {"entries": 0, "summaries": 0, "bytes": 0}
+    for model in [InventoryArchive, Inventory]:
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    model.objects.select_for_update()
+                    .filter(timestamp__lt=before)
+                    .order_by("timestamp", "id")
+                    .values_list(*ENTRY_FIELDS)[:batch_size]
+                )
+                if not rows:
+                    break
+                entries = [dict(zip(ENTRY_FIELDS, row)) for row in rows]
+                timezones = {
+                    pk: pytz.timezone(str(tz))
+                    for pk, tz in User.objects.filter(
+                        pk__in={entry["user_id"] for entry in entries}
+                    ).values_list("pk", "timezone")
+                }
+                days = {}
+                for entry in entries:
+                    day = entry["timestamp"].astimezone(timezones[entry["user_id"]]).date()
+                    key = (entry["organization_id"], entry["ppetype_id"], day)
+                    days.setdefault(key, []).append(entry)
+
+                existing = {
+                    (summary.organization_id, summary.ppetype_id, summary.day): summary
+                    for summary in InventoryDailySummary.objects.select_for_update().filter(
+                        organization_id__in={key[0] for key in days},
+                        ppetype_id__in={key[1] for key in days},
+                        day__in={key[2] for key in days},
+                    )
+                }
+                replaced = [existing[key].pk for key in days if key in existing]
+                summaries = []
+                for key, day_entries in days.items():
+                    summary = existing.get(key)
+                    for entry in day_entries:
+                        summary = _add_to_summary(summary, entry, key[2])
+                    summaries.append(summary)
+
+                compacted = model.objects.filter(pk__in=[entry["id"] for entry in entries])
+                old_summaries = InventoryDailySummary.objects.filter(pk__in=replaced)
+                reclaimed = stored_size(compacted) + stored_size(old_summaries)
+                old_summaries.delete()
+                InventoryDailySummary.objects.bulk_create(summaries)
+                compacted.delete()
+                reclaimed -= stored_size(
+                    InventoryDailySummary.objects.filter(
+                        pk__in=[summary.pk for summary in summaries]
+                    )
+                )
+            report["entries"] += len(entries)
+            report["summaries"] += len(summaries) - len(replaced)
+            report["bytes"] += reclaimed
+    return report
@@ -1,3 +1,1017 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta
+from unittest import mock, skipUnless
+from xml.etree import ElementTree
 
-# Create your tests here.
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytz
+from django.conf import settings
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .backends import load_request_user
+from .cache import bump_data_version, get_data_version, get_organizations_version, get_versions
+from .dash_app import (
+    TABLE_COLUMNS,
+    downsample,
+    get_forecasts,
+    parse_zoom_range,
+    search_org_selector_options,
+    split_filter_part,
+    update_current_inventory,
+    update_projected_inventory,
+    update_remaining_inventory,
+    update_table,
+)
+from .downsampling import lttb
+from .export_jobs import MISSING, artifact_path, evict_artifacts, get_export_version, start_export
+from .exports import (
+    ARROW_SCHEMA,
+    EXPORT_HEADERS,
+    decode_cursor,
+    encode_cursor,
+    get_export_queryset,
+    get_incremental_queryset,
+    iter_export_rows,
+    write_export,
+)
+from .ingest import ingest_inventory
+from .management.commands.check_query_plans import full_scans, hot_queries, seed
+from .models import (
+    CurrentInventory,
+    ImportCheckpoint,
+    Inventory,
+    InventoryArchive,
+    InventoryDailyRollup,
+    InventoryDailySummary,
+    InventoryForecast,
+    Organization,
+    PPEType,
+    User,
+    latest_entries,
+)
+from .pagination import KeysetPage
+from .partitions import (
+    add_months,
+    archive_boundary,
+    archive_entries,
+    create_partition,
+    is_partitioned,
+    partitions,
+    roll_partitions,
+)
+from .retention import compact_entries, raw_history_start
+
+ROLLUP_VALUES = ["organization", "item_type", "day", "number", "projected_daily_use", "projected_run_out"]
+CURRENT_VALUES = ["organization", "ppetype", "number", "daily_use", "projected_daily_use", "timestamp"]
+
+
+class InventoryTestCase(TestCase):
+    """Sets up a parent organization with two providers, each with a user, and a PPE type of every kind."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.parent = Organization.objects.create(name="Parent", is_provider=False)
+        cls.providers = [
+            Organization.objects.create(
+                name="Provider {}".format(i), is_provider=True, parent=cls.parent
+            )
+            for i in range(2)
+        ]
+        cls.users = [
+            User.objects.create_user(
+                "user{}".format(i),
+                "user{}@example.com".format(i),
+                "password",
+                organization=provider,
+                timezone="America/New_York",
+            )
+            for i, provider in enumerate(cls.providers)
+        ]
+        # Read back, so that their timezones are tzinfo objects rather than the names they were created with.
+        cls.users = [User.objects.get(pk=user.pk) for user in cls.users]
+        cls.ppetypes = {
+            item_type: PPEType.objects.create(
+                item_type=item_type, item_attribute="Nitrile", size="M"
+            )
+            for item_type, name in PPEType.PPE_CHOICES
+        }
+
+    def add_inventory(self, provider, user, timestamp, number=100, item_type=PPEType.GLOVES):
+        ppetype = self.ppetypes[item_type]
+        return Inventory.objects.create(
+            organization=provider,
+            user=user,
+            ppetype=ppetype,
+            number=number,
+            daily_use=10,
+            projected_daily_use=12,
+            timestamp=timestamp,
+        )
+
+
+class DataVersionTests(TestCase):
+    def test_versions_outlive_the_caches(self):
+        organization = Organization.objects.create(name="Provider", is_provider=True)
+        version = get_data_version(organization)
+        # Another process bumping the version is seen however empty this process's caches are.
+        bump_data_version(organization)
+        for cache in caches.all():
+            cache.clear()
+        self.assertEqual(get_data_version(organization), version + 1)
+
+    def test_rebuilding_the_rollups_bumps_every_tree(self):
+        organizations = [
+            Organization.objects.create(name="Provider {}".format(i), is_provider=True) for i in range(2)
+        ]
+        versions = [get_data_version(organization) for organization in organizations]
+        call_command("rebuild_inventory_rollups", stdout=io.StringIO())
+        self.assertEqual(
+            [get_data_version(organization) for organization in organizations],
+            [version + 1 for version in versions],
+        )
+
+
+class ExportJobTests(InventoryTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings_override = override_settings(EXPORT_CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_backdated_inventory_changes_the_export_version(self):
+        self.add_inventory(self.providers[0], self.users[0], timezone.now())
+        version = get_export_version(self.parent)
+        row = {
+            "item_type": PPEType.GLOVES,
+            "item_attribute": "Nitrile",
+            "size": "M",
+            "number": "5",
+            "timestamp": "2020-01-01 12:00",
+        }
+        report = ingest_inventory([(2, row)], self.users[1])
+        self.assertEqual(report.created, 1)
+        self.assertEqual(report.backdated, 0)  # Backdated in the tree, but not in its own organization.
+        self.assertNotEqual(get_export_version(self.parent), version)
+
+    def test_joining_provider_changes_the_export_version(self):
+        version = get_export_version(self.parent)
+        Organization.objects.create(name="New provider", is_provider=True, parent=self.parent)
+        self.assertNotEqual(get_export_version(self.parent), version)
+
+    @override_settings(EXPORT_CACHE_MAX_BYTES=10, EXPORT_JOB_TIMEOUT=60)
+    def test_eviction_covers_error_and_dead_part_files(self):
+        ages = {"1-1-1.csv": 0, "1-2-1.csv.error": 100, "1-3-1.csv.part": 0, "1-4-1.csv.part": 100}
+        for name, age in ages.items():
+            with open(artifact_path(name), "w") as f:
+                f.write("x" * 8)
+            stamp = timezone.now().timestamp() - age
+            os.utime(artifact_path(name), (stamp, stamp))
+        evict_artifacts()
+        # The oldest of the finished export and error file goes; so does the .part file nothing touched for longer
+        # than EXPORT_JOB_TIMEOUT, but not the live one.
+        self.assertEqual(
+            sorted(os.listdir(self.cache_dir)), ["1-1-1.csv", "1-3-1.csv.part"]
+        )
+
+    @override_settings(EXPORT_JOB_TIMEOUT=60)
+    def test_builds_claimed_since_the_status_was_read_are_left_alone(self):
+        job_id = "{}-{}.csv".format(self.parent.pk, get_export_version(self.parent))
+        part = artifact_path(job_id) + ".part"
+        for age, submitted in [(0, False), (100, True)]:
+            with open(part, "w") as f:
+                f.write("half")
+            stamp = timezone.now().timestamp() - age
+            os.utime(part, (stamp, stamp))
+            # As if the .part file was made by another process right after the status was read.
+            with mock.patch("ppetrackr.core.export_jobs.get_job_status", return_value=MISSING), mock.patch(
+                "ppetrackr.core.export_jobs._executor"
+            ) as executor:
+                self.assertEqual(start_export(self.parent, "csv"), job_id)
+            self.assertEqual(executor.submit.called, submitted)
+            with open(part) as f:
+                # A live build's file is kept, a stale one is replaced by a new claim.
+                self.assertEqual(f.read(), "" if submitted else "half")
+            os.remove(part)
+
+    def test_progress_is_reported_while_rows_are_written(self):
+        for day in range(1, 4):
+            self.add_inventory(
+                self.providers[0], self.users[0], datetime(2020, 1, day, tzinfo=timezone.utc)
+            )
+        calls = []
+        with mock.patch("ppetrackr.core.exports.EXPORT_CHUNK_SIZE", 1):
+            write_export(
+                self.parent, "xlsx", io.BytesIO(), on_progress=lambda: calls.append(1)
+            )
+        self.assertEqual(len(calls), 3)
+
+
+class ExportTestCase(InventoryTestCase):
+    """Adds an entry for each provider, and a parent organization's user to export them."""
+
+    def setUp(self):
+        self.entries = [
+            Inventory.objects.create(
+                organization=self.providers[0],
+                user=self.users[0],
+                ppetype=self.ppetypes[PPEType.N95MASK],
+                number=120,
+                item_number="N-1",
+                daily_use=10,
+                projected_daily_use=15,
+                projected_run_out=date(2020, 2, 1),
+                comments='Counted twice, "by hand"\nin the store',
+                timestamp=datetime(2020, 1, 2, 3, 4, 5, 6000, tzinfo=timezone.utc),
+            ),
+            Inventory.objects.create(
+                organization=self.providers[1],
+                user=self.users[1],
+                ppetype=self.ppetypes[PPEType.GLOVES],
+                number=7,
+                timestamp=datetime(2020, 1, 3, tzinfo=timezone.utc),
+            ),
+        ]
+        self.parent_user = User.objects.create_user(
+            "parent", "parent@example.com", "password", organization=self.parent, timezone="UTC"
+        )
+
+
+class CsvExportTests(ExportTestCase):
+    expected = [
+        [
+            "Provider 0", "N95 Masks", "N-1", "Nitrile", "M", "120", "10", "15", "2020-02-01",
+            "2020-01-02 03:04:05.006000+00:00", 'Counted twice, "by hand"\nin the store',
+        ],
+        ["Provider 1", "Gloves", "", "Nitrile", "M", "7", "", "", "", "2020-01-03 00:00:00+00:00", ""],
+    ]
+
+    def test_incremental_exports_are_streamed(self):
+        self.client.force_login(self.parent_user)
+        response = self.client.get(reverse("download_dashboard_view"), {"format": "csv", "since": ""})
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(rows, [EXPORT_HEADERS] + self.expected)
+
+    def test_full_exports_hold_the_same_rows(self):
+        output = io.BytesIO()
+        write_export(self.parent, "csv", output)
+        rows = list(csv.reader(io.StringIO(output.getvalue().decode())))
+        self.assertEqual(rows[0], EXPORT_HEADERS)
+        self.assertEqual(sorted(rows[1:]), self.expected)
+
+    def test_related_fields_are_joined_in(self):
+        for i in range(20):
+            self.add_inventory(self.providers[i % 2], self.users[i % 2], timezone.now())
+        queryset = get_export_queryset(self.parent)
+        with self.assertNumQueries(1):
+            rows = list(iter_export_rows(queryset))
+        self.assertEqual(len(rows), 22)
+
+
+class XlsxExportTests(ExportTestCase):
+    def read_sheet(self, output):
+        """Returns the first sheet's cell values, as text, row by row with blank cells as None."""
+        namespace = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+        with zipfile.ZipFile(output) as book:
+            sheet = ElementTree.fromstring(book.read("xl/worksheets/sheet1.xml"))
+        rows = []
+        for row in sheet.iterfind("x:sheetData/x:row", namespace):
+            values = [None] * len(EXPORT_HEADERS)
+            for cell in row.iterfind("x:c", namespace):
+                column = ord(cell.get("r")[0]) - ord("A")
+                values[column] = "".join(cell.itertext()) or None
+            rows.append(values)
+        return rows
+
+    def test_cells_are_typed(self):
+        output = io.BytesIO()
+        write_export(self.parent, "xlsx", output)
+        rows = self.read_sheet(output)
+        self.assertEqual(rows[0], EXPORT_HEADERS)
+        rows = sorted(rows[1:], key=lambda row: row[0])
+        self.assertEqual(len(rows), 2)
+
+        # Numbers and dates are numeric cells, dates as days since 1899-12-30 with the time as the fraction of a day.
+        row = rows[0]
+        self.assertEqual(
+            row[:9], ["Provider 0", "N95 Masks", "N-1", "Nitrile", "M", "120", "10", "15", "43862"]
+        )
+        self.assertAlmostEqual(float(row[9]), 43832 + (3 * 3600 + 4 * 60 + 5.006) / 86400, places=8)
+        self.assertEqual(row[10], 'Counted twice, "by hand"\nin the store')
+        self.assertEqual(
+            rows[1], ["Provider 1", "Gloves", None, "Nitrile", "M", "7", None, None, None, "43833", None]
+        )
+
+
+class ArrowExportTests(ExportTestCase):
+    expected = [
+        {
+            "organization": "Provider 0",
+            "item_category": "N95 Masks",
+            "model_number": "N-1",
+            "attribute": "Nitrile",
+            "size": "M",
+            "quantity": 120,
+            "daily_use": 10,
+            "projected_daily_use": 15,
+            "projected_run_out": date(2020, 2, 1),
+            "timestamp": datetime(2020, 1, 2, 3, 4, 5, 6000, tzinfo=timezone.utc),
+            "comments": 'Counted twice, "by hand"\nin the store',
+        },
+        {
+            "organization": "Provider 1",
+            "item_category": "Gloves",
+            "model_number": "",
+            "attribute": "Nitrile",
+            "size": "M",
+            "quantity": 7,
+            "daily_use": None,
+            "projected_daily_use": None,
+            "projected_run_out": None,
+            "timestamp": datetime(2020, 1, 3, tzinfo=timezone.utc),
+            "comments": "",
+        },
+    ]
+
+    def export(self, file_format):
+        output = io.BytesIO()
+        write_export(self.parent, file_format, output)
+        output.seek(0)
+        return output
+
+    def assertRoundTrips(self, table):
+        self.assertEqual(table.schema, ARROW_SCHEMA)
+        rows = sorted(table.to_pylist(), key=lambda row: row["organization"])
+        self.assertEqual(rows, self.expected)
+
+    def test_parquet_round_trip(self):
+        self.assertRoundTrips(pq.read_table(self.export("parquet")))
+
+    def test_arrow_round_trip(self):
+        self.assertRoundTrips(pa.ipc.open_file(self.export("arrow")).read_all())
+
+    def test_batches_share_dictionaries(self):
+        for i in range(5):
+            self.add_inventory(self.providers[i % 2], self.users[i % 2], timezone.now())
+        with mock.patch("ppetrackr.core.exports.EXPORT_BATCH_SIZE", 2):
+            reader = pa.ipc.open_file(self.export("arrow"))
+        self.assertEqual(reader.num_record_batches, 4)
+        table = reader.read_all()
+        self.assertEqual(table.num_rows, 7)
+        self.assertEqual(
+            sorted(table.column("organization").to_pylist()), ["Provider 0"] * 4 + ["Provider 1"] * 3
+        )
+
+
+class KeysetPageTests(InventoryTestCase):
+    def test_empty_page_links_back(self):
+        entry = self.add_inventory(
+            self.providers[0], self.users[0], datetime(2020, 1, 1, tzinfo=timezone.utc)
+        )
+        # A link to the page after the oldest entry, say one that has since been deleted.
+        page = KeysetPage(Inventory.objects.all(), 10, after=(entry.timestamp, entry.pk))
+        self.assertEqual(len(page), 0)
+        self.assertTrue(page.has_previous)
+        self.assertEqual(decode_cursor(page.previous_cursor), (entry.timestamp, entry.pk))
+
+
+class CurrentInventoryTests(InventoryTestCase):
+    def test_record_batches_its_writes(self):
+        day = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        existing = [
+            self.add_inventory(provider, user, day, item_type=item_type)
+            for provider, user in zip(self.providers, self.users)
+            for item_type in self.ppetypes
+        ]
+        CurrentInventory.objects.record(existing[::2])
+        later = [
+            self.add_inventory(
+                inventory.organization, inventory.user, day + timedelta(days=1), number=5,
+                item_type=inventory.item_type,
+            )
+            for inventory in existing
+        ]
+        # Locking the rows, creating the missing ones and updating the rest, each in one statement, however many there
+        # are. The rest are the savepoints around them.
+        with self.assertNumQueries(7):
+            CurrentInventory.objects.record(later)
+        # An older entry doesn't replace a newer one.
+        CurrentInventory.objects.record(existing)
+        self.assertEqual(CurrentInventory.objects.count(), len(later))
+        self.assertEqual(
+            {(row.organization_id, row.ppetype_id, row.number) for row in CurrentInventory.objects.all()},
+            {(inventory.organization_id, inventory.ppetype_id, 5) for inventory in later},
+        )
+
+    def test_latest_entries_are_found_in_one_query(self):
+        now = timezone.now()
+        entries = [
+            self.add_inventory(provider, user, now - timedelta(days=days_ago), number=days_ago, item_type=item_type)
+            for provider, user in zip(self.providers, self.users)
+            for item_type in [PPEType.GLOVES, PPEType.GOWNS]
+            for days_ago in [3, 1, 2]
+        ]
+        # A later entry with the same timestamp wins, as (timestamp, id) orders them.
+        tie = self.add_inventory(self.providers[0], self.users[0], entries[1].timestamp, number=0)
+        expected = {(entry.organization_id, entry.ppetype_id): 1 for entry in entries}
+        expected[(tie.organization_id, tie.ppetype_id)] = 0
+        with self.assertNumQueries(1):
+            latest = latest_entries(Inventory.objects.all()).values_list("organization", "ppetype", "number")
+            self.assertEqual({(organization, ppetype): number for organization, ppetype, number in latest}, expected)
+
+    def test_errors_other_than_a_race_are_raised(self):
+        inventory = self.add_inventory(self.providers[0], self.users[0], timezone.now())
+        # As a foreign key violation would, every try; a race is over once the other row is there to lock.
+        with mock.patch.object(
+            CurrentInventory.objects, "bulk_create", side_effect=IntegrityError
+        ) as bulk_create, self.assertRaises(IntegrityError):
+            CurrentInventory.objects.record([inventory])
+        self.assertEqual(bulk_create.call_count, 2)
+
+
+class InventoryForecastTests(InventoryTestCase):
+    def setUp(self):
+        # Used up 10 a day over the last ten days, with 50 left as of two days ago.
+        now = timezone.now()
+        for days_ago, number in [(12, 150), (2, 50)]:
+            inventory = self.add_inventory(
+                self.providers[0], self.users[0], now - timedelta(days=days_ago), number=number
+            )
+            CurrentInventory.objects.record([inventory])
+
+    def test_days_remaining_count_down_from_the_latest_count(self):
+        InventoryForecast.objects.compute()
+        forecast = InventoryForecast.objects.get()
+        self.assertAlmostEqual(forecast.days_remaining, 5)
+        for user in [self.users[0], User.objects.create_user("parent", organization=self.parent)]:
+            [entry] = get_forecasts(user, get_versions(user.organization), PPEType.GLOVES, None)
+            self.assertAlmostEqual(entry["days_remaining"], 3, places=3)
+
+    def test_pairs_without_current_inventory_are_skipped(self):
+        CurrentInventory.objects.all().delete()
+        InventoryForecast.objects.compute()
+        self.assertFalse(InventoryForecast.objects.exists())
+
+
+class DailyBucketingTests(InventoryTestCase):
+    def assertBucketedOn(self, tz, instants, day):
+        """Checks that entries submitted at the given UTC instants by a user in the timezone are all counted on the
+        (local) day, both by the database and by the Python loop that daily_totals() uses where the database has no
+        timezone support."""
+        username = "{}-{}".format(tz, day)
+        user = User.objects.create_user(
+            username, username + "@example.com", organization=self.providers[0], timezone=tz
+        )
+        user = User.objects.get(pk=user.pk)
+        for instant in instants:
+            self.add_inventory(self.providers[0], user, pytz.utc.localize(instant), number=1)
+        inventories = Inventory.objects.filter(user=user)
+        for totals in [
+            InventoryDailyRollup.objects._totals_in_database(inventories),
+            InventoryDailyRollup.objects._totals_in_python(inventories),
+        ]:
+            self.assertEqual({key[2]: values[0] for key, values in totals.items()}, {day: len(instants)})
+
+    def test_new_york_springing_forward(self):
+        # Clocks go forward at 2am on 2020-03-08: 01:30 EST and 03:30 EDT are both that day.
+        self.assertBucketedOn(
+            "America/New_York", [datetime(2020, 3, 8, 6, 30), datetime(2020, 3, 8, 7, 30)], date(2020, 3, 8)
+        )
+
+    def test_new_york_falling_back(self):
+        # Clocks go back at 2am on 2020-11-01: 23:30 EDT is the day before, 00:30 EDT and 23:30 EST are that day.
+        self.assertBucketedOn("America/New_York", [datetime(2020, 11, 1, 3, 30)], date(2020, 10, 31))
+        self.assertBucketedOn(
+            "America/New_York", [datetime(2020, 11, 1, 4, 30), datetime(2020, 11, 2, 4, 30)], date(2020, 11, 1)
+        )
+
+    def test_london_midnight_moves_with_summer_time(self):
+        # Midnight is 23:00 UTC in summer time and 00:00 UTC in winter.
+        self.assertBucketedOn("Europe/London", [datetime(2020, 3, 28, 23, 30)], date(2020, 3, 28))
+        self.assertBucketedOn("Europe/London", [datetime(2020, 3, 29, 23, 30)], date(2020, 3, 30))
+        self.assertBucketedOn(
+            "Europe/London", [datetime(2020, 10, 24, 23, 30), datetime(2020, 10, 25, 23, 30)], date(2020, 10, 25)
+        )
+
+
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.parent = seed(rows=5000, providers=5)
+        cls.provider = Organization.objects.get(pk=cls.parent.get_provider_ids()[0])
+        cls.user = User.objects.create_user(
+            "query-plans", "query-plans@example.com", "password", organization=cls.provider
+        )
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in hot_queries(self.parent).items():
+            with self.subTest(name):
+                self.assertEqual(full_scans(queryset.explain()), [])
+
+    def test_inventory_list_pages_cost_the_same_however_deep(self):
+        self.client.force_login(self.user)
+        url = reverse("inventory_list_view")
+        deep = Inventory.objects.filter(
+            organization=self.provider, timestamp__gte=raw_history_start()
+        ).order_by("timestamp", "pk")[20]
+        # The session, the user with their organization, the page and the count.
+        for params in [{}, {"after": encode_cursor(deep.timestamp, deep.pk)}]:
+            with self.subTest(params=params), self.assertNumQueries(4):
+                response = self.client.get(url, params)
+            self.assertEqual(len(response.context["inventory_list"]), settings.INVENTORY_LIST_PAGE_SIZE)
+
+
+class BulkImportTests(InventoryTestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".csv")
+        self.addCleanup(os.remove, self.path)
+        with os.fdopen(handle, "w") as f:
+            f.write("organization,item_type,item_attribute,size,number\n")
+            for number in range(4):
+                f.write("Provider 0,gloves,Nitrile,M,{}\n".format(number))
+
+    def bulk_import(self):
+        call_command(
+            "bulk_import", "inventory", self.path, user="user0", batch_size=2, stdout=io.StringIO()
+        )
+
+    def test_resuming_after_a_failed_batch_imports_every_row_once(self):
+        save = ImportCheckpoint.save
+        saves = []
+
+        def fail_on_second_batch(checkpoint, *args, **kwargs):
+            saves.append(checkpoint.rows)
+            if len(saves) == 3:  # Creating the checkpoint, then one save per batch.
+                raise KeyboardInterrupt
+            return save(checkpoint, *args, **kwargs)
+
+        with mock.patch.object(ImportCheckpoint, "save", fail_on_second_batch):
+            with self.assertRaises(KeyboardInterrupt):
+                self.bulk_import()
+        self.assertEqual(ImportCheckpoint.objects.get().rows, 2)
+        self.assertEqual(Inventory.objects.count(), 2)
+
+        self.bulk_import()
+        self.assertEqual(
+            sorted(Inventory.objects.values_list("number", flat=True)), [0, 1, 2, 3]
+        )
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+
+class RequestUserTests(InventoryTestCase):
+    def test_deactivation_takes_effect_straight_away(self):
+        self.client.force_login(self.users[0])
+        url = reverse("inventory_list_view")
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # As another process would, without any signals in this one.
+        User.objects.filter(pk=self.users[0].pk).update(is_active=False)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_pages_load_the_user_and_organization_in_one_query(self):
+        self.client.force_login(self.users[0])
+        # The session, then the user with their organization, where Django's own backend would take three queries.
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(reverse("home_view")).status_code, 200)
+
+    def test_parents_see_their_providers(self):
+        user = User.objects.create_user(
+            "parent", "parent@example.com", "password", organization=self.parent
+        )
+        self.client.force_login(user)
+        request_user = self.client.get(reverse("home_view")).wsgi_request.user
+        self.assertEqual(
+            request_user.organization.get_provider_ids(),
+            [provider.pk for provider in self.providers],
+        )
+
+    def test_sessions_of_the_replaced_backend_stay_signed_in(self):
+        self.client.force_login(self.users[0], backend="django.contrib.auth.backends.ModelBackend")
+        self.assertEqual(self.client.get(reverse("inventory_list_view")).status_code, 200)
+
+
+class PartitionTests(InventoryTestCase):
+    def setUp(self):
+        self.month = add_months(archive_boundary(), -2)
+        self.old = self.add_inventory(self.providers[0], self.users[0], self.month + timedelta(days=3))
+        self.recent = self.add_inventory(self.providers[0], self.users[0], timezone.now())
+
+    def assertArchived(self):
+        self.assertEqual(list(Inventory.objects.values_list("pk", flat=True)), [self.recent.pk])
+        self.assertEqual(list(InventoryArchive.objects.values_list("pk", flat=True)), [self.old.pk])
+
+    def test_roll_moves_old_inventory_to_the_archive(self):
+        roll_partitions()
+        self.assertArchived()
+
+    @skipUnless(
+        connection.vendor == "postgresql" and connection.pg_version >= 110000,
+        "The inventory tables are only partitioned on Postgres 11 and later.",
+    )
+    def test_roll_moves_old_months_as_whole_partitions(self):
+        self.assertTrue(is_partitioned())
+        # The migration made partitions from the current month on, so the old entry is in the default partition
+        # until its month gets one.
+        create_partition(Inventory, self.month)
+        report = roll_partitions()
+        self.assertEqual(report["archived"], [self.month])
+        self.assertEqual(report["entries"], 0)
+        self.assertNotIn(self.month, partitions(Inventory))
+        self.assertIn(self.month, partitions(InventoryArchive))
+        self.assertArchived()
+
+
+class DashboardCallbackTests(InventoryTestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        now = timezone.now()
+        for provider, user in zip(self.providers, self.users):
+            inventory = self.add_inventory(provider, user, now - timedelta(days=1))
+            CurrentInventory.objects.record([inventory])
+            InventoryDailyRollup.objects.record([inventory])
+        InventoryForecast.objects.compute()
+
+    def test_a_warm_cache_costs_one_query_per_callback(self):
+        parent = User.objects.create_user("parent", "parent@example.com", organization=self.parent)
+        for user in [load_request_user(self.users[0].pk), load_request_user(parent.pk)]:
+            callbacks = [
+                lambda: update_table(PPEType.GLOVES, None, 0, [], "", 25, user=user),
+                lambda: update_current_inventory(PPEType.GLOVES, None, None, None, user=user),
+                lambda: update_projected_inventory(PPEType.GLOVES, None, None, None, user=user),
+                lambda: update_remaining_inventory(PPEType.GLOVES, None, user=user),
+            ]
+            for callback in callbacks:
+                callback()
+            # Only the versions are read, both in one query, to find the results cached under them.
+            for callback in callbacks:
+                with self.subTest(user=user.username), self.assertNumQueries(1):
+                    callback()
+
+
+class DashboardTableTests(InventoryTestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.now = timezone.now().replace(microsecond=0)
+        # Thirty entries an hour apart, the newest with a quantity of 0 and each older one 10 more.
+        self.entries = [
+            self.add_inventory(
+                self.providers[i % 2], self.users[i % 2], self.now - timedelta(hours=i + 1), number=i * 10
+            )
+            for i in range(30)
+        ]
+        self.add_inventory(self.providers[0], self.users[0], self.now, item_type=PPEType.N95MASK)
+        self.user = User.objects.create_user("parent", "parent@example.com", organization=self.parent)
+        self.user = load_request_user(self.user.pk)
+
+    def table(self, page_current=0, sort_by=None, filter_query="", page_size=10):
+        return update_table(PPEType.GLOVES, None, page_current, sort_by or [], filter_query, page_size, user=self.user)
+
+    def numbers(self, rows):
+        return [row["number"] for row in rows]
+
+    def test_pages(self):
+        rows, style, page_count = self.table()
+        self.assertEqual(page_count, 3)
+        self.assertEqual(self.numbers(rows), list(range(0, 100, 10)))
+        self.assertEqual({column["id"] for column in TABLE_COLUMNS}, set(rows[0]))
+        self.assertEqual(rows[0]["organization__name"], "Provider 0")
+        self.assertEqual(rows[0]["readable_ppe_type"], "Gloves")
+
+        rows, style, page_count = self.table(page_current=2)
+        self.assertEqual(self.numbers(rows), list(range(200, 300, 10)))
+        # Past the last page, the last page is shown.
+        self.assertEqual(self.table(page_current=5)[0], rows)
+        # No request reads more than TABLE_MAX_PAGE_SIZE rows.
+        self.assertEqual(len(self.table(page_size=1000)[0]), 30)
+        self.assertEqual(self.table(page_size=1000)[2], 1)
+
+    def test_sort(self):
+        rows = self.table(sort_by=[{"column_id": "number", "direction": "asc"}])[0]
+        self.assertEqual(self.numbers(rows), list(range(0, 100, 10)))
+        rows = self.table(sort_by=[{"column_id": "number", "direction": "desc"}])[0]
+        self.assertEqual(self.numbers(rows), list(range(290, 190, -10)))
+        rows = self.table(sort_by=[{"column_id": "organization__name", "direction": "desc"}], page_size=15)[0]
+        self.assertEqual({row["organization__name"] for row in rows}, {"Provider 1"})
+        # Columns that cannot be sorted keep the default order.
+        rows = self.table(sort_by=[{"column_id": "readable_ppe_type", "direction": "desc"}])[0]
+        self.assertEqual(self.numbers(rows), list(range(0, 100, 10)))
+
+    def test_split_filter_part(self):
+        self.assertEqual(split_filter_part("{number} > 100"), ("number", "gt", "100"))
+        self.assertEqual(split_filter_part("{number} ge 100"), ("number", "gte", "100"))
+        self.assertEqual(split_filter_part("{number} != 5"), ("number", "ne", "5"))
+        self.assertEqual(
+            split_filter_part('{comments} contains "said \\"hi\\""'), ("comments", "icontains", 'said "hi"')
+        )
+        self.assertEqual(
+            split_filter_part("{timestamp__date} datestartswith 2020-01"), ("timestamp__date", "startswith", "2020-01")
+        )
+        self.assertIsNone(split_filter_part("number > 100"))
+        self.assertIsNone(split_filter_part("{number}"))
+
+    def test_filters(self):
+        rows, style, page_count = self.table(filter_query="{number} > 200")
+        self.assertEqual(page_count, 1)
+        self.assertEqual(self.numbers(rows), list(range(210, 300, 10)))
+
+        rows = self.table(filter_query="{number} <= 100 && {organization__name} contains 1")[0]
+        self.assertEqual(self.numbers(rows), [10, 30, 50, 70, 90])
+        rows = self.table(filter_query="{number} eq 50")[0]
+        self.assertEqual(self.numbers(rows), [50])
+
+        # Submission dates are matched on the day in the current timezone.
+        day = timezone.localdate(self.entries[0].timestamp)
+        expected = [entry.number for entry in self.entries if timezone.localdate(entry.timestamp) == day]
+        rows = self.table(filter_query="{timestamp__date} datestartswith " + day.isoformat(), page_size=30)[0]
+        self.assertEqual(self.numbers(rows), expected)
+        rows = self.table(filter_query="{timestamp__date} < " + day.isoformat(), page_size=30)[0]
+        self.assertEqual(self.numbers(rows), [number for number in range(0, 300, 10) if number not in expected])
+
+        # Clauses that are malformed, or on columns that cannot be filtered, are left out.
+        for filter_query in ["{number} > many", "{readable_ppe_type} = Masks", "{timestamp__date} datestartswith x"]:
+            with self.subTest(filter_query=filter_query):
+                self.assertEqual(self.table(filter_query=filter_query)[2], 3)
+
+    def test_over_projected_rows_are_highlighted(self):
+        # 16 a day projected is more than 50% above 10 a day used, 12 is not.
+        Inventory.objects.filter(pk=self.entries[2].pk).update(projected_daily_use=16)
+        rows, style, page_count = self.table()
+        self.assertEqual(style, [{"if": {"row_index": 2}, "backgroundColor": "#FF6848", "color": "white"}])
+        self.assertNotIn("over_projected", rows[2])
+
+
+class DownsamplingTests(TestCase):
+    def test_short_series_are_kept_whole(self):
+        x = list(range(10))
+        self.assertEqual(lttb(x, x, 10), x)
+        self.assertEqual(lttb(x, x, 50), x)
+        self.assertEqual(lttb(x, x, 2), x)
+        self.assertEqual(lttb([], [], 5), [])
+
+    def test_budget_and_endpoints(self):
+        x = list(range(1000))
+        y = [(i * 37) % 101 for i in x]
+        for threshold in [3, 10, 100, 999]:
+            with self.subTest(threshold=threshold):
+                indices = lttb(x, y, threshold)
+                self.assertEqual(len(indices), threshold)
+                self.assertEqual((indices[0], indices[-1]), (0, 999))
+                self.assertEqual(indices, sorted(set(indices)))
+
+    def test_peaks_and_dips_are_kept(self):
+        x = list(range(1000))
+        y = [100] * 1000
+        y[537], y[212] = 5000, -5000
+        indices = lttb(x, y, 20)
+        self.assertIn(537, indices)
+        self.assertIn(212, indices)
+
+    @override_settings(DASHBOARD_CHART_POINTS=50)
+    def test_downsample(self):
+        start = date(2018, 1, 1)
+        data = [{"day": start + timedelta(days=i), "number": i % 7} for i in range(1000)]
+        points = downsample(data, "number", None)
+        self.assertEqual(len(points), 50)
+        self.assertEqual((points[0], points[-1]), (data[0], data[-1]))
+
+        # Zoomed in, only the days in range are drawn, and one either side so the line runs off the chart's edges.
+        zoom_range = parse_zoom_range({"xaxis.range[0]": "2019-01-01 00:00", "xaxis.range[1]": "2019-01-31 12:00"})
+        self.assertEqual(zoom_range, (date(2019, 1, 1), date(2019, 1, 31)))
+        points = downsample(data, "number", zoom_range)
+        self.assertEqual(
+            [point["day"] for point in points], [date(2018, 12, 31) + timedelta(days=i) for i in range(33)]
+        )
+
+        # A zoom still wider than the budget is downsampled too.
+        points = downsample(data, "number", (date(2018, 3, 1), date(2019, 3, 1)))
+        self.assertEqual(len(points), 50)
+        self.assertEqual((points[0]["day"], points[-1]["day"]), (date(2018, 2, 28), date(2019, 3, 2)))
+
+    def test_parse_zoom_range(self):
+        self.assertIsNone(parse_zoom_range(None))
+        self.assertIsNone(parse_zoom_range({"xaxis.autorange": True}))
+        self.assertIsNone(parse_zoom_range({"xaxis.range": ["soon", "later"]}))
+        self.assertEqual(
+            parse_zoom_range({"xaxis.range": ["2020-02-01", "2020-03-01 06:00:00.5"]}),
+            (date(2020, 2, 1), date(2020, 3, 1)),
+        )
+
+
+class CompactionTests(InventoryTestCase):
+    def setUp(self):
+        # Three entries on January 10th in New York, then one the next day, and one for the other provider.
+        self.day = [
+            self.add_inventory(
+                self.providers[0], self.users[0], datetime(2020, 1, 10, hour, tzinfo=timezone.utc), number=number
+            )
+            for hour, number in [(14, 300), (16, 200), (18, 100)]
+        ]
+        self.next_day = self.add_inventory(
+            self.providers[0], self.users[0], datetime(2020, 1, 11, 15, tzinfo=timezone.utc), number=50
+        )
+        self.other = self.add_inventory(
+            self.providers[1], self.users[1], datetime(2020, 1, 10, 15, tzinfo=timezone.utc), number=70
+        )
+        self.recent = self.add_inventory(self.providers[1], self.users[1], timezone.now(), number=60)
+        self.before = datetime(2020, 2, 1, tzinfo=timezone.utc)
+
+    def derived(self):
+        InventoryDailyRollup.objects.rebuild()
+        CurrentInventory.objects.rebuild()
+        return (
+            list(InventoryDailyRollup.objects.order_by("organization", "item_type", "day").values(*ROLLUP_VALUES)),
+            list(CurrentInventory.objects.order_by("organization", "ppetype").values(*CURRENT_VALUES)),
+        )
+
+    def test_rollups_and_current_inventory_are_rebuilt_the_same(self):
+        before = self.derived()
+        compact_entries(self.before)
+        self.assertEqual(self.derived(), before)
+
+    def test_a_day_split_across_batches_is_one_summary(self):
+        report = compact_entries(self.before, batch_size=2)
+        self.assertEqual(report["entries"], 5)
+        self.assertEqual(report["summaries"], 3)
+        summary = InventoryDailySummary.objects.get(organization=self.providers[0], day=date(2020, 1, 10))
+        self.assertEqual(summary.entries, 3)
+        self.assertEqual(summary.total_number, 600)
+        self.assertEqual(
+            (summary.pk, summary.number, summary.timestamp), (self.day[-1].pk, 100, self.day[-1].timestamp)
+        )
+        self.assertEqual(list(Inventory.objects.values_list("pk", flat=True)), [self.recent.pk])
+
+    def test_exports_return_the_compacted_day_from_the_summaries(self):
+        compact_entries(self.before)
+        output = io.BytesIO()
+        write_export(self.parent, "csv", output)
+        rows = list(csv.DictReader(io.StringIO(output.getvalue().decode())))
+        # The day's last entry stands in for the day.
+        self.assertEqual(
+            sorted((row["Organization"], row["Quantity"]) for row in rows),
+            [("Provider 0", "100"), ("Provider 0", "50"), ("Provider 1", "60"), ("Provider 1", "70")],
+        )
+
+        queryset, cursor = get_incremental_queryset(self.parent)
+        self.assertIs(queryset.model, InventoryDailySummary)
+        self.assertEqual(
+            list(queryset.values_list("pk", flat=True)), [self.other.pk, self.day[-1].pk, self.next_day.pk]
+        )
+        # A client that had seen the day's last entry before it was compacted isn't given the day again.
+        queryset, cursor = get_incremental_queryset(self.parent, since=(self.day[-1].timestamp, self.day[-1].pk))
+        self.assertEqual(list(queryset.values_list("pk", flat=True)), [self.next_day.pk])
+        queryset, cursor = get_incremental_queryset(self.parent, since=decode_cursor(cursor, high_water=True))
+        self.assertIs(queryset.model, Inventory)
+        self.assertEqual(list(queryset.values_list("pk", flat=True)), [self.recent.pk])
+
+    def test_the_latest_entry_of_each_provider_and_ppe_type_is_kept(self):
+        compact_entries(self.before, batch_size=1)
+        compact_entries(timezone.now() + timedelta(days=1), batch_size=1)
+        self.assertFalse(Inventory.objects.exists())
+        # Every entry is compacted, yet the latest of each provider and PPE type is still there, with its own id.
+        latest = {
+            (summary.organization_id, summary.ppetype_id): (summary.pk, summary.number)
+            for summary in InventoryDailySummary.objects.order_by("timestamp", "pk")
+        }
+        self.assertEqual(
+            latest,
+            {
+                (self.providers[0].pk, self.next_day.ppetype_id): (self.next_day.pk, 50),
+                (self.providers[1].pk, self.recent.ppetype_id): (self.recent.pk, 60),
+            },
+        )
+
+
+class IncrementalExportTests(InventoryTestCase):
+    def setUp(self):
+        self.first = [
+            self.add_inventory(self.providers[0], self.users[0], datetime(2020, 6, day, tzinfo=timezone.utc)).pk
+            for day in [1, 2]
+        ]
+
+    def export(self, cursor, limit=None):
+        """Returns the ids an incremental export from a cursor gives, and the cursor to pass next."""
+        since = decode_cursor(cursor, high_water=True) if cursor else None
+        queryset, cursor = get_incremental_queryset(self.parent, since=since, limit=limit)
+        return list(queryset.values_list("pk", flat=True)), cursor
+
+    def ingest(self, *timestamps):
+        """Ingests an entry submitted at each of the timestamps, returning their ids."""
+        rows = [
+            {"item_type": PPEType.GLOVES, "item_attribute": "Nitrile", "size": "M", "number": "5", "timestamp": day}
+            for day in timestamps
+        ]
+        ingest_inventory(enumerate(rows, start=2), self.users[0])
+        return list(Inventory.objects.order_by("-pk").values_list("pk", flat=True)[: len(timestamps)])[::-1]
+
+    def test_backdated_entries_are_returned_by_the_next_call(self):
+        ids, cursor = self.export("")
+        self.assertEqual(ids, self.first)
+        added = self.ingest("2020-05-31 12:00", "2020-05-30 12:00", "2020-06-03 12:00")
+        # The entries dated behind the cursor come first, in the order they were added, then the newer one.
+        ids, cursor = self.export(cursor)
+        self.assertEqual(ids, added[:2])
+        ids, cursor = self.export(cursor)
+        self.assertEqual(ids, added[2:])
+        self.assertEqual(self.export(cursor), ([], cursor))
+
+    def test_backdated_entries_are_paged_by_the_limit(self):
+        ids, cursor = self.export("")
+        added = self.ingest("2020-05-31 12:00", "2020-05-30 12:00", "2020-05-29 12:00")
+        pages = []
+        while True:
+            ids, cursor = self.export(cursor, limit=2)
+            if not ids:
+                break
+            pages.append(ids)
+        self.assertEqual(pages, [added[:2], added[2:]])
+
+    def test_backdated_entries_are_found_once_archived(self):
+        ids, cursor = self.export("")
+        [added] = self.ingest("2020-05-31 12:00")
+        archive_entries(datetime(2020, 6, 1, tzinfo=timezone.utc))
+        self.assertTrue(InventoryArchive.objects.filter(pk=added).exists())
+        self.assertEqual(self.export(cursor)[0], [added])
+
+    def test_cursors_without_a_high_water_mark_still_work(self):
+        ids, cursor = self.export("", limit=1)
+        timestamp, pk = decode_cursor(cursor)
+        self.assertEqual(self.export(encode_cursor(timestamp, pk))[0], self.first[1:])
+
+
+class ProviderIdsTests(InventoryTestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def test_providers_below_an_organization(self):
+        provider_ids = [provider.pk for provider in self.providers]
+        self.assertEqual(self.parent.get_provider_ids(), provider_ids)
+        self.assertEqual(self.providers[1].get_provider_ids(), provider_ids[1:])
+        self.assertEqual(self.parent.get_provider_ids(selected=[provider_ids[1], self.parent.pk, 0]), provider_ids[1:])
+        self.assertEqual(self.parent.get_provider_ids(selected=[]), [])
+        # Cached, only the organizations version is read.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.parent.get_provider_ids(), provider_ids)
+        version = get_organizations_version()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.parent.get_provider_ids(organizations_version=version), provider_ids)
+
+    def test_moved_providers_are_found_under_their_new_parent(self):
+        other = Organization.objects.create(name="Other", is_provider=False)
+        region = Organization.objects.create(name="Region", is_provider=False, parent=self.parent)
+        self.assertEqual(self.parent.get_provider_ids(), [provider.pk for provider in self.providers])
+        self.assertEqual(other.get_provider_ids(), [])
+
+        # Moved down the tree, the provider is still below the parent.
+        moved = Organization.objects.get(pk=self.providers[1].pk)
+        moved.parent = region
+        moved.save()
+        self.assertEqual(self.parent.get_provider_ids(), [provider.pk for provider in self.providers])
+        self.assertEqual(region.get_provider_ids(), [moved.pk])
+
+        # Moved to another tree, with the region, it isn't. The parent's tree fields, as loaded, are out of date now.
+        region = Organization.objects.get(pk=region.pk)
+        region.parent = other
+        region.save()
+        self.assertEqual(self.parent.get_provider_ids(), [self.providers[0].pk])
+        self.assertEqual(other.get_provider_ids(), [moved.pk])
+        self.assertEqual(region.get_provider_ids(), [moved.pk])
+
+
+class OrgSelectorTests(InventoryTestCase):
+    def test_renamed_providers_are_found_by_their_new_name(self):
+        self.assertEqual(
+            len(search_org_selector_options(self.parent, get_organizations_version(), "provider")), 2
+        )
+        self.providers[0].name = "Renamed"
+        self.providers[0].save()
+        self.assertEqual(
+            search_org_selector_options(self.parent, get_organizations_version(), "ren"),
+            [{"label": "Renamed", "value": self.providers[0].pk}],
+        )
+
+
+class IngestTests(InventoryTestCase):
+    def test_rows_older_than_the_newest_inventory_are_reported_as_backdated(self):
+        self.add_inventory(self.providers[0], self.users[0], datetime(2020, 6, 1, tzinfo=timezone.utc))
+        rows = [
+            {"item_type": PPEType.GLOVES, "item_attribute": "Nitrile", "size": "M", "number": "5", "timestamp": day}
+            for day in ["2020-05-31 12:00", "2020-06-02 12:00", None]
+        ]
+        report = ingest_inventory(enumerate(rows, start=2), self.users[0])
+        self.assertEqual(report.created, 3)
+        self.assertEqual(report.as_dict()["backdated"], 1)
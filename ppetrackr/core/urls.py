@@ -8,6 +8,11 @@ urlpatterns = [
     path("", views.index_view, name="index_view"),
     path("home/", views.home_view, name="home_view"),
     path("home/inventory/", views.inventory_list_view, name="inventory_list_view"),
+    path(
+        "api/inventory/ingest/",
+        views.ingest_inventory_view,
+        name="ingest_inventory_view",
+    ),
     path("home/onboard/", views.onboard_view, name="onboard_view"),
     path(
         "home/onboard/connect/", views.onboard_connect_view, name="onboard_connect_view"
@@ -79,9 +84,19 @@ urlpatterns = [
         name="track_face_mask_view",
     ),
     path("dashboard/", views.dashboard_view, name="dashboard_view"),
+    path(
+        "dashboard/cache-stats/",
+        views.dashboard_cache_stats_view,
+        name="dashboard_cache_stats_view",
+    ),
     path(
         "dashboard/download",
         views.download_dashboard_view,
         name="download_dashboard_view",
     ),
+    path(
+        "dashboard/download/<str:job_id>/",
+        views.export_job_view,
+        name="export_job_view",
+    ),
 ]
@@ -1,21 +1,47 @@
-import csv
 from datetime import datetime
-from io import BytesIO
+from tempfile import TemporaryFile
 
-import xlsxwriter as xlsxwriter
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.mail import send_mail
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.http import Http404, StreamingHttpResponse
+from django.db import transaction
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import redirect, render
 from django.template.loader import render_to_string
+from django.urls import reverse
 from django.views import View
-
-from .decorators import onboard_pending, onboard_required
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .cache import bump_data_version, result_cache
+from .decorators import basic_auth_required, onboard_pending, onboard_required
+from .export_jobs import (
+    MISSING,
+    READY,
+    get_job_error,
+    get_job_status,
+    open_artifact,
+    parse_job_id,
+    start_export,
+)
+from .exports import (
+    EXPORT_CONTENT_TYPES,
+    decode_cursor,
+    get_incremental_queryset,
+    iter_export_rows,
+    stream_csv,
+    write_export,
+)
 from .forms import (
     CustomUserCreationForm,
     OnboardConnectForm,
@@ -28,7 +54,22 @@ from .forms import (
     TrackMaskModelFormset,
     TrackSwabModelFormset,
 )
-from .models import Inventory, PPEType
+from .ingest import (
+    INGEST_CONTENT_TYPES,
+    ingest_inventory,
+    iter_csv_rows,
+    iter_ndjson_rows,
+    open_ingest_stream,
+)
+from .models import (
+    CurrentInventory,
+    Inventory,
+    InventoryDailyRollup,
+    InventoryForecast,
+    PPEType,
+)
+from .pagination import KeysetPage, approximate_count
+from .retention import raw_history_start
 
 
 def index_view(request):
@@ -41,7 +82,7 @@ def error_404_view(request, exception):
     return render(request, "core/404.html", ctx, status=404)
 
 
-def error_500_view(request, exception):
+def error_500_view(request):
     ctx = {}
     return render(request, "core/500.html", ctx, status=500)
 
@@ -78,7 +119,7 @@ def onboard_connect_view(request):
         if form.is_valid():
             organization = form.cleaned_data["organization"]
             request.user.organization = organization
-            request.user.save()
+            request.user.save(update_fields=["organization"])
             messages.success(request, "You have joined {}".format(organization.name))
             return redirect("home_view")
     ctx = {"form": form}
@@ -95,7 +136,7 @@ def onboard_new_provider_view(request):
             organization.is_provider = True
             organization.save()
             request.user.organization = organization
-            request.user.save()
+            request.user.save(update_fields=["organization"])
             msg_plain = render_to_string(
                 "registration/provider_organization_code.txt", {"user": request.user}
             )
@@ -126,7 +167,7 @@ def onboard_new_parent_view(request):
             organization.is_provider = False
             organization.save()
             request.user.organization = organization
-            request.user.save()
+            request.user.save(update_fields=["organization"])
             msg_plain = render_to_string(
                 "registration/admin_organization_code.txt", {"user": request.user}
             )
@@ -183,12 +224,20 @@ class TrackInventoryView(LoginRequiredMixin, View):
         return ""
 
     def get_formset(self, *args, **kwargs):
+        # Look the PPE types up once for the whole formset, rather than once per form.
+        kwargs["form_kwargs"] = {
+            "ppetypes": PPEType.objects.filter(item_type=self.ppe_type).in_bulk()
+        }
         return self.PPE_FORMSET_DICT[self.ppe_type](*args, **kwargs)
 
     def _get_recent_items(self, user, ppe_item_type):
-        recent_items = Inventory.objects.filter(
-            organization=user.organization, ppetype__item_type=ppe_item_type
-        ).order_by("-timestamp")[:5]
+        recent_items = (
+            Inventory.objects.filter(
+                organization=user.organization, item_type=ppe_item_type
+            )
+            .select_related("ppetype", "user")
+            .order_by("-timestamp")[:5]
+        )
         return recent_items
 
     def get(self, request, *args, **kwargs):
@@ -202,11 +251,22 @@ class TrackInventoryView(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
         formset = self.get_formset(request.POST)
         if formset.is_valid():
+            instances = []
             for form in formset:
                 instance = form.save(commit=False)
                 instance.user = request.user
                 instance.organization = request.user.organization
-                instance.save()
+                # bulk_create() doesn't call save(), which would otherwise copy this.
+                instance.item_type = instance.ppetype.item_type
+                instances.append(instance)
+            # One batched insert, and one update of the current inventory, rollups and forecasts, for the whole
+            # submission.
+            with transaction.atomic():
+                Inventory.objects.bulk_create(instances)
+                CurrentInventory.objects.record(instances)
+                InventoryDailyRollup.objects.record(instances)
+                InventoryForecast.objects.compute([request.user.organization])
+            bump_data_version(request.user.organization)
             messages.success(
                 request,
                 "You have submitted an update for {} different type(s) of {}".format(
@@ -228,117 +288,180 @@ def dashboard_view(request):
     return render(request, "core/dashboard.html", ctx)
 
 
+@staff_member_required
+def dashboard_cache_stats_view(request):
+    """Reports the hit and miss counts of the dashboard result cache."""
+    return JsonResponse(result_cache.stats())
+
+
 @login_required
 @onboard_required
 def inventory_list_view(request):
+    """Lists the organization's inventory since raw_history_start(), newest first, a page at a time. Pages are linked
+    by ?after=<cursor> and ?before=<cursor> rather than page numbers, so that deep pages are as quick as the first
+    one. Older inventory is archived or compacted and left to the exports, which the page says."""
+    since = raw_history_start()
     inventory_qs = Inventory.objects.filter(
-        organization=request.user.organization
-    ).order_by("-timestamp")
-    page_num = request.GET.get("page", 1)
-
-    paginator = Paginator(inventory_qs, 15)
+        organization=request.user.organization, timestamp__gte=since
+    ).select_related("ppetype", "user")
     try:
-        inventory_list = paginator.page(page_num)
-    except PageNotAnInteger:
-        inventory_list = paginator.page(1)
-    except EmptyPage:
-        inventory_list = paginator.page(paginator.num_pages)
+        after = decode_cursor(request.GET["after"]) if request.GET.get("after") else None
+        before = decode_cursor(request.GET["before"]) if request.GET.get("before") else None
+    except ValueError:
+        after = before = None
+    inventory_list = KeysetPage(
+        inventory_qs, settings.INVENTORY_LIST_PAGE_SIZE, after=after, before=before
+    )
 
     ctx = {
         "inventory_list": inventory_list,
+        "since": since,
     }
+    if settings.INVENTORY_LIST_COUNT_LIMIT:
+        ctx["total"], ctx["total_is_lower_bound"] = approximate_count(
+            inventory_qs, settings.INVENTORY_LIST_COUNT_LIMIT
+        )
     return render(request, "core/inventory_list.html", ctx)
 
 
-class PseudoBuffer:
-    """This is basically a mockup of the write file format that Python expects. You can use this to work with Django
-    StreamingHttpResponses"""
+@csrf_exempt
+@require_POST
+@basic_auth_required
+def ingest_inventory_view(request):
+    """Adds inventory to the user's organization in bulk, for systems that push their stock levels automatically. The
+    request body is CSV with a header row, or newline-delimited JSON objects, chosen by ?format=csv|ndjson or else by
+    the Content-Type, and may be gzipped (with Content-Encoding: gzip). Each row gives an item_type, item_attribute and
+    size naming the PPE type, a number, and optionally the other inventory fields and a timestamp. The column titles of
+    the CSV export are accepted too.
+
+    The body is read and inserted in batches as it arrives. Rows that aren't valid are skipped, and the response is a
+    JSON report of how many rows were created and rejected and what was wrong with each rejected row (by line). It
+    also counts the rows that were backdated, with a timestamp before the organization's newest inventory: incremental
+    exports from cursors handed out earlier return those on their next call, ahead of newer inventory."""
+    file_format = request.GET.get("format")
+    if file_format is None:
+        content_type = request.content_type
+        for name, ingest_content_type in INGEST_CONTENT_TYPES.items():
+            if content_type == ingest_content_type:
+                file_format = name
+    if file_format not in INGEST_CONTENT_TYPES:
+        return HttpResponseBadRequest(
+            "Send CSV or newline-delimited JSON, with ?format=csv|ndjson or a Content-Type of {}.".format(
+                " or ".join(INGEST_CONTENT_TYPES.values())
+            )
+        )
+
+    stream = open_ingest_stream(
+        request, compressed=request.META.get("HTTP_CONTENT_ENCODING") == "gzip"
+    )
+    if file_format == "csv":
+        rows = iter_csv_rows(stream)
+    else:
+        rows = iter_ndjson_rows(stream)
+    report = ingest_inventory(rows, request.user)
+    return JsonResponse(report.as_dict(), status=400 if report.error else 200)
+
+
+def _export_filename(user, file_format):
+    dt = user.timezone.fromutc(datetime.utcnow())
+    y, m, d = dt.year, dt.month, dt.day
+    return f"ppetrackr_data__{y}-{m:02d}-{d:02d}.{file_format}"
+
 
-    def write(self, v):
-        return v
+def _export_file_response(request, job_id, file_format):
+    return FileResponse(
+        open_artifact(job_id),
+        as_attachment=True,
+        filename=_export_filename(request.user, file_format),
+        content_type=EXPORT_CONTENT_TYPES[file_format],
+    )
+
+
+def _incremental_export_response(request, file_format):
+    try:
+        since = request.GET["since"]
+        since = decode_cursor(since, high_water=True) if since else None
+        limit = int(request.GET["limit"]) if request.GET.get("limit") else None
+    except ValueError:
+        return HttpResponseBadRequest("Invalid since cursor or limit.")
+    if limit is not None and limit < 1:
+        return HttpResponseBadRequest("Invalid since cursor or limit.")
+
+    queryset, next_cursor = get_incremental_queryset(
+        request.user.organization, since=since, limit=limit
+    )
+    filename = _export_filename(request.user, file_format)
+    content_type = EXPORT_CONTENT_TYPES[file_format]
+    if file_format == "csv":
+        response = StreamingHttpResponse(
+            stream_csv(iter_export_rows(queryset)), content_type=content_type
+        )
+        response["Content-Disposition"] = f"attachment; filename={filename}"
+    else:
+        output = TemporaryFile()
+        write_export(
+            request.user.organization, file_format, output, queryset=queryset
+        )
+        output.seek(0)
+        response = FileResponse(
+            output, as_attachment=True, filename=filename, content_type=content_type
+        )
+    response["X-Next-Cursor"] = next_cursor
+    return response
 
 
 @login_required
 @onboard_required
 def download_dashboard_view(request):
-    """This view provides a file, via the ?format=<filetype> interface. Options are 'csv' and 'xlsx'. When
-    possible, it uses streaming HTTP responses in order to prevent timeouts from dropping large file transfers."""
+    """This view provides a file, via the ?format=<filetype> interface. Options are 'csv', 'xlsx', and the columnar
+    'parquet' and 'arrow'. Exports are built by a background job and cached until new inventory is submitted, so if
+    the current export is already built it is sent straight away, otherwise the user is sent to the job's page to wait
+    for it.
 
-    file_format = request.GET["format"]
+    Passing ?since=<cursor> instead exports only the inventory submitted after the cursor (everything, for an empty
+    cursor), optionally at most ?limit=<rows> entries, in timestamp order. These are streamed directly rather than
+    cached, and the cursor to pass next time is returned in the X-Next-Cursor header. Inventory ingested or imported
+    later with an earlier timestamp than the cursor is returned by the next call from it, in id order, before
+    anything newer."""
 
-    # I'm sure there's a better way of doing this but this is how I did it this time. The first value in each pair is
-    # the pretty title text for the header of the spreadsheet. The second value is a lambda function which helps you to
-    # navigate to the attributes and sub-attributes where the field value is stored under each DB entry.
-    headers = [
-        ["Organization", lambda x: x.organization.name],
-        ["Item Category", lambda x: dict(x.ppetype.PPE_CHOICES)[x.ppetype.item_type]],
-        ["Model Number", lambda x: x.item_number],
-        ["Attribute", lambda x: x.ppetype.item_attribute],
-        ["Size", lambda x: x.ppetype.size],
-        ["Quantity", lambda x: x.number],
-        ["Daily Use", lambda x: x.daily_use],
-        ["Projected Daily Use", lambda x: x.projected_daily_use],
-        ["Projected Run-Out Date", lambda x: x.projected_run_out],
-        ["Date Submitted (UTC)", lambda x: x.timestamp],
-        ["Comments", lambda x: x.comments],
-    ]
+    file_format = request.GET["format"]
 
     if not request.user.organization:
         raise Http404(
             "User must become part of an organization to download inventory data."
         )
-    elif (
-        request.user.organization.is_provider
-    ):  # If the user is a solo provider, give them just their inventory.
-        db_data = list(Inventory.objects.filter(organization=request.user.organization))
-    else:  # If the user is an admin, give them the inventory of all of their child providers.
-        providers = request.user.organization.get_descendants().filter(is_provider=True)
-        db_data = list(Inventory.objects.filter(organization__in=providers))
-
-    data = [[v[0] for v in headers]]  # Put pretty titles into data
-
-    for (
-        entry
-    ) in (
-        db_data
-    ):  # Use lambda functions to turn each Inventory object into a cell value
-        new_row = [func(entry) for k, func in headers]
-        data.append(new_row)
-
-    if file_format == "csv":  # Create a CSV
-        writer = csv.writer(PseudoBuffer())
-        output = (writer.writerow(row) for row in data)
-        content_type = "text/csv"
-    elif file_format == "xlsx":  # Create an XLSX
-        output = BytesIO()
-        book = xlsxwriter.Workbook(output)
-        runout_date_format = book.add_format({"num_format": "yyyy-mm-dd"})
-        timestamp_format = book.add_format({"num_format": "yyyy-mm-dd hh:mm:ss.000"})
-        book.remove_timezone = True
-        sheet = book.add_worksheet()
-        for r_num, cols in enumerate(data):
-            for c_num, cell in enumerate(cols):
-                form = None
-                if c_num == 8:
-                    form = runout_date_format
-                elif c_num == 9:
-                    form = timestamp_format
-                if not form:
-                    sheet.write(r_num, c_num, cell)
-                else:
-                    sheet.write(r_num, c_num, cell, form)
-        book.close()
-        output.seek(0)
-        content_type = (
-            "application/vnd.openxmlformats-officedocument-spreadsheetml.sheet"
-        )
+    if file_format not in EXPORT_CONTENT_TYPES:
+        raise Http404("Unknown download format: {}".format(file_format))
 
-    # Generate the filename.
-    dt = request.user.timezone.fromutc(datetime.utcnow())
-    y, m, d = dt.year, dt.month, dt.day
-    filename = f"ppetrackr_data__{y}-{m:02d}-{d:02d}.{file_format}"
+    if "since" in request.GET:
+        return _incremental_export_response(request, file_format)
 
-    # Prepare the response and send it.
-    response = StreamingHttpResponse(output, content_type=content_type)
-    response["Content-Disposition"] = f"attachment; filename={filename}"
-    return response
+    job_id = start_export(request.user.organization, file_format)
+    if get_job_status(job_id) == READY:
+        return _export_file_response(request, job_id, file_format)
+    return redirect("export_job_view", job_id=job_id)
+
+
+@login_required
+@onboard_required
+def export_job_view(request, job_id):
+    """Sends the file of a finished export job, or a page that refreshes itself until the job is done."""
+    job = parse_job_id(job_id)
+    if not job or job[0] != request.user.organization.pk:
+        raise Http404("No such export.")
+    file_format = job[2]
+
+    status = get_job_status(job_id)
+    if status == READY:
+        return _export_file_response(request, job_id, file_format)
+    elif status == MISSING:  # Evicted or lost, start over with the current data.
+        return redirect(
+            "{}?format={}".format(reverse("download_dashboard_view"), file_format)
+        )
+    ctx = {
+        "job_id": job_id,
+        "status": status,
+        "error": get_job_error(job_id),
+        "file_format": file_format,
+    }
+    return render(request, "core/export_job.html", ctx, status=202)
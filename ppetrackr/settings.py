@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import tempfile
 
 import dj_database_url
 import sentry_sdk
@@ -160,6 +161,85 @@ STATICFILES_DIRS = (os.path.join(BASE_DIR, "static"),)
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = "/media/"
 
+# Dashboard exports are built by background worker threads and cached in this directory until new inventory is
+# submitted. The least recently used files are evicted once the directory grows past EXPORT_CACHE_MAX_BYTES, and a
+# build that hasn't written anything for EXPORT_JOB_TIMEOUT seconds is considered dead and is restarted.
+EXPORT_CACHE_DIR = os.environ.get(
+    "EXPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ppetrackr-exports")
+)
+EXPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+EXPORT_WORKERS = 2
+EXPORT_JOB_TIMEOUT = 15 * 60
+
+# How long (in seconds) the providers and inventory behind one dashboard interaction are cached, so that the tab
+# callbacks it fires can share them.
+DASHBOARD_INTERACTION_CACHE_TIMEOUT = 60
+
+# Rendered dashboard figures and tables are cached in the "dashboard" cache until new inventory is submitted in their
+# organization tree (or DASHBOARD_CACHE_TIMEOUT seconds pass). It is kept in memory, or in files shared by all of an
+# instance's processes when DASHBOARD_CACHE_DIR is set. Either way it holds at most DASHBOARD_CACHE_MAX_ENTRIES
+# results, evicting the least recently used ones first.
+#
+# The data versions that cached results are keyed on live in the database (see DataVersion), so new inventory is
+# shown straight away by every process and instance, whichever of them (or which management command) wrote it. The
+# caches themselves can therefore be per process. Sharing them only raises the hit rate, so deployments running more
+# than one worker should set DASHBOARD_CACHE_DIR, or point the "default" and dashboard caches at a shared backend
+# such as memcached.
+DASHBOARD_CACHE_ALIAS = "dashboard"
+DASHBOARD_CACHE_TIMEOUT = 24 * 60 * 60
+DASHBOARD_CACHE_MAX_ENTRIES = 2000
+
+# Rows per page of the inventory activity list, and how far its total is counted before it is shown as "more than"
+# that (set to None to not count at all).
+INVENTORY_LIST_PAGE_SIZE = 15
+INVENTORY_LIST_COUNT_LIMIT = 10000
+
+# How many days of inventory history the days-remaining forecasts are based on.
+FORECAST_WINDOW_DAYS = 14
+
+# Inventory from the last INVENTORY_HOT_MONTHS calendar months (this one included) is kept in the inventory table,
+# which is all the dashboard reads. The roll_inventory_partitions command, run daily, moves older inventory to the
+# archive, which only exports read. On Postgres 11 and later both tables are partitioned by month, with partitions
+# created INVENTORY_PARTITIONS_AHEAD months in advance.
+INVENTORY_HOT_MONTHS = 13
+INVENTORY_PARTITIONS_AHEAD = 3
+
+# The compact_inventory command, run daily, collapses the inventory submitted more than INVENTORY_RAW_RETENTION_DAYS
+# days ago into one summary per organization, PPE type and day. It must be longer than FORECAST_WINDOW_DAYS, which the
+# forecasts read raw inventory for, and the dashboard table only lists the raw inventory.
+INVENTORY_RAW_RETENTION_DAYS = 90
+
+# How long (in seconds) the list of a parent organization's providers offered in the dashboard's org-selector is
+# cached. It is rebuilt straight away when any organization is added, moved or renamed, so this only bounds how long
+# the lists of parents nobody is looking at are kept.
+ORG_SELECTOR_CACHE_TIMEOUT = 60 * 60
+
+# The most points a provider's history chart shows at once. Longer histories are downsampled to this many.
+DASHBOARD_CHART_POINTS = 500
+
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    DASHBOARD_CACHE_ALIAS: {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "dashboard",
+        "OPTIONS": {"MAX_ENTRIES": DASHBOARD_CACHE_MAX_ENTRIES},
+    },
+}
+
+if "DASHBOARD_CACHE_DIR" in os.environ:
+    CACHES[DASHBOARD_CACHE_ALIAS] = {
+        "BACKEND": "ppetrackr.core.cache.LRUFileBasedCache",
+        "LOCATION": os.environ["DASHBOARD_CACHE_DIR"],
+        "OPTIONS": {"MAX_ENTRIES": DASHBOARD_CACHE_MAX_ENTRIES},
+    }
+
+# Each request's user is loaded with their organization in one query. Django's own backend stays listed after it so
+# that sessions signed in through it before it was replaced stay signed in.
+AUTHENTICATION_BACKENDS = [
+    "ppetrackr.core.backends.ModelBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+
 LOGIN_URL = "/login/"
 LOGIN_REDIRECT_URL = "/home/"
 LOGOUT_REDIRECT_URL = "/"